@@ -3,10 +3,17 @@ API蓝图注册模块
 负责注册所有API路由蓝图
 """
 
+import logging
+
 from flask import Flask
 from api.dispatch import dispatch_bp
 from api.audit import audit_bp
 from api.company import company_bp
+from api.jobs import jobs_bp
+from api.backup import backup_bp
+from api.analytics import analytics_bp
+
+logger = logging.getLogger(__name__)
 
 def init_api_routes(app):
     """初始化所有API路由"""
@@ -19,10 +26,17 @@ def init_api_routes(app):
     # 注册公司API
     app.register_blueprint(company_bp)
     
-    # 打印注册成功的路由
-    if app.config.get('DEBUG', False):
-        print("✅ API路由注册完成")
-        print("📋 已注册的路由：")
+    # 注册后台任务API
+    app.register_blueprint(jobs_bp)
+    
+    # 注册数据库备份API
+    app.register_blueprint(backup_bp)
+    
+    # 注册派车分析API
+    app.register_blueprint(analytics_bp)
+    
+    # 输出已注册的路由（调试级别）
+    if logger.isEnabledFor(logging.DEBUG):
         for rule in app.url_map.iter_rules():
-            if rule.endpoint.startswith('dispatch.') or rule.endpoint.startswith('audit.') or rule.endpoint.startswith('company.'):
-                print(f"  - {rule.rule} [{', '.join(rule.methods)}]")
\ No newline at end of file
+            if rule.endpoint.split('.')[0] in ('dispatch', 'audit', 'company', 'jobs', 'backup', 'analytics'):
+                logger.debug(f"API路由: {rule.rule} [{', '.join(sorted(rule.methods))}]")
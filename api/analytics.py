@@ -0,0 +1,81 @@
+"""
+派车分析API模块 - 按维度上卷/下钻查询派车分析汇总（不扫描派车任务表）
+"""
+
+from datetime import date
+
+from flask import Blueprint, request, session
+from api.decorators import require_role, create_response
+from dispatch_rollup import (DIMENSIONS, LEAD_STAGES, MEASURES, TIME_DIMENSIONS, pending_days, query_rollup,
+                             refresh_job)
+from job_queue import get_job_manager
+
+analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
+
+# 汇总包含全部承运商的数据，不对车间地调和供应商开放
+ANALYTICS_ROLES = ['区域调度员', '超级管理员', '对账人员']
+
+
+@analytics_bp.route('/dimensions', methods=['GET'])
+@require_role(ANALYTICS_ROLES)
+def get_dimensions():
+    """可用维度、指标和环节时效定义"""
+    from app import get_db
+
+    return create_response(data={
+        'dimensions': DIMENSIONS,
+        'time_dimensions': TIME_DIMENSIONS,
+        'measures': MEASURES,
+        'lead_stages': {stage: {'from': start or '创建任务', 'to': end} for stage, (start, end) in LEAD_STAGES.items()},
+        'pending_days': pending_days(get_db())
+    })
+
+
+@analytics_bp.route('/rollup', methods=['GET'])
+@require_role(ANALYTICS_ROLES)
+def get_rollup():
+    """
+    按维度查询汇总
+
+    group_by 为逗号分隔的维度（如 month,carrier_company），为空时只返回合计；
+    维度名作为查询参数时按取值下钻（如 carrier_company=XX物流&status=任务结束）；
+    日期范围 date_from、date_to 默认为本月1日至今天
+    """
+    today = date.today()
+    date_from = request.args.get('date_from') or today.replace(day=1).isoformat()
+    date_to = request.args.get('date_to') or today.isoformat()
+    try:
+        if date.fromisoformat(date_from) > date.fromisoformat(date_to):
+            return create_response(success=False, error={
+                'code': 4001,
+                'message': '起始日期不能晚于截止日期'
+            }), 400
+    except ValueError:
+        return create_response(success=False, error={
+            'code': 4001,
+            'message': '日期格式错误，应为YYYY-MM-DD'
+        }), 400
+
+    group_by = [d.strip() for d in request.args.get('group_by', '').split(',') if d.strip()]
+    filters = {d: request.args[d].strip() for d in DIMENSIONS if request.args.get(d, '').strip()}
+    try:
+        from app import get_db
+        result = query_rollup(get_db(), date_from, date_to, group_by, filters)
+    except ValueError as e:
+        return create_response(success=False, error={
+            'code': 4001,
+            'message': str(e)
+        }), 400
+
+    return create_response(data={'date_from': date_from, 'date_to': date_to, 'group_by': group_by,
+                                 'filters': filters, **result})
+
+
+@analytics_bp.route('/refresh', methods=['POST'])
+@require_role(['超级管理员'])
+def refresh_rollup():
+    """提交后台任务重算全部待重算日期，{"full": true} 时从在途库和归档库重建全部日期"""
+    data = request.get_json(silent=True) or {}
+    job_id = get_job_manager().submit('dispatch_rollup_refresh', refresh_job, bool(data.get('full')),
+                                      created_by=session.get('user_id'))
+    return create_response(data={'job_id': job_id}), 202
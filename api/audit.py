@@ -6,6 +6,9 @@ from flask import Blueprint, request, jsonify, session
 from api.decorators import require_role, create_response
 from api.validators import validators
 from db_manager import DatabaseManager
+from constants import DispatchStatus
+from modules.reconciliation.feishu_sync import wake_dispatcher
+from modules.reconciliation.ledger import post_task_settlement
 from datetime import datetime
 
 audit_bp = Blueprint('audit', __name__, url_prefix='/api/dispatch')
@@ -289,7 +292,13 @@ def update_task_status(task_id):
                 VALUES (?, ?, ?, ?, ?)
             """, [task_id, status_change, current_role, datetime.now(), note])
             
+            # 任务结束时按运价入账（与状态变更在同一事务中）
+            if new_status == DispatchStatus.TASK_COMPLETED.value:
+                post_task_settlement(db_manager.conn, task_id, operator=current_role, note=note)
+            
             db_manager.conn.commit()
+            if new_status == DispatchStatus.TASK_COMPLETED.value:
+                wake_dispatcher()
             
             return create_response(data={
                 'task_id': task_id,
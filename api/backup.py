@@ -0,0 +1,73 @@
+"""
+数据库备份API模块 - 快照列表、创建、下载与恢复（仅超级管理员）
+"""
+
+from flask import Blueprint, current_app, session, send_file
+from api.decorators import require_role, create_response
+from backup_service import backup_job, get_snapshot, list_snapshots, restore_snapshot, snapshot_file_path
+from job_queue import get_job_manager
+
+backup_bp = Blueprint('backup', __name__, url_prefix='/api/backups')
+
+
+@backup_bp.route('', methods=['GET'])
+@require_role(['超级管理员'])
+def get_backups():
+    """获取快照列表"""
+    return create_response(data=list_snapshots())
+
+
+@backup_bp.route('', methods=['POST'])
+@require_role(['超级管理员'])
+def create_backup():
+    """提交后台任务创建快照"""
+    job_id = get_job_manager().submit('database_backup', backup_job, '手动', session.get('user_id'),
+                                      created_by=session.get('user_id'))
+    return create_response(data={'job_id': job_id}), 202
+
+
+@backup_bp.route('/<snapshot_id>/download', methods=['GET'])
+@require_role(['超级管理员'])
+def download_backup(snapshot_id):
+    """下载快照中的主库压缩文件"""
+    try:
+        path = snapshot_file_path(snapshot_id)
+    except ValueError:
+        path = None
+    if not path:
+        return create_response(success=False, error={
+            'code': 4004,
+            'message': '备份不存在'
+        }), 404
+
+    return send_file(path, as_attachment=True, download_name=f'database_{snapshot_id}.db.gz')
+
+
+@backup_bp.route('/<snapshot_id>/restore', methods=['POST'])
+@require_role(['超级管理员'])
+def restore_backup(snapshot_id):
+    """
+    从快照恢复数据库，恢复前自动为当前数据创建快照
+    直接在请求中执行：后台任务记录保存在被覆盖的数据库中，无法可靠跟踪
+    """
+    try:
+        if not get_snapshot(snapshot_id):
+            return create_response(success=False, error={
+                'code': 4004,
+                'message': '备份不存在'
+            }), 404
+        result = restore_snapshot(current_app.config['DATABASE'], snapshot_id, session.get('user_id'))
+    except ValueError as e:
+        return create_response(success=False, error={
+            'code': 4001,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return create_response(success=False, error={
+            'code': 5001,
+            'message': f'恢复备份失败: {str(e)}'
+        }), 500
+
+    # 会话表已清空，当前登录也随之失效
+    session.clear()
+    return create_response(data=result)
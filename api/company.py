@@ -3,38 +3,30 @@
 """
 
 from flask import Blueprint, jsonify, request
-global_db_manager = None
 
-def set_db_manager(db_manager):
-    """设置全局数据库管理器实例"""
-    global global_db_manager
-    global_db_manager = db_manager
+from company_directory import company_directory, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
 
 # 创建蓝图
 company_bp = Blueprint('company', __name__)
 
 @company_bp.route('/api/companies', methods=['GET'])
 def get_companies():
-    """获取所有公司列表"""
+    """
+    获取公司列表
+
+    无参数时返回全部公司；带 q 参数时按名称前缀、拼音首字母检索，limit 限制返回数量
+    """
     try:
-        # 获取数据库连接
-        db_manager = global_db_manager
-        if not db_manager or not db_manager.connect():
-            return jsonify({'error': '数据库连接失败'}), 500
-        
-        cursor = db_manager.cursor
-        
-        # 查询所有公司
-        cursor.execute('SELECT id, name FROM Company ORDER BY name')
-        companies = []
-        for row in cursor.fetchall():
-            companies.append({
-                'id': row[0],
-                'name': row[1]
-            })
-        
-        db_manager.disconnect()
-        return jsonify(companies)
+        from app import get_db
+        conn = get_db()
+
+        query = request.args.get('q', '').strip()
+        limit = request.args.get('limit', type=int)
+        if not query and limit is None:
+            return jsonify(company_directory.all(conn))
+
+        limit = min(max(limit or DEFAULT_SEARCH_LIMIT, 1), MAX_SEARCH_LIMIT)
+        return jsonify(company_directory.search(conn, query, limit))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -42,19 +34,12 @@ def get_companies():
 def get_company_id_by_name(company_name):
     """根据公司名称获取公司ID"""
     try:
-        # 获取数据库连接
-        db_manager = global_db_manager
-        if not db_manager or not db_manager.connect():
-            return jsonify({'error': '数据库连接失败'}), 500
-        
-        # 获取公司ID
-        company_id = db_manager.get_company_id_by_name(company_name)
-        
-        db_manager.disconnect()
-        
+        from app import get_db
+        company_id = company_directory.get_id(get_db(), company_name)
+
         if company_id is not None:
             return jsonify({'id': company_id})
         else:
             return jsonify({'error': '未找到指定公司'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
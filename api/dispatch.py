@@ -2,6 +2,9 @@ from flask import Blueprint, request, jsonify, session
 from api.decorators import require_role, create_response
 from api.utils import validate_dispatch_data, generate_task_id
 from db_manager import DatabaseManager
+from export_service import export_response, export_job, SUPPORTED_FORMATS
+from job_queue import get_job_manager
+from task_archive import ARCHIVE_SCHEMA, open_archive
 import datetime
 import sqlite3
 
@@ -134,7 +137,11 @@ def create_task():
 @dispatch_bp.route('/tasks', methods=['GET'])
 @require_role(['车间地调', '区域调度员', '超级管理员', '供应商'])
 def get_tasks():
-    """获取任务列表 - 根据用户角色返回不同的任务范围"""
+    """
+    获取任务列表 - 根据用户角色返回不同的任务范围
+
+    只查询主库中的在途与近期任务（工作队列），已归档任务通过 /reconciliation/api/tasks/search 查询
+    """
     try:
         # 获取查询参数
         page = int(request.args.get('page', 1))
@@ -272,7 +279,7 @@ def get_tasks():
 @dispatch_bp.route('/tasks/<task_id>', methods=['GET'])
 @require_role(['车间地调', '区域调度员', '超级管理员', '供应商'])
 def get_task_detail(task_id):
-    """获取单个任务详情"""
+    """获取单个任务详情（主库中不存在时查找已归档任务，返回的 archived 为 True）"""
     try:
         db_manager = DatabaseManager()
         if not db_manager.connect():
@@ -284,6 +291,13 @@ def get_task_detail(task_id):
         try:
             db_manager.cursor.execute('SELECT * FROM manual_dispatch_tasks WHERE task_id = ?', (task_id,))
             task = db_manager.cursor.fetchone()
+            history_table = 'dispatch_status_history'
+            if not task:
+                open_archive(db_manager.conn)
+                db_manager.cursor.execute(f'SELECT * FROM {ARCHIVE_SCHEMA}.archived_tasks WHERE task_id = ?',
+                                          (task_id,))
+                task = db_manager.cursor.fetchone()
+                history_table = f'{ARCHIVE_SCHEMA}.archived_status_history'
             
             if not task:
                 return create_response(success=False, error={
@@ -294,11 +308,12 @@ def get_task_detail(task_id):
             # 获取列名并构建任务数据字典
             columns = [description[0] for description in db_manager.cursor.description]
             task_data = dict(zip(columns, task))
+            task_data['archived'] = history_table != 'dispatch_status_history'
             
             # 获取状态历史
-            db_manager.cursor.execute('''
+            db_manager.cursor.execute(f'''
                 SELECT h.status_change as status, h.timestamp, h.operator as updated_by_id, h.note as notes, u.full_name as updated_by_name
-                FROM dispatch_status_history h
+                FROM {history_table} h
                 LEFT JOIN User u ON h.operator = u.id
                 WHERE h.task_id = ?
                 ORDER BY h.timestamp DESC
@@ -789,7 +804,7 @@ def delete_vehicle_capacity_reference(license_plate):
 @dispatch_bp.route('/statistics', methods=['GET'])
 @require_role(['车间地调', '区域调度员', '超级管理员', '供应商'])
 def get_statistics():
-    """获取任务统计信息"""
+    """获取任务统计信息（只统计主库中的在途与近期任务）"""
     try:
         db_manager = DatabaseManager()
         if not db_manager.connect():
@@ -902,3 +917,50 @@ def get_statistics():
             'code': 5001,
             'message': f'获取统计信息失败: {str(e)}'
         }), 500
+
+
+@dispatch_bp.route('/export/<kind>', methods=['GET'])
+@require_role(['区域调度员', '超级管理员'])
+def export_dispatch_data(kind):
+    """导出派车数据（task/history/vehicle），支持xlsx和csv格式"""
+    if kind not in ['task', 'history', 'vehicle']:
+        return create_response(success=False, error={
+            'code': 4001,
+            'message': f'不支持的导出类型: {kind}'
+        }), 400
+
+    file_format = request.args.get('format', 'xlsx')
+    if file_format not in SUPPORTED_FORMATS:
+        return create_response(success=False, error={
+            'code': 4001,
+            'message': f'不支持的导出格式: {file_format}'
+        }), 400
+
+    filters = {
+        name: request.args.get(name)
+        for name in ['status', 'carrier_company', 'task_id', 'license_plate', 'date_from', 'date_to']
+    }
+
+    try:
+        # 异步模式：提交后台任务，立即返回任务ID
+        if request.args.get('async') == '1':
+            job_id = get_job_manager().submit(f'{kind}_export', export_job, kind, file_format, filters,
+                                              created_by=session.get('user_id'))
+            return create_response(data={'job_id': job_id}), 202
+
+        db_manager = DatabaseManager()
+        if not db_manager.connect():
+            return create_response(success=False, error={
+                'code': 5001,
+                'message': '数据库连接失败'
+            }), 500
+
+        # 连接在数据读取完毕后释放（CSV为流式响应，读取发生在响应发送过程中）
+        return export_response(db_manager.conn, kind, file_format, filters,
+                               on_close=db_manager.disconnect)
+
+    except Exception as e:
+        return create_response(success=False, error={
+            'code': 5001,
+            'message': f'导出失败: {str(e)}'
+        }), 500
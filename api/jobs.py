@@ -0,0 +1,69 @@
+"""
+后台任务API模块 - 查询导入/导出等后台任务的状态、进度和结果文件
+"""
+
+from flask import Blueprint, session, send_file
+from api.decorators import require_role, create_response
+from job_queue import get_job_manager
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+ALL_ROLES = ['车间地调', '区域调度员', '超级管理员', '供应商', '对账人员']
+
+
+def _get_visible_job(job_id):
+    """获取当前用户可见的任务：本人提交的任务，超级管理员可查看全部"""
+    job = get_job_manager().get_job(job_id)
+    if not job:
+        return None
+    if session.get('user_role') != '超级管理员' and job['created_by'] != session.get('user_id'):
+        return None
+    return job
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@require_role(ALL_ROLES)
+def get_job(job_id):
+    """获取后台任务状态和进度"""
+    try:
+        job = _get_visible_job(job_id)
+        if not job:
+            return create_response(success=False, error={
+                'code': 4004,
+                'message': '任务不存在'
+            }), 404
+
+        return create_response(data={
+            'job_id': job['id'],
+            'job_type': job['job_type'],
+            'status': job['status'],
+            'progress_current': job['progress_current'],
+            'progress_total': job['progress_total'],
+            'message': job['message'],
+            'result': job['result'],
+            'error': job['error'],
+            'download_available': job['has_file'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at']
+        })
+
+    except Exception as e:
+        return create_response(success=False, error={
+            'code': 5001,
+            'message': f'获取任务状态失败: {str(e)}'
+        }), 500
+
+
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+@require_role(ALL_ROLES)
+def download_job_result(job_id):
+    """下载后台任务生成的结果文件"""
+    job = _get_visible_job(job_id)
+    if not job or not job['has_file']:
+        return create_response(success=False, error={
+            'code': 4004,
+            'message': '结果文件不存在'
+        }), 404
+
+    return send_file(job['result_file'], as_attachment=True, download_name=job['result_filename'])
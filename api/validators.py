@@ -6,6 +6,8 @@
 from datetime import datetime
 import re
 
+from constants import DispatchStatus
+
 class DispatchValidators:
     """派车任务验证器类"""
     
@@ -114,27 +116,17 @@ class DispatchValidators:
     @staticmethod
     def validate_status_update(data):
         """验证状态更新数据"""
-        required_fields = ['task_id', 'new_status', 'operator_role', 'operator_user_id']
+        # 操作人角色和ID取自会话，请求体只需提供目标状态
+        if not data or not data.get('new_status'):
+            return False, '缺少必填字段: new_status'
         
-        for field in required_fields:
-            if field not in data or not data.get(field):
-                return False, f'缺少必填字段: {field}'
-        
-        # 验证状态值
-        valid_statuses = [
-            '待提交', '待区域调度员审核', '待供应商响应',
-            '已响应', '已发车', '已到达', '已完成'
-        ]
+        # 验证状态值（与任务表的状态约束一致）
+        valid_statuses = DispatchStatus.all_values()
         
         new_status = data.get('new_status')
         if new_status not in valid_statuses:
             return False, f'状态必须是以下之一: {", ".join(valid_statuses)}'
         
-        # 验证操作人角色
-        valid_roles = ['车间地调', '区域调度员', '超级管理员', '供应商']
-        if data.get('operator_role') not in valid_roles:
-            return False, f'操作人角色必须是以下之一: {", ".join(valid_roles)}'
-        
         # 验证备注
         note = data.get('note', '')
         if len(note) > 200:
@@ -1,24 +1,27 @@
-print('=== 脚本开始执行 ===')
 import os
-import sys
-import traceback
 import sqlite3
-import logging
 from flask import Flask, g, request, session, redirect, url_for, render_template, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
-import traceback
+from security import verify_password, LoginBusyError, login_stats
 from functools import wraps
 import jinja2
+
+from startup import StartupReport
+startup_report = StartupReport()
 # 从配置文件导入数据库路径
-from config import DATABASE
+from config import DATABASE, LOG_LEVEL, LOG_FORMAT
+from logging_config import configure_logging
+
+# 尽早配置日志，后续模块导入时的日志也能按统一格式输出
+configure_logging(LOG_LEVEL, LOG_FORMAT)
 # 使用db_manager统一管理数据库初始化
 from db_manager import DatabaseManager
+from reference_cache import role_cache
+from api.decorators import require_role, create_response
 
 # 应用初始化
 from flask_login import LoginManager, UserMixin, login_required, current_user,login_user,logout_user    
 
 # 导入公司API并设置数据库管理器
-from api.company import set_db_manager as set_company_db_manager
 
 class User(UserMixin):
     def __init__(self, user_id, username, full_name, roles=None):
@@ -28,7 +31,8 @@ class User(UserMixin):
         self.roles = roles or []
         # 支持单一角色访问
         self.role = roles[0] if roles and roles[0] else None
-from config import SECRET_KEY
+from config import SECRET_KEY, SESSION_BACKEND, SESSION_LIFETIME, SESSION_MEMORY_MAX_ENTRIES
+from session_store import ServerSessionInterface, create_session_store
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
@@ -36,34 +40,31 @@ app.secret_key = SECRET_KEY
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'  # 设置登录页面路由
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME
+# 服务端会话：Cookie中只保存会话ID
+app.session_interface = ServerSessionInterface(
+    create_session_store(SESSION_BACKEND, db_path=DATABASE, max_entries=SESSION_MEMORY_MAX_ENTRIES)
+)
 # 加载配置到 app 中（关键步骤）
 app.config['DATABASE'] = DATABASE  # 确保这行代码存在
-
-# 再次打印调试，确认应用中已加载
-print("=== Flask 应用配置 ===")
-print(f"应用中的数据库路径: {app.config['DATABASE']}")  # 必须显示正确路径
-print(f"SECRET_KEY 是否设置: {bool(app.config['SECRET_KEY'])}")
-
-
-
-
-# 日志配置
-app.logger.setLevel(logging.DEBUG)
-
-
-
-# 在应用启动时初始化数据库
-with app.app_context():
-    DatabaseManager.init_database()
-    # 设置公司API的数据库管理器
-    set_company_db_manager(DatabaseManager())
+app.logger.debug(f"数据库路径: {app.config['DATABASE']}")
 
 
 # 数据库操作函数
+def store_auth_snapshot(user_id, username, full_name, user_role):
+    """将授权信息保存到会话中，后续请求无需再查询用户和角色"""
+    session['auth'] = {'id': user_id, 'username': username, 'full_name': full_name, 'role': user_role}
+    # 同步设置session以兼容权限检查
+    session['user_id'] = user_id
+    session['user_role'] = user_role
+
 @login_manager.user_loader
 def load_user(user_id):
+    # 优先使用会话中的授权快照
+    auth = session.get('auth')
+    if auth and str(auth['id']) == str(user_id):
+        return User(auth['id'], auth['username'], auth['full_name'], [auth['role']])
+
     db = get_db()
     user = db.execute('SELECT id, username, full_name FROM User WHERE id = ? AND is_active = 1', (user_id,)).fetchone()
     if user:
@@ -74,6 +75,8 @@ def load_user(user_id):
             WHERE ur.user_id = ?
         ''', (user_id,)).fetchone()
         user_role = role['name'] if role else None
+        # 通过记住我Cookie恢复登录时，重新建立授权快照
+        store_auth_snapshot(user['id'], user['username'], user['full_name'], user_role)
         # 使用单一角色创建用户对象
         return User(user['id'], user['username'], user['full_name'], [user_role])
     return None
@@ -102,13 +105,11 @@ def index():
 # 修复权限查询函数，使用正确的表名
 import sqlite3
 
-from db_manager import DatabaseManager
-
 def get_user_modules(user_id):
     """获取用户有权限访问的模块列表，支持父子模块结构"""
     db_manager = DatabaseManager()
     if not db_manager.connect():
-        print("数据库连接失败")
+        app.logger.error("数据库连接失败")
         return []
     cursor = db_manager.cursor
     try:
@@ -170,7 +171,7 @@ def get_user_modules(user_id):
         
         return root_modules
     except Exception as e:
-        print(f"获取用户模块权限时出错: {e}")
+        app.logger.error(f"获取用户模块权限时出错: {e}")
         return []
     finally:
         db_manager.disconnect()
@@ -181,23 +182,38 @@ def get_user_modules(user_id):
 def get_roles():
     """获取所有角色列表"""
     try:
-        db_manager = DatabaseManager()
-        if not db_manager.connect():
-            return jsonify({'error': '数据库连接失败'}), 500
-        cursor = db_manager.cursor
-        cursor.execute('SELECT id, name, description FROM Role ORDER BY id')
-        roles = []
-        for row in cursor.fetchall():
-            roles.append({
-                'id': row[0],
-                'name': row[1],
-                'description': row[2]
-            })
-        db_manager.disconnect()
+        roles = [
+            {'id': role['id'], 'name': role['name'], 'description': role['description']}
+            for role in role_cache.get(get_db())
+        ]
         return jsonify(roles)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 登录统计API
+@app.route('/api/login-stats')
+@login_required
+@require_role(['超级管理员'])
+def get_login_stats():
+    """获取登录次数、速率及密码校验耗时统计"""
+    return create_response(data=login_stats.snapshot())
+
+# SQL执行统计API
+@app.route('/api/query-stats')
+@login_required
+@require_role(['超级管理员'])
+def get_query_stats():
+    """按归一化语句汇总的SQL执行统计与慢查询计划"""
+    import query_profiler
+    if query_profiler.profiler is None:
+        return create_response(False, error='未启用SQL统计'), 404
+    report = query_profiler.profiler.report(
+        sort=request.args.get('sort', 'total_ms'),
+        limit=request.args.get('limit', 50, type=int),
+        slow_only=request.args.get('slow_only') == '1'
+    )
+    return create_response(data=report)
+
 # 修复角色权限查询API
 @app.route('/api/role-permissions/<int:role_id>')
 @login_required
@@ -262,7 +278,19 @@ def login():
         finally:
             cursor.close()
         
-        if user and check_password_hash(user['password'], password):
+        try:
+            valid, new_hash = verify_password(user['password'], password) if user else (False, None)
+        except LoginBusyError as e:
+            return str(e), 503
+        login_stats.record_attempt(valid)
+
+        if valid:
+            # 哈希参数已变更时按当前策略重新保存
+            if new_hash:
+                db.execute('UPDATE User SET password = ? WHERE id = ?', (new_hash, user['id']))
+                db.commit()
+                login_stats.record_rehash()
+
             # 获取用户角色（单一角色）
             role = db.execute('''
                 SELECT r.name FROM Role r
@@ -273,12 +301,12 @@ def login():
             
             # 创建用户对象并添加角色信息
             user_obj = User(user['id'], username, user['full_name'], [user_role])
+            # 登录后更换会话ID，防止会话固定
+            session.regenerate()
             # 使用Flask-Login进行登录
             login_user(user_obj, remember=True)
-            # 同步设置session以兼容权限检查
-            session['user_id'] = user['id']
-            session['user_role'] = user_role
-            print(f"用户 {username} 登录成功，角色: {user_role}")  # 调试日志
+            store_auth_snapshot(user['id'], username, user['full_name'], user_role)
+            app.logger.debug(f"用户 {username} 登录成功，角色: {user_role}")
             return redirect(url_for('dashboard'))
         
         return '用户名或密码错误'
@@ -287,7 +315,10 @@ def login():
 
 @app.route('/logout')
 def logout():
-    session.pop('user_id', None)
+    # logout_user 会同时清除记住我Cookie；会话清空后服务端记录随之删除
+    logout_user()
+    for key in ('auth', 'user_id', 'user_role'):
+        session.pop(key, None)
     return redirect(url_for('login'))
 
 @app.route('/debug/user')
@@ -343,45 +374,46 @@ def handle_template_not_found(e):
     return render_template('error.html', message='模板未找到'), 404
 
 # 数据库初始化
-def init_db():
-    """统一的数据库初始化入口，使用DatabaseManager"""
+def init_db(force=False):
+    """统一的数据库初始化入口：表结构已是当前版本时跳过"""
     try:
-        from db_manager import DatabaseManager
-        db_manager = DatabaseManager()
-        db_manager.create_tables()
-        app.logger.info('数据库初始化完成')
+        return DatabaseManager.init_database(app.config['DATABASE'], force=force)
     except Exception as e:
         app.logger.error(f'数据库初始化失败: {str(e)}')
         raise
 
 
+# 在应用启动时初始化数据库（每个进程只执行一次）
+with startup_report.phase('数据库初始化') as phase_info:
+    phase_info.update(init_db())
+
+
 
 
 
 # 导入并注册蓝图（如果存在）
-try:
-    # 延迟导入蓝图以避免循环依赖
-    from modules.system import system_bp
-    from modules.reconciliation import reconciliation_bp
-    from modules.scheduling import scheduling_bp
-    from modules.planning import planning_bp
-    from modules.cost_analysis import cost_analysis_bp
-    from modules.basic_data import basic_data_bp
-    from modules.user_management import user_management_bp
-    
-    app.register_blueprint(system_bp, url_prefix='/system')
-    app.register_blueprint(reconciliation_bp, url_prefix='/reconciliation')
-    app.register_blueprint(scheduling_bp, url_prefix='/scheduling')
-    app.register_blueprint(planning_bp, url_prefix='/planning')      
-    app.register_blueprint(cost_analysis_bp, url_prefix='/cost_analysis')
-    app.register_blueprint(basic_data_bp, url_prefix='/basic_data')
-    app.register_blueprint(user_management_bp, url_prefix='/users')
-except ImportError as e:
-    print(f'蓝图模块导入失败: {str(e)}', file=sys.stderr)
-    traceback.print_exc(file=sys.stderr)
-except Exception as e:
-    print(f'蓝图注册错误: {str(e)}', file=sys.stderr)
-    traceback.print_exc(file=sys.stderr)
+with startup_report.phase('蓝图注册'):
+    try:
+        # 延迟导入蓝图以避免循环依赖
+        from modules.system import system_bp
+        from modules.reconciliation import reconciliation_bp
+        from modules.scheduling import scheduling_bp
+        from modules.planning import planning_bp
+        from modules.cost_analysis import cost_analysis_bp
+        from modules.basic_data import basic_data_bp
+        from modules.user_management import user_management_bp
+
+        app.register_blueprint(system_bp, url_prefix='/system')
+        app.register_blueprint(reconciliation_bp, url_prefix='/reconciliation')
+        app.register_blueprint(scheduling_bp, url_prefix='/scheduling')
+        app.register_blueprint(planning_bp, url_prefix='/planning')
+        app.register_blueprint(cost_analysis_bp, url_prefix='/cost_analysis')
+        app.register_blueprint(basic_data_bp, url_prefix='/basic_data')
+        app.register_blueprint(user_management_bp, url_prefix='/users')
+    except ImportError as e:
+        app.logger.exception(f'蓝图模块导入失败: {str(e)}')
+    except Exception as e:
+        app.logger.exception(f'蓝图注册错误: {str(e)}')
 
 # 新增 AJAX 演示路由
 
@@ -506,35 +538,38 @@ def update_task_status(task_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# 注册API蓝图
-from api import init_api_routes
-init_api_routes(app)
+with startup_report.phase('API与工具注册'):
+    # 注册API蓝图
+    from api import init_api_routes
+    init_api_routes(app)
+
+    # 注册命令行工具
+    from cli import register_cli_commands
+    register_cli_commands(app)
+
+    # 注册性能指标
+    from config import METRICS_ENABLED, SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_EXPLAIN
+    if METRICS_ENABLED:
+        from metrics import init_metrics
+        from query_profiler import init_query_profiler
+        init_metrics(app)
+        init_query_profiler(SLOW_QUERY_THRESHOLD_MS, explain=SLOW_QUERY_EXPLAIN)
+
+    # 配置了审批系统地址时，在处理请求的进程中（收到首个请求时）启动飞书审批同步线程；
+    # flask 命令行不处理请求，不启动后台线程，发件箱由 feishu-sync 命令推送
+    from config import FEISHU_APPROVAL_URL
+    if FEISHU_APPROVAL_URL:
+        from modules.reconciliation.feishu_sync import start_dispatcher
+
+        @app.before_request
+        def ensure_feishu_dispatcher():
+            start_dispatcher(DATABASE)
+
+startup_report.finish()
+app.config['STARTUP_REPORT'] = startup_report.as_dict()
 
 # 应用入口点
 if __name__ == '__main__':
-    print('=== 应用启动诊断 ===')
-    print('1. 开始执行主入口代码')
-    try:
-        print('2. 创建应用上下文')
-        with app.app_context():
-            print('3. 初始化数据库')
-            init_db()
-            print('4. 数据库初始化完成')
-        
-        print('5. 获取端口号')
-        port = int(os.environ.get('PORT', 5000))
-        
-        print('6. 准备启动服务器')
-        app.logger.info(f'应用启动，访问地址: http://127.0.0.1:{port}')
-        print(f'7. 启动服务器 on http://0.0.0.0:{port}')
-        # 延迟导入用户管理蓝图避免循环依赖
-        
-        
-        app.run(host='0.0.0.0', port=port, debug=True)
-        print('8. 服务器启动成功')
-    except Exception as e:
-        print('应用初始化错误详情:')
-        traceback.print_exc()
-        print('错误类型:', type(e))
-        print('错误信息:', str(e))
-        exit(1)
+    port = int(os.environ.get('PORT', 5000))
+    app.logger.info(f'应用启动，访问地址: http://127.0.0.1:{port}')
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,447 @@
+"""
+数据库备份服务 - 使用 SQLite 在线备份接口分批复制数据库，生成压缩快照
+每批只短暂持有读锁，批次之间写操作可以提交（写入会使复制从头开始，持续写入时退回一次复制完成）；
+快照先复制到临时文件，完成完整性检查后再压缩，主库不参与压缩和校验
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from config import BACKUP_DIR, BACKUP_MIN_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_RETENTION_DAYS
+from constants import JobStatus
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+PARTIAL_SUFFIX = '.partial'
+# 分批复制期间源库被其他连接修改时 SQLite 会从头重新复制，超过该次数后改为一次复制完成
+MAX_BACKUP_RESTARTS = 2
+COPY_CHUNK_SIZE = 1024 * 1024
+
+LABEL_MANUAL = '手动'
+LABEL_SCHEDULED = '定时'
+LABEL_PRE_RESTORE = '恢复前'
+
+# 同一进程内同时只允许一个备份、恢复或归档操作
+_operation_lock = threading.Lock()
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+@contextmanager
+def exclusive_operation():
+    """备份、恢复与任务归档互斥执行（同一进程内），已有操作进行时抛出 ValueError"""
+    if not _operation_lock.acquire(blocking=False):
+        raise ValueError('已有备份、恢复或归档操作正在进行')
+    try:
+        yield
+    finally:
+        _operation_lock.release()
+
+
+def _snapshot_dir(snapshot_id, backup_dir=BACKUP_DIR):
+    # 快照编号只允许数字和下划线，避免路径穿越
+    if not snapshot_id or not snapshot_id.replace('_', '').isdigit():
+        raise ValueError('备份编号无效')
+    return os.path.join(backup_dir, snapshot_id)
+
+
+def _copy_database(source_path, target_path, pages_per_step=BACKUP_PAGES_PER_STEP):
+    """
+    在线复制数据库，返回 (页数, 重新复制次数)
+    其他连接在复制期间写入时 SQLite 会从头重新复制；每次重新复制把每批页数放大8倍，
+    超过 MAX_BACKUP_RESTARTS 次后一次复制完成（期间写操作等待）
+    """
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            raise _BackupRestarted()
+        last_remaining = remaining
+
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            for restarts in range(MAX_BACKUP_RESTARTS + 1):
+                last_remaining = None
+                try:
+                    if restarts < MAX_BACKUP_RESTARTS:
+                        source.backup(target, pages=pages_per_step * 8 ** restarts, progress=progress, sleep=0.01)
+                    else:
+                        logger.warning(f'备份期间数据库持续写入，已重新复制{restarts}次，改为一次复制完成')
+                        source.backup(target, pages=-1)
+                    break
+                except _BackupRestarted:
+                    continue
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return page_count, restarts
+
+
+def _check_integrity(path):
+    """完整性检查，返回 'ok' 或第一条错误"""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA integrity_check(1)').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _compress(source_path, target_path):
+    """gzip压缩，返回 (压缩后大小, sha256)"""
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as target:
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+    with open(target_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return os.path.getsize(target_path), digest.hexdigest()
+
+
+def _decompress(source_path, target_path):
+    with gzip.open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _database_files(db_path):
+    """需要备份的数据库：主库，以及已存在的任务归档库（主库在前，先于归档库复制）"""
+    from task_archive import archive_path
+
+    files = {'database': db_path}
+    conn = sqlite3.connect(db_path)
+    try:
+        path = archive_path(conn)
+    finally:
+        conn.close()
+    if path != ':memory:' and os.path.exists(path):
+        files['archive'] = path
+    return files
+
+
+def _drop_unarchived(archive_copy, database_copy):
+    """
+    归档库在主库之后复制，两次复制之间其他进程完成的归档批次会使任务同时出现在两个副本中；
+    从归档库副本删除主库副本中仍有的任务（及其车辆、状态历史），两个副本对应同一时刻
+
+    Returns:
+        int: 删除的任务数
+    """
+    from task_archive import ARCHIVE_TABLES
+
+    conn = sqlite3.connect(archive_copy)
+    try:
+        conn.execute('ATTACH DATABASE ? AS snapshot_main', (database_copy,))
+        dropped = 0
+        with conn:
+            for table, (archive_table, _) in ARCHIVE_TABLES.items():
+                count = conn.execute(f'''
+                    DELETE FROM main.{archive_table}
+                    WHERE task_id IN (SELECT task_id FROM snapshot_main.manual_dispatch_tasks)
+                ''').rowcount
+                if table == 'manual_dispatch_tasks':
+                    dropped = count
+        conn.execute('DETACH DATABASE snapshot_main')
+    finally:
+        conn.close()
+    return dropped
+
+
+def _schema_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def create_snapshot(db_path, label=LABEL_MANUAL, created_by=None, backup_dir=BACKUP_DIR,
+                    progress_callback=None):
+    """
+    创建数据库快照：在线复制、完整性检查、压缩，写入清单后按保留策略清理旧快照
+
+    Args:
+        db_path (str): 主库路径（任务归档库存在时一并备份）
+        label (str): 手动/定时/恢复前
+        progress_callback (callable, optional): 参数为 (已完成步骤, 总步骤, 说明)
+
+    Returns:
+        dict: 快照清单
+    """
+    with exclusive_operation():
+        return _create_snapshot(db_path, label, created_by, backup_dir, progress_callback)
+
+
+def _create_snapshot(db_path, label, created_by, backup_dir, progress_callback):
+    started = time.perf_counter()
+    snapshot_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    while os.path.exists(os.path.join(backup_dir, snapshot_id)):
+        time.sleep(1)
+        snapshot_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    # 先写入临时目录，全部完成后改名，列表中不会出现未完成的快照
+    partial_dir = os.path.join(backup_dir, snapshot_id + PARTIAL_SUFFIX)
+    os.makedirs(partial_dir)
+    try:
+        files = []
+        sources = _database_files(db_path)
+        steps = len(sources) * 3
+        copies = {}
+        for index, (name, source_path) in enumerate(sources.items()):
+            if progress_callback:
+                progress_callback(index, steps, f'复制{name}')
+            raw_path = os.path.join(partial_dir, f'{name}.db')
+            copies[name] = (raw_path, *_copy_database(source_path, raw_path))
+        if 'archive' in copies:
+            dropped = _drop_unarchived(copies['archive'][0], copies['database'][0])
+            if dropped:
+                logger.info(f'复制期间有 {dropped} 个任务被归档，快照按主库副本的时刻保留在主库中')
+
+        for index, (name, (raw_path, page_count, restarts)) in enumerate(copies.items()):
+            if progress_callback:
+                progress_callback(len(copies) + index * 2, steps, f'检查{name}')
+            integrity = _check_integrity(raw_path)
+            if integrity != 'ok':
+                raise RuntimeError(f'备份文件完整性检查失败（{name}）: {integrity}')
+
+            if progress_callback:
+                progress_callback(len(copies) + index * 2 + 1, steps, f'压缩{name}')
+            raw_size = os.path.getsize(raw_path)
+            schema_version = _schema_version(raw_path)
+            size, sha256 = _compress(raw_path, raw_path + '.gz')
+            os.remove(raw_path)
+            files.append({'name': name, 'file': f'{name}.db.gz', 'size': size, 'raw_size': raw_size,
+                          'sha256': sha256, 'page_count': page_count, 'restarts': restarts,
+                          'schema_version': schema_version})
+
+        manifest = {
+            'id': snapshot_id,
+            'label': label,
+            'created_by': created_by,
+            'created_at': datetime.now().isoformat(sep=' ', timespec='seconds'),
+            'duration_ms': round((time.perf_counter() - started) * 1000),
+            'size': sum(item['size'] for item in files),
+            'integrity': 'ok',
+            'files': files
+        }
+        with open(os.path.join(partial_dir, MANIFEST_FILE), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+        os.rename(partial_dir, os.path.join(backup_dir, snapshot_id))
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+
+    logger.info(f"数据库快照已创建: {snapshot_id}（{manifest['size'] / 1048576:.1f} MB，"
+                f"耗时 {manifest['duration_ms'] / 1000:.1f} 秒）")
+    manifest['removed'] = prune_snapshots(backup_dir)
+    return manifest
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """已完成的快照清单，按时间倒序"""
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name, MANIFEST_FILE)
+        if name.endswith(PARTIAL_SUFFIX) or not os.path.isfile(path):
+            continue
+        try:
+            with open(path, encoding='utf-8') as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError) as e:
+            logger.warning(f'读取备份清单失败 {name}: {str(e)}')
+    return sorted(snapshots, key=lambda item: item['id'], reverse=True)
+
+
+def get_snapshot(snapshot_id, backup_dir=BACKUP_DIR):
+    """读取快照清单，不存在时返回None"""
+    path = os.path.join(_snapshot_dir(snapshot_id, backup_dir), MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def snapshot_file_path(snapshot_id, name='database', backup_dir=BACKUP_DIR):
+    """快照中某个数据库的压缩文件路径，不存在时返回None"""
+    manifest = get_snapshot(snapshot_id, backup_dir)
+    item = next((f for f in manifest['files'] if f['name'] == name), None) if manifest else None
+    if not item:
+        return None
+    path = os.path.join(_snapshot_dir(snapshot_id, backup_dir), item['file'])
+    return path if os.path.isfile(path) else None
+
+
+def prune_snapshots(backup_dir=BACKUP_DIR, retention_days=BACKUP_RETENTION_DAYS, min_keep=BACKUP_MIN_KEEP):
+    """
+    保留策略：最近 min_keep 份始终保留，其余超过 retention_days 天的删除；
+    同时清理一天前遗留的未完成目录
+
+    Returns:
+        list: 删除的快照编号
+    """
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y%m%d_%H%M%S')
+    removed = []
+    for manifest in list_snapshots(backup_dir)[min_keep:]:
+        if manifest['id'] < cutoff:
+            shutil.rmtree(os.path.join(backup_dir, manifest['id']), ignore_errors=True)
+            removed.append(manifest['id'])
+
+    stale = time.time() - 86400
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        if name.endswith(PARTIAL_SUFFIX) and os.path.getmtime(path) < stale:
+            shutil.rmtree(path, ignore_errors=True)
+    if removed:
+        logger.info(f"已清理过期快照: {', '.join(removed)}")
+    return removed
+
+
+def _restore_database(source_path, target_path):
+    """用在线备份接口把快照写回目标库（一次完成，期间其他连接等待），目标库的连接无需关闭"""
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(target_path, timeout=60)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def _empty_archive(archive_file, work_path):
+    """复制归档库并删除全部归档数据（保留表结构和索引，已挂载的连接仍可查询），返回副本路径"""
+    from task_archive import ARCHIVE_TABLES
+
+    _restore_database(archive_file, work_path)
+    conn = sqlite3.connect(work_path)
+    try:
+        with conn:
+            for archive_table, _ in ARCHIVE_TABLES.values():
+                conn.execute(f'DELETE FROM {archive_table}')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    return work_path
+
+
+def _after_restore(db_path, pre_restore_id):
+    """
+    恢复后的收尾：补齐表结构到当前版本；快照中未结束的后台任务标记失败；
+    清空会话（快照中可能有已注销的会话）；缓存版本号整体前移，各进程重新加载缓存
+    """
+    from db_manager import DatabaseManager
+
+    DatabaseManager.init_database(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            conn.execute('''
+                UPDATE background_jobs SET status = ?, error = ?, finished_at = ?
+                WHERE status IN (?, ?)
+            ''', (JobStatus.FAILED.value, f'数据库已从备份恢复（恢复前快照 {pre_restore_id}）',
+                  datetime.now().isoformat(sep=' '), JobStatus.QUEUED.value, JobStatus.RUNNING.value))
+            conn.execute('DELETE FROM sessions')
+            conn.execute('''
+                UPDATE cache_versions
+                SET version = version + (SELECT MAX(version) FROM cache_versions) + 1,
+                    updated_at = CURRENT_TIMESTAMP
+            ''')
+    finally:
+        conn.close()
+
+
+def restore_snapshot(db_path, snapshot_id, created_by=None, backup_dir=BACKUP_DIR):
+    """
+    从快照恢复：校验文件摘要和完整性，先为当前数据创建“恢复前”快照，再写回主库（及归档库）
+    恢复后所有会话失效，需要重新登录
+
+    Returns:
+        dict: {'snapshot_id', 'pre_restore_snapshot'}
+    """
+    from db_manager import SCHEMA_VERSION
+    from task_archive import archive_path
+
+    manifest = get_snapshot(snapshot_id, backup_dir)
+    if not manifest:
+        raise ValueError('备份不存在')
+    with exclusive_operation():
+        snapshot_dir = _snapshot_dir(snapshot_id, backup_dir)
+        work_dir = os.path.join(backup_dir, f'restore_{snapshot_id}{PARTIAL_SUFFIX}')
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            # 全部文件校验通过后才开始写回
+            prepared = {}
+            for item in manifest['files']:
+                path = os.path.join(snapshot_dir, item['file'])
+                if not os.path.isfile(path) or _sha256(path) != item['sha256']:
+                    raise ValueError(f"备份文件缺失或已损坏: {item['file']}")
+                if item.get('schema_version', 0) > SCHEMA_VERSION:
+                    raise ValueError('备份来自更新版本的程序，不能恢复')
+                raw_path = os.path.join(work_dir, f"{item['name']}.db")
+                _decompress(path, raw_path)
+                integrity = _check_integrity(raw_path)
+                if integrity != 'ok':
+                    raise ValueError(f"备份文件完整性检查失败（{item['name']}）: {integrity}")
+                prepared[item['name']] = raw_path
+
+            pre_restore = _create_snapshot(db_path, LABEL_PRE_RESTORE, created_by, backup_dir, None)
+
+            conn = sqlite3.connect(db_path)
+            try:
+                current_archive = archive_path(conn)
+            finally:
+                conn.close()
+            targets = {'database': db_path, 'archive': current_archive}
+            if 'archive' not in prepared and current_archive != ':memory:' and os.path.exists(current_archive):
+                # 快照中没有归档库（当时尚未归档）：当前归档库已在恢复前快照中，清空后写回，
+                # 否则快照主库中的任务与当前归档库中的同一批任务会重复统计
+                prepared['archive'] = _empty_archive(current_archive, os.path.join(work_dir, 'archive.db'))
+            for name, raw_path in prepared.items():
+                _restore_database(raw_path, targets[name])
+            _after_restore(db_path, pre_restore['id'])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.warning(f"数据库已从快照 {snapshot_id} 恢复（恢复前快照 {pre_restore['id']}）")
+    return {'snapshot_id': snapshot_id, 'pre_restore_snapshot': pre_restore['id']}
+
+
+def backup_job(context, label=LABEL_MANUAL, created_by=None):
+    """后台任务：创建数据库快照"""
+    manifest = create_snapshot(
+        context.manager.db_path, label, created_by,
+        progress_callback=lambda done, total, message: context.update_progress(done, total, message=message)
+    )
+    context.update_progress(1, 1, message=f"快照 {manifest['id']} 已创建", force=True)
+    return manifest
@@ -0,0 +1,5 @@
+"""
+性能基准测试
+- datagen: 按规模生成派车业务合成数据
+- flows: 通过 Flask 测试客户端驱动关键业务流程，统计吞吐量、延迟分位数与SQL语句数
+"""
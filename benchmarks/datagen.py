@@ -0,0 +1,276 @@
+"""
+合成数据生成 - 按规模生成单位、供应商、调度人员、派车任务（双轨、全部状态）、状态历史和车辆
+任务状态与历史按 api/audit.py 的流转规则生成，同一随机种子生成的数据完全一致
+
+用法：python -m benchmarks.datagen --db bench.db --tasks 100000
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from api.audit import get_next_handler
+from db_manager import DatabaseManager
+from security import hash_password
+
+# 基准测试账号的统一密码
+BENCH_PASSWORD = 'bench12345'
+
+# 账号前缀：bench_<角色>_<序号>
+BENCH_USER_PREFIX = {
+    '供应商': 'bench_supplier',
+    '车间地调': 'bench_workshop',
+    '区域调度员': 'bench_dispatcher'
+}
+
+# 各轨道的状态流转路径
+TRACK_PATHS = {
+    '轨道A': ['待调度员审核', '待供应商响应', '供应商已响应', '车间已核查', '供应商已确认', '任务结束'],
+    '轨道B': ['待供应商响应', '供应商已响应', '车间已核查', '供应商已确认', '任务结束']
+}
+
+# 当前状态分布（已结束的任务占多数，与线上接近）
+STATUS_WEIGHTS = {
+    '轨道A': {'待调度员审核': 6, '待供应商响应': 6, '供应商已响应': 4, '车间已核查': 3,
+             '供应商已确认': 3, '任务结束': 70, '已取消': 8},
+    '轨道B': {'待供应商响应': 8, '供应商已响应': 5, '车间已核查': 4, '供应商已确认': 3, '任务结束': 80}
+}
+
+# 已经有车辆信息的状态
+VEHICLE_STATUSES = {'供应商已响应', '车间已核查', '供应商已确认', '任务结束'}
+
+CITIES = ['北京', '上海', '广州', '深圳', '天津', '重庆', '成都', '武汉', '南京', '杭州',
+          '西安', '郑州', '长沙', '济南', '沈阳', '哈尔滨', '昆明', '南宁', '福州', '合肥']
+COMPANY_SUFFIXES = ['物流有限公司', '运输有限公司', '快运有限公司', '供应链有限公司', '速递有限公司']
+PLATE_PREFIXES = ['京A', '沪B', '粤A', '粤B', '津C', '渝D', '川A', '鄂A', '苏A', '浙A']
+WEIGHTS = [5, 8, 12, 20, 30, 40]
+
+BATCH_SIZE = 5000
+
+
+def bench_username(role, index):
+    """基准测试账号用户名"""
+    return f'{BENCH_USER_PREFIX[role]}_{index}'
+
+
+def _weighted_choice(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _ensure_schema(db_path):
+    """建表并写入默认角色、权限与管理员"""
+    DatabaseManager.init_database(db_path)
+
+
+def _company_name(index):
+    base = CITIES[index % len(CITIES)] + COMPANY_SUFFIXES[index // len(CITIES) % len(COMPANY_SUFFIXES)]
+    cycle = index // (len(CITIES) * len(COMPANY_SUFFIXES))
+    return f'{base}{cycle}' if cycle else base
+
+
+def _insert_companies(conn, rng, count):
+    names = [_company_name(i) for i in range(count)]
+    conn.executemany('''
+        INSERT OR IGNORE INTO Company (name, contact_person, contact_phone, address)
+        VALUES (?, ?, ?, ?)
+    ''', [(name, f'联系人{i}', f'138{rng.randrange(10 ** 8):08d}', f'{name[:2]}市') for i, name in enumerate(names)])
+    placeholders = ', '.join('?' * len(names))
+    return [dict(row) for row in conn.execute(f'SELECT id, name FROM Company WHERE name IN ({placeholders})', names)]
+
+
+def _insert_users(conn, rng, role, count, password_hash, companies=None):
+    role_id = conn.execute('SELECT id FROM Role WHERE name = ?', (role,)).fetchone()[0]
+    now = datetime.now()
+    users = []
+    for i in range(1, count + 1):
+        username = bench_username(role, i)
+        company = rng.choice(companies) if companies else None
+        row = conn.execute('''
+            INSERT INTO User (username, password, full_name, email, phone, company_id, is_active, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET password = excluded.password, company_id = excluded.company_id
+            RETURNING id
+        ''', (username, password_hash, f'{role}{i}', f'{username}@bench.local', f'139{rng.randrange(10 ** 8):08d}',
+              company['id'] if company else None, now, now)).fetchone()
+        conn.execute('INSERT OR IGNORE INTO UserRole (user_id, role_id) VALUES (?, ?)', (row[0], role_id))
+        users.append({'id': row[0], 'company': company['name'] if company else None})
+    return users
+
+
+def _build_task(rng, index, start_date, days, suppliers, workshops, dispatchers, plates):
+    """生成一个任务及其状态历史、车辆"""
+    track = '轨道A' if rng.random() < 0.6 else '轨道B'
+    status = _weighted_choice(rng, STATUS_WEIGHTS[track])
+    supplier = rng.choice(suppliers)
+    if track == '轨道A':
+        initiator_role, initiator = '车间地调', rng.choice(workshops)
+    else:
+        initiator_role, initiator = '区域调度员', rng.choice(dispatchers)
+
+    created_at = start_date + timedelta(days=rng.randrange(days), minutes=rng.randrange(24 * 60))
+    start_city, end_city = rng.sample(CITIES, 2)
+    task_id = f'B{index:09d}'
+
+    # 走到当前状态经过的路径
+    path = TRACK_PATHS[track]
+    if status == '已取消':
+        reached = [path[0], '已取消']
+    else:
+        reached = path[:path.index(status) + 1]
+
+    history = [(task_id, '创建任务', initiator_role, created_at, '基准测试数据')]
+    timestamp = created_at
+    for old_status, new_status in zip(reached, reached[1:]):
+        timestamp += timedelta(minutes=rng.randrange(5, 240))
+        if old_status == '待调度员审核':
+            operator = '区域调度员'
+        elif new_status in ('供应商已响应', '供应商已确认'):
+            operator = '供应商'
+        else:
+            operator = initiator_role
+        history.append((task_id, f'{old_status}→{new_status}', operator, timestamp, None))
+
+    audited = track == '轨道A' and status != '待调度员审核'
+    audit_status = ('已拒绝' if status == '已取消' else '已通过') if audited else ('待审核' if track == '轨道A' else '已通过')
+    next_handler = get_next_handler(status, {'dispatch_track': track})
+    if status == '待调度员审核':
+        next_handler = '区域调度员'
+
+    task = (
+        task_id, created_at.strftime('%Y-%m-%d'), f'{start_city}邮区中心局', f'{start_city}-{end_city}',
+        supplier['company'], f'{start_city}{end_city}线', rng.choice(['单程', '往返']),
+        '正班' if rng.random() < 0.7 else '加班', rng.randrange(20, 121), float(rng.choice(WEIGHTS)),
+        None, status, track, initiator_role, initiator['id'], int(track == '轨道A'),
+        '区域调度员' if audited else None, rng.choice(dispatchers)['id'] if audited else None, audit_status,
+        history[1][3] if audited else None, next_handler, None, supplier['id'],
+        created_at, timestamp
+    )
+
+    vehicles = []
+    if status in VEHICLE_STATUSES:
+        for carriage in range(1, rng.choice([1, 1, 1, 2]) + 1):
+            plate, standard_volume = rng.choice(plates)
+            vehicles.append((task_id, f'MN{index:09d}{carriage}', f'DP{index:09d}{carriage}', plate, str(carriage),
+                             round(standard_volume * rng.uniform(0.6, 1.0), 1), history[-1][3]))
+    return task, history, vehicles
+
+
+def _flush(conn, tasks, history, vehicles):
+    conn.executemany('''
+        INSERT OR IGNORE INTO manual_dispatch_tasks
+        (task_id, required_date, start_bureau, route_direction, carrier_company, route_name,
+         transport_type, requirement_type, volume, weight, special_requirements, status,
+         dispatch_track, initiator_role, initiator_user_id, audit_required, auditor_role, auditor_user_id,
+         audit_status, audit_time, current_handler_role, current_handler_user_id, assigned_supplier_id,
+         created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', tasks)
+    conn.executemany('''
+        INSERT INTO dispatch_status_history (task_id, status_change, operator, timestamp, note)
+        VALUES (?, ?, ?, ?, ?)
+    ''', history)
+    conn.executemany('''
+        INSERT INTO vehicles (task_id, manifest_number, dispatch_number, license_plate, carriage_number, actual_volume, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', vehicles)
+    conn.commit()
+
+
+def generate_dataset(db_path, tasks=10000, companies=50, suppliers=200, workshops=20, dispatchers=5,
+                     vehicles=500, days=365, seed=42, batch_size=BATCH_SIZE, progress=None):
+    """
+    生成合成数据集
+
+    Args:
+        db_path (str): 数据库路径，不存在时自动建表
+        tasks (int): 派车任务数
+        companies / suppliers / workshops / dispatchers (int): 单位、供应商、车间地调、区域调度员数量
+        vehicles (int): 车牌池大小（同时写入车辆容积参考表）
+        days (int): 任务日期分布在最近多少天内
+        seed (int): 随机种子
+        progress (callable): 进度回调 progress(已生成任务数, 总数)
+
+    Returns:
+        dict: 各类数据的生成数量
+    """
+    rng = random.Random(seed)
+    _ensure_schema(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    # 只影响本连接：批量写入时不等待落盘
+    conn.execute('PRAGMA synchronous = OFF')
+    try:
+        company_rows = _insert_companies(conn, rng, companies)
+        password_hash = hash_password(BENCH_PASSWORD)
+        supplier_users = _insert_users(conn, rng, '供应商', suppliers, password_hash, company_rows)
+        workshop_users = _insert_users(conn, rng, '车间地调', workshops, password_hash)
+        dispatcher_users = _insert_users(conn, rng, '区域调度员', dispatchers, password_hash)
+
+        plates = []
+        for i in range(vehicles):
+            vehicle_type = rng.choice(['单车', '挂车'])
+            plates.append((f'{rng.choice(PLATE_PREFIXES)}{i:05d}', 35.0 if vehicle_type == '单车' else 85.0))
+        conn.executemany('''
+            INSERT OR IGNORE INTO vehicle_capacity_reference (vehicle_type, standard_volume, license_plate, suppliers)
+            VALUES (?, ?, ?, '[]')
+        ''', [('单车' if volume == 35.0 else '挂车', volume, plate) for plate, volume in plates])
+        conn.commit()
+
+        start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+        counts = {'companies': len(company_rows), 'suppliers': len(supplier_users), 'workshops': len(workshop_users),
+                  'dispatchers': len(dispatcher_users), 'tasks': 0, 'history': 0, 'vehicles': 0}
+        task_batch, history_batch, vehicle_batch = [], [], []
+        for index in range(1, tasks + 1):
+            task, history, task_vehicles = _build_task(rng, index, start_date, days, supplier_users,
+                                                       workshop_users, dispatcher_users, plates)
+            task_batch.append(task)
+            history_batch.extend(history)
+            vehicle_batch.extend(task_vehicles)
+            if len(task_batch) >= batch_size:
+                _flush(conn, task_batch, history_batch, vehicle_batch)
+                counts['history'] += len(history_batch)
+                counts['vehicles'] += len(vehicle_batch)
+                task_batch, history_batch, vehicle_batch = [], [], []
+                if progress:
+                    progress(index, tasks)
+        if task_batch:
+            _flush(conn, task_batch, history_batch, vehicle_batch)
+            counts['history'] += len(history_batch)
+            counts['vehicles'] += len(vehicle_batch)
+        counts['tasks'] = tasks
+        conn.execute('ANALYZE')
+        return counts
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成派车业务合成数据')
+    parser.add_argument('--db', default='bench.db', help='数据库路径')
+    parser.add_argument('--tasks', type=int, default=10000, help='派车任务数')
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--suppliers', type=int, default=200)
+    parser.add_argument('--workshops', type=int, default=20)
+    parser.add_argument('--dispatchers', type=int, default=5)
+    parser.add_argument('--vehicles', type=int, default=500, help='车牌池大小')
+    parser.add_argument('--days', type=int, default=365, help='任务日期分布天数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+
+    def progress(done, total):
+        print(f'  {done}/{total} 任务 ({time.perf_counter() - started:.1f}s)')
+
+    counts = generate_dataset(args.db, tasks=args.tasks, companies=args.companies, suppliers=args.suppliers,
+                              workshops=args.workshops, dispatchers=args.dispatchers, vehicles=args.vehicles,
+                              days=args.days, seed=args.seed, progress=progress)
+    print(f'生成完成 ({time.perf_counter() - started:.1f}s): {counts}')
+    print(f'基准测试账号密码: {BENCH_PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+飞书审批系统本地桩 - 实现 POST /approvals/batch，用于联调和测试发件箱推送
+按幂等键去重（重复推送返回 duplicate 和原审批单号），可模拟延迟、整批失败（503）和单条拒绝；
+GET /approvals/stats 返回收到的请求数、事件数和重复数
+
+用法：
+    python -m benchmarks.feishu_stub --port 8765 --fail-rate 0.1
+    FEISHU_APPROVAL_URL=http://127.0.0.1:8765 python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ApprovalStub:
+    """桩的状态：已受理的幂等键 -> 审批单号"""
+
+    def __init__(self, latency_ms=0, fail_rate=0.0, reject_rate=0.0):
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.reject_rate = reject_rate
+        self.approvals = {}
+        self.stats = {'requests': 0, 'failed_requests': 0, 'events': 0, 'accepted': 0, 'duplicates': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    def handle_batch(self, events):
+        """处理一批事件，返回结果列表；模拟整批失败时返回None"""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.stats['requests'] += 1
+            if random.random() < self.fail_rate:
+                self.stats['failed_requests'] += 1
+                return None
+            results = []
+            for event in events:
+                key = event['idempotency_key']
+                self.stats['events'] += 1
+                if key in self.approvals:
+                    self.stats['duplicates'] += 1
+                    results.append({'idempotency_key': key, 'status': 'duplicate',
+                                    'approval_no': self.approvals[key], 'approval_status': '待审核'})
+                elif random.random() < self.reject_rate:
+                    self.stats['rejected'] += 1
+                    results.append({'idempotency_key': key, 'status': 'rejected', 'error': '模拟拒绝'})
+                else:
+                    self.approvals[key] = f'FP-{len(self.approvals) + 1:08d}'
+                    self.stats['accepted'] += 1
+                    results.append({'idempotency_key': key, 'status': 'accepted',
+                                    'approval_no': self.approvals[key], 'approval_status': '待审核'})
+            return results
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != '/approvals/batch':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                events = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['events']
+            except (ValueError, KeyError):
+                return self._reply(400, {'error': 'invalid body'})
+            results = stub.handle_batch(events)
+            if results is None:
+                return self._reply(503, {'error': 'simulated failure'})
+            self._reply(200, {'results': results})
+
+        def do_GET(self):
+            if self.path != '/approvals/stats':
+                return self._reply(404, {'error': 'not found'})
+            with stub._lock:
+                self._reply(200, dict(stub.stats))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(host='127.0.0.1', port=0, **options):
+    """在后台线程中启动桩，返回 (server, stub)；port=0 时自动分配，地址见 server.server_address"""
+    stub = ApprovalStub(**options)
+    server = ThreadingHTTPServer((host, port), _make_handler(stub))
+    threading.Thread(target=server.serve_forever, name='feishu-stub', daemon=True).start()
+    return server, stub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='飞书审批系统本地桩')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=int, default=0, help='每个请求的模拟延迟（毫秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='整批返回503的比例')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='单条事件被拒绝的比例')
+    args = parser.parse_args(argv)
+
+    server, stub = start_stub(args.host, args.port, latency_ms=args.latency_ms,
+                              fail_rate=args.fail_rate, reject_rate=args.reject_rate)
+    print(f'审批系统桩已启动: http://{args.host}:{server.server_address[1]}')
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(stub.stats, ensure_ascii=False))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
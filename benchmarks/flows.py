@@ -0,0 +1,259 @@
+"""
+业务流程基准测试 - 通过 Flask 测试客户端驱动关键流程，统计吞吐量、延迟分位数与每个请求的SQL语句数
+流程：任务列表（调度员/供应商）、统计、详情、创建、审核、供应商确认
+审核、创建、确认会修改数据库；对比前后结果时请使用同一种子重新生成的数据库
+
+用法：
+    python -m benchmarks.datagen --db bench.db --tasks 100000
+    python -m benchmarks.flows --db bench.db --iterations 200 --json before.json
+    python -m benchmarks.flows --db bench.db --iterations 200 --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+# 所有流程（按执行顺序）
+FLOW_NAMES = ['list', 'list_supplier', 'stats', 'stats_supplier', 'detail', 'create', 'audit', 'confirm']
+
+# 对比时展示的指标：(字段, 名称, 数值越大越好)
+COMPARE_FIELDS = [('throughput_rps', '吞吐量', True), ('p50_ms', 'p50', False),
+                  ('p99_ms', 'p99', False), ('sql_per_request', 'SQL/请求', False)]
+
+
+class PoolExhausted(Exception):
+    """待处理任务已用完"""
+
+
+def percentile(sorted_values, p):
+    """线性插值分位数，sorted_values 须已排序"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class FlowBenchmark:
+    """按角色登录测试客户端，逐个流程计时"""
+
+    def __init__(self, app, db_path, seed=42):
+        from benchmarks.datagen import BENCH_PASSWORD, bench_username
+
+        self.app = app
+        self.db_path = db_path
+        self.rng = random.Random(seed)
+        self.sql_count = 0
+        self.clients = {}
+        for role in ('区域调度员', '供应商', '车间地调'):
+            client = app.test_client()
+            response = client.post('/login', data={'username': bench_username(role, 1), 'password': BENCH_PASSWORD})
+            if response.status_code != 302:
+                raise RuntimeError(f'基准测试账号登录失败（{role}），请先运行 benchmarks.datagen')
+            self.clients[role] = client
+
+        conn = sqlite3.connect(db_path)
+        try:
+            self.task_ids = [row[0] for row in conn.execute('SELECT task_id FROM manual_dispatch_tasks')]
+            self.total_pages = max(len(self.task_ids) // 20, 1)
+            self.audit_pool = [row[0] for row in conn.execute('''
+                SELECT task_id FROM manual_dispatch_tasks
+                WHERE status = '待调度员审核' AND dispatch_track = '轨道A'
+            ''')]
+            self.confirm_pool = [row[0] for row in conn.execute('''
+                SELECT t.task_id FROM manual_dispatch_tasks t
+                WHERE t.status = '待供应商响应'
+                  AND NOT EXISTS (SELECT 1 FROM vehicles v WHERE v.task_id = t.task_id)
+            ''')]
+        finally:
+            conn.close()
+        self.rng.shuffle(self.audit_pool)
+        self.rng.shuffle(self.confirm_pool)
+
+    def count_sql(self, cursor, sql, params, elapsed, many=False):
+        """SQL观察者：统计语句数"""
+        self.sql_count += 1
+
+    def _page(self):
+        # 大部分请求集中在前几页
+        return 1 if self.rng.random() < 0.7 else self.rng.randint(1, self.total_pages)
+
+    def flow_list(self):
+        return self.clients['区域调度员'].get(f'/api/dispatch/tasks?page={self._page()}&limit=20')
+
+    def flow_list_supplier(self):
+        return self.clients['供应商'].get(f'/api/dispatch/tasks?page={self._page()}&limit=20')
+
+    def flow_stats(self):
+        return self.clients['区域调度员'].get('/api/dispatch/statistics')
+
+    def flow_stats_supplier(self):
+        return self.clients['供应商'].get('/api/dispatch/statistics')
+
+    def flow_detail(self):
+        return self.clients['区域调度员'].get(f'/api/dispatch/tasks/{self.rng.choice(self.task_ids)}')
+
+    def flow_create(self):
+        required_time = datetime.now() + timedelta(days=self.rng.randint(1, 30), hours=self.rng.randint(0, 23))
+        return self.clients['车间地调'].post('/api/dispatch/tasks', json={
+            'requirement_type': self.rng.choice(['正班', '加班']),
+            'start_location': '北京邮区中心局',
+            'end_location': '京沪线',
+            'carrier_company': self.rng.choice(['北京物流有限公司', '上海物流有限公司']),
+            'transport_type': self.rng.choice(['单程', '往返']),
+            'weight': self.rng.choice(['5', '8', '12', '20']),
+            'volume': self.rng.randint(20, 120),
+            'required_time': required_time.strftime('%Y-%m-%dT%H:%M'),
+            'dispatch_track': '轨道A'
+        })
+
+    def flow_audit(self):
+        if not self.audit_pool:
+            raise PoolExhausted()
+        task_id = self.audit_pool.pop()
+        response = self.clients['区域调度员'].post(f'/api/dispatch/tasks/{task_id}/audit',
+                                               json={'audit_result': '通过', 'audit_note': '基准测试'})
+        self.confirm_pool.append(task_id)
+        return response
+
+    def flow_confirm(self):
+        if not self.confirm_pool:
+            raise PoolExhausted()
+        return self.clients['供应商'].post(f'/api/dispatch/tasks/{self.confirm_pool.pop()}/confirm')
+
+    def run_flow(self, name, iterations, warmup=10):
+        """运行一个流程，返回统计结果"""
+        flow = getattr(self, f'flow_{name}')
+        latencies = []
+        sql_counts = []
+        errors = 0
+        # 屏蔽请求处理过程中的 print 输出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            wall_started = time.perf_counter()
+            for i in range(warmup + iterations):
+                self.sql_count = 0
+                started = time.perf_counter()
+                try:
+                    response = flow()
+                except PoolExhausted:
+                    break
+                elapsed = time.perf_counter() - started
+                if i < warmup:
+                    wall_started = time.perf_counter()
+                    continue
+                latencies.append(elapsed * 1000)
+                sql_counts.append(self.sql_count)
+                if response.status_code >= 400:
+                    errors += 1
+            wall = time.perf_counter() - wall_started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / wall, 1) if latencies else 0.0,
+            'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p90_ms': round(percentile(latencies, 90), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+            'sql_per_request': round(sum(sql_counts) / len(sql_counts), 1) if sql_counts else 0.0
+        }
+
+
+def print_report(results, baseline=None):
+    """输出结果表格；提供基准结果时附加变化百分比"""
+    header = f"{'流程':<16}{'请求':>7}{'错误':>6}{'吞吐/s':>9}{'均值ms':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'SQL/请求':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in results.items():
+        print(f"{name:<16}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+              f"{stats['mean_ms']:>9}{stats['p50_ms']:>9}{stats['p90_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats['max_ms']:>9}{stats['sql_per_request']:>10}")
+
+    if not baseline:
+        return
+    print()
+    print('与基准对比（+ 为改善）：')
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        changes = []
+        for field, label, higher_is_better in COMPARE_FIELDS:
+            if not before[field]:
+                continue
+            change = (stats[field] - before[field]) / before[field] * 100
+            if not higher_is_better:
+                change = -change
+            changes.append(f'{label} {before[field]}→{stats[field]} ({change:+.1f}%)')
+        print(f'  {name:<16}' + '  '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='业务流程基准测试')
+    parser.add_argument('--db', default='bench.db', help='由 benchmarks.datagen 生成的数据库')
+    parser.add_argument('--flows', default=','.join(FLOW_NAMES), help=f"逗号分隔，可选: {','.join(FLOW_NAMES)}")
+    parser.add_argument('--iterations', type=int, default=200, help='每个流程的计时请求数')
+    parser.add_argument('--warmup', type=int, default=10, help='每个流程的预热请求数（不计时）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='结果写入JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果对比')
+    args = parser.parse_args(argv)
+
+    flows = [name.strip() for name in args.flows.split(',') if name.strip()]
+    unknown = [name for name in flows if name not in FLOW_NAMES]
+    if unknown:
+        parser.error(f"未知流程: {', '.join(unknown)}")
+    if not os.path.exists(args.db):
+        parser.error(f'数据库不存在: {args.db}，请先运行 python -m benchmarks.datagen --db {args.db}')
+
+    # 必须在导入应用之前设置数据库路径
+    os.environ['DATABASE_PATH'] = args.db
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from app import app
+        from metrics import add_sql_observer
+        app.config['TESTING'] = True
+        bench = FlowBenchmark(app, args.db, seed=args.seed)
+    add_sql_observer(bench.count_sql)
+
+    results = {}
+    for name in flows:
+        results[name] = bench.run_flow(name, args.iterations, warmup=args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['flows']
+
+    print(f'数据库: {args.db}（{len(bench.task_ids)} 个任务），每个流程 {args.iterations} 次')
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({
+                'meta': {
+                    'db': args.db,
+                    'tasks': len(bench.task_ids),
+                    'iterations': args.iterations,
+                    'warmup': args.warmup,
+                    'seed': args.seed,
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                    'created_at': datetime.now().isoformat(timespec='seconds')
+                },
+                'flows': results
+            }, file, ensure_ascii=False, indent=2)
+        print(f'结果已保存: {args.json}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""
+并发压测 - 模拟早高峰：供应商轮询任务、调度员审核、车间地调创建任务，按双轨状态机把任务推进到结束
+对本地运行中的应用发起真实HTTP请求（每个虚拟用户一个线程、独立Cookie），统计各操作延迟、
+数据库锁冲突（database is locked）和其他错误，并输出报告
+
+用法：
+    python -m benchmarks.datagen --db bench.db --tasks 100000
+    DATABASE_PATH=bench.db python app.py
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --suppliers 20 --dispatchers 3 --workshops 5 --duration 60
+"""
+
+import argparse
+import collections
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.datagen import BENCH_PASSWORD, bench_username
+from benchmarks.flows import percentile
+
+# 各角色的操作权重
+ROLE_MIX = {
+    '供应商': {'list': 50, 'stats': 10, 'confirm': 20, 'supplier_confirm': 20},
+    '区域调度员': {'list': 35, 'stats': 15, 'audit': 25, 'create_b': 10, 'advance_b': 15},
+    '车间地调': {'list': 40, 'create_a': 30, 'advance_a': 30}
+}
+
+# 新建任务的初始状态（与 DatabaseManager.create_dispatch_task 一致）
+INITIAL_STATUS = {'轨道A': '待调度员审核', '轨道B': '待供应商响应'}
+
+# 状态推进：(轨道, 当前状态) -> (执行角色, 目标状态)，与 api/audit.py 的流转规则一致
+TRANSITIONS = {
+    ('轨道A', '供应商已响应'): ('车间地调', '车间已核查'),
+    ('轨道A', '车间已核查'): ('供应商', '供应商已确认'),
+    ('轨道A', '供应商已确认'): ('车间地调', '任务结束'),
+    ('轨道B', '供应商已响应'): ('区域调度员', '车间已核查'),
+    ('轨道B', '车间已核查'): ('供应商', '供应商已确认'),
+    ('轨道B', '供应商已确认'): ('区域调度员', '任务结束')
+}
+
+# 操作 -> 可推进的 (轨道, 状态)
+ADVANCE_ACTIONS = {
+    'advance_a': [('轨道A', '供应商已确认'), ('轨道A', '供应商已响应')],
+    'advance_b': [('轨道B', '供应商已确认'), ('轨道B', '供应商已响应')],
+    'supplier_confirm': [('轨道A', '车间已核查'), ('轨道B', '车间已核查')]
+}
+
+LOCK_MARKERS = ('database is locked', 'database table is locked')
+
+REQUEST_TIMEOUT = 30
+
+
+class TaskBoard:
+    """压测中创建的任务按 (轨道, 状态) 排队，供各角色领取推进"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(collections.deque)
+        self._created_at = {}
+        self.completed = []
+
+    def add(self, track, status, task_id, created_at=None):
+        with self._lock:
+            if created_at is not None:
+                self._created_at[task_id] = created_at
+            self._queues[(track, status)].append(task_id)
+
+    def take(self, keys):
+        """按顺序从第一个非空队列领取任务"""
+        with self._lock:
+            for key in keys:
+                if self._queues[key]:
+                    return key, self._queues[key].popleft()
+        return None, None
+
+    def complete(self, task_id):
+        with self._lock:
+            created_at = self._created_at.pop(task_id, None)
+            if created_at is not None:
+                self.completed.append(time.monotonic() - created_at)
+
+    def pending(self):
+        with self._lock:
+            return {f'{track}/{status}': len(queue) for (track, status), queue in self._queues.items() if queue}
+
+
+class Stats:
+    """按操作汇总延迟与错误"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.lock_errors = collections.Counter()
+        self.transport_errors = collections.Counter()
+        self.error_samples = {}
+
+    def record(self, action, elapsed, status, body):
+        with self._lock:
+            self.latencies[action].append(elapsed * 1000)
+            if status is None:
+                self.transport_errors[action] += 1
+            elif any(marker in body for marker in LOCK_MARKERS):
+                self.lock_errors[action] += 1
+            elif status >= 400:
+                self.errors[action] += 1
+                self.error_samples.setdefault(action, f'{status} {body[:200]}')
+
+    def report(self, duration):
+        with self._lock:
+            actions = {}
+            total = 0
+            for action, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                total += len(values)
+                actions[action] = {
+                    'requests': len(values),
+                    'errors': self.errors[action],
+                    'lock_errors': self.lock_errors[action],
+                    'transport_errors': self.transport_errors[action],
+                    'p50_ms': round(percentile(values, 50), 1),
+                    'p95_ms': round(percentile(values, 95), 1),
+                    'p99_ms': round(percentile(values, 99), 1),
+                    'max_ms': round(values[-1], 1)
+                }
+            return {
+                'duration_s': round(duration, 1),
+                'requests': total,
+                'throughput_rps': round(total / duration, 1) if duration else 0.0,
+                'lock_errors': sum(self.lock_errors.values()),
+                'errors': sum(self.errors.values()),
+                'transport_errors': sum(self.transport_errors.values()),
+                'actions': actions,
+                'error_samples': dict(self.error_samples)
+            }
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class VirtualUser(threading.Thread):
+    """一个登录用户：按角色操作权重循环发起请求"""
+
+    def __init__(self, base_url, role, username, board, stats, stop_event, think_time, seed):
+        super().__init__(name=username, daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.role = role
+        self.username = username
+        self.board = board
+        self.stats = stats
+        self.stop_event = stop_event
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+        self.logged_in = False
+
+    def request(self, action, method, path, payload=None, form=None):
+        """发起请求并记录结果，返回 (状态码, 解析后的JSON或None)"""
+        data = None
+        headers = {}
+        if payload is not None:
+            data = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode('utf-8')
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+
+        started = time.perf_counter()
+        status, body = None, ''
+        try:
+            with self.opener.open(req, timeout=REQUEST_TIMEOUT) as response:
+                status, body = response.status, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read().decode('utf-8', 'replace')
+        except OSError as e:
+            body = str(e)
+        self.stats.record(action, time.perf_counter() - started, status, body)
+
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+    def login(self):
+        # 登录排队已满（503）时稍后重试
+        for _ in range(10):
+            status, _ = self.request('login', 'POST', '/login',
+                                     form={'username': self.username, 'password': BENCH_PASSWORD})
+            if status == 302:
+                self.logged_in = True
+                return
+            if status != 503:
+                break
+            time.sleep(1)
+
+    def run(self):
+        self.login()
+        if not self.logged_in:
+            return
+        actions = ROLE_MIX[self.role]
+        while not self.stop_event.is_set():
+            action = self.rng.choices(list(actions), weights=list(actions.values()))[0]
+            getattr(self, f'do_{action}')()
+            if self.think_time:
+                self.stop_event.wait(self.rng.uniform(0.5, 1.5) * self.think_time)
+
+    # 各操作：需要领取任务但队列为空时退化为轮询任务列表
+
+    def do_list(self):
+        page = 1 if self.rng.random() < 0.8 else self.rng.randint(2, 20)
+        self.request('list', 'GET', f'/api/dispatch/tasks?page={page}&limit=20')
+
+    def do_stats(self):
+        self.request('stats', 'GET', '/api/dispatch/statistics')
+
+    def _create(self, action, track):
+        status, body = self.request(action, 'POST', '/api/dispatch/tasks', payload={
+            'requirement_type': self.rng.choice(['正班', '加班']),
+            'start_location': '北京邮区中心局',
+            'end_location': '京沪线',
+            'carrier_company': self.rng.choice(['北京物流有限公司', '上海物流有限公司']),
+            'transport_type': self.rng.choice(['单程', '往返']),
+            'weight': self.rng.choice(['5', '8', '12', '20']),
+            'volume': self.rng.randint(20, 120),
+            'required_time': time.strftime('%Y-%m-%dT%H:%M', time.localtime(time.time() + 86400)),
+            'dispatch_track': track
+        })
+        if status == 200 and body and body.get('success'):
+            data = body['data']
+            self.board.add(data['dispatch_track'], INITIAL_STATUS[data['dispatch_track']], data['task_id'],
+                           created_at=time.monotonic())
+
+    def do_create_a(self):
+        self._create('create_a', '轨道A')
+
+    def do_create_b(self):
+        self._create('create_b', '轨道B')
+
+    def do_audit(self):
+        _, task_id = self.board.take([('轨道A', '待调度员审核')])
+        if task_id is None:
+            return self.do_list()
+        status, body = self.request('audit', 'POST', f'/api/dispatch/tasks/{task_id}/audit',
+                                    payload={'audit_result': '通过', 'audit_note': '压测'})
+        if status == 200 and body and body.get('success'):
+            self.board.add('轨道A', '待供应商响应', task_id)
+        else:
+            self.board.add('轨道A', '待调度员审核', task_id)
+
+    def do_confirm(self):
+        key, task_id = self.board.take([('轨道A', '待供应商响应'), ('轨道B', '待供应商响应')])
+        if task_id is None:
+            return self.do_list()
+        status, body = self.request('confirm', 'POST', f'/api/dispatch/tasks/{task_id}/confirm')
+        if status == 200 and body and body.get('success'):
+            self.board.add(key[0], '供应商已响应', task_id)
+        else:
+            self.board.add(*key, task_id)
+
+    def _advance(self, action):
+        key, task_id = self.board.take(ADVANCE_ACTIONS[action])
+        if task_id is None:
+            return self.do_list()
+        _, new_status = TRANSITIONS[key]
+        status, body = self.request(action, 'PUT', f'/api/dispatch/tasks/{task_id}/status',
+                                    payload={'new_status': new_status, 'note': '压测'})
+        if status == 200 and body and body.get('success'):
+            if new_status == '任务结束':
+                self.board.complete(task_id)
+            else:
+                self.board.add(key[0], new_status, task_id)
+        else:
+            self.board.add(*key, task_id)
+
+    def do_advance_a(self):
+        self._advance('advance_a')
+
+    def do_advance_b(self):
+        self._advance('advance_b')
+
+    def do_supplier_confirm(self):
+        self._advance('supplier_confirm')
+
+
+def run_load_test(base_url, suppliers=20, dispatchers=3, workshops=5, duration=60, ramp_up=10,
+                  think_time=0.5, seed=42):
+    """
+    运行压测
+
+    Args:
+        base_url (str): 应用地址
+        suppliers / dispatchers / workshops (int): 各角色虚拟用户数（使用 benchmarks.datagen 生成的账号）
+        duration (float): 压测时长（秒，从全部用户启动后开始计时）
+        ramp_up (float): 用户逐个启动的总时长（秒）
+        think_time (float): 两次操作之间的平均间隔（秒）
+
+    Returns:
+        dict: 报告
+    """
+    board = TaskBoard()
+    stats = Stats()
+    stop_event = threading.Event()
+
+    users = []
+    for role, count in (('供应商', suppliers), ('区域调度员', dispatchers), ('车间地调', workshops)):
+        for i in range(1, count + 1):
+            users.append(VirtualUser(base_url, role, bench_username(role, i), board, stats, stop_event,
+                                     think_time, seed=seed * 1000 + len(users)))
+    random.Random(seed).shuffle(users)
+
+    for user in users:
+        user.start()
+        time.sleep(ramp_up / max(len(users), 1))
+
+    started = time.monotonic()
+    stop_event.wait(duration)
+    stop_event.set()
+    for user in users:
+        user.join(timeout=REQUEST_TIMEOUT)
+    elapsed = time.monotonic() - started + ramp_up
+
+    report = stats.report(elapsed)
+    report['users'] = {'供应商': suppliers, '区域调度员': dispatchers, '车间地调': workshops,
+                       'logged_in': sum(user.logged_in for user in users)}
+    completed = sorted(board.completed)
+    report['tasks_completed'] = len(completed)
+    report['task_lifecycle_p50_s'] = round(percentile(completed, 50), 2)
+    report['tasks_in_progress'] = board.pending()
+    return report
+
+
+def print_report(report):
+    print(f"时长 {report['duration_s']}s，用户 {report['users']}")
+    print(f"请求 {report['requests']}，吞吐 {report['throughput_rps']}/s，"
+          f"锁冲突 {report['lock_errors']}，其他错误 {report['errors']}，连接错误 {report['transport_errors']}")
+    print(f"完成任务 {report['tasks_completed']}（创建到结束 p50 {report['task_lifecycle_p50_s']}s），"
+          f"进行中 {report['tasks_in_progress']}")
+    header = f"{'操作':<18}{'请求':>7}{'错误':>6}{'锁冲突':>7}{'连接':>6}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'max':>9}"
+    print(header)
+    print('-' * len(header))
+    for action, item in report['actions'].items():
+        print(f"{action:<18}{item['requests']:>7}{item['errors']:>6}{item['lock_errors']:>7}"
+              f"{item['transport_errors']:>6}{item['p50_ms']:>9}{item['p95_ms']:>9}{item['p99_ms']:>9}{item['max_ms']:>9}")
+    for action, sample in report['error_samples'].items():
+        print(f'  {action} 错误示例: {sample}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='派车流程并发压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='应用地址')
+    parser.add_argument('--suppliers', type=int, default=20, help='供应商虚拟用户数')
+    parser.add_argument('--dispatchers', type=int, default=3, help='区域调度员虚拟用户数')
+    parser.add_argument('--workshops', type=int, default=5, help='车间地调虚拟用户数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长（秒）')
+    parser.add_argument('--ramp-up', type=float, default=10, help='用户启动总时长（秒）')
+    parser.add_argument('--think-time', type=float, default=0.5, help='操作间平均间隔（秒）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='报告写入JSON文件')
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args.url, suppliers=args.suppliers, dispatchers=args.dispatchers,
+                           workshops=args.workshops, duration=args.duration, ramp_up=args.ramp_up,
+                           think_time=args.think_time, seed=args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f'报告已保存: {args.json}')
+
+
+if __name__ == '__main__':
+    main()
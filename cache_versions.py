@@ -0,0 +1,30 @@
+"""
+缓存版本模块 - 基于 cache_versions 表的跨进程缓存失效
+写操作递增对应名称的版本号，内存缓存读取前比较版本号决定是否重新加载
+"""
+
+# 缓存名称
+COMPANY_CACHE = 'company'
+ROLE_CACHE = 'role'
+PERMISSION_CACHE = 'permission'
+
+
+def get_cache_version(conn, name):
+    """读取缓存版本号，未记录时返回0"""
+    row = conn.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_cache_version(conn, name):
+    """
+    递增缓存版本号
+
+    在调用方的事务中执行，不单独提交：与数据修改一起提交或回滚
+    """
+    conn.execute('''
+        INSERT INTO cache_versions (name, version, updated_at)
+        VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET
+            version = version + 1,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (name,))
@@ -0,0 +1,250 @@
+"""
+命令行工具模块
+通过 flask --app app <命令> 调用的运维命令
+"""
+
+import csv
+import os
+import subprocess
+import sys
+
+import click
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 只应在导入/导出等路由中按需加载的重量级库
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl']
+
+
+def parse_importtime(output):
+    """
+    解析 python -X importtime 的输出
+
+    Returns:
+        list: [{'module', 'self_us', 'cumulative_us', 'depth'}]，按导入完成顺序排列
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue
+        # 模块名前的缩进（每层两个空格）表示导入嵌套深度
+        name = name[1:]
+        entries.append({
+            'module': name.strip(),
+            'self_us': self_us,
+            'cumulative_us': cumulative_us,
+            'depth': (len(name) - len(name.lstrip(' '))) // 2
+        })
+    return entries
+
+
+def profile_imports(module='app'):
+    """在独立子进程中以 -X importtime 导入指定模块，返回解析结果"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'导入{module}失败: {result.stderr.strip().splitlines()[-1:]}')
+    return parse_importtime(result.stderr)
+
+
+def register_cli_commands(app):
+    """注册所有命令行工具"""
+
+    @app.cli.command('startup-profile')
+    @click.option('--module', default='app', show_default=True, help='要分析的入口模块')
+    @click.option('--top', default=20, show_default=True, help='显示累计耗时最高的模块数')
+    def startup_profile(module, top):
+        """分析应用启动的模块导入耗时（python -X importtime）"""
+        entries = profile_imports(module)
+        if not entries:
+            click.echo('未采集到导入耗时数据')
+            return
+
+        total = next((e for e in reversed(entries) if e['module'] == module), entries[-1])
+        click.echo(f"导入 {module} 总耗时: {total['cumulative_us'] / 1000:.1f} ms，共 {len(entries)} 个模块")
+
+        # 只统计入口模块直接导入的模块，子模块耗时已计入其累计值
+        direct = [e for e in entries if e['depth'] == total['depth'] + 1]
+        ranked = sorted(direct, key=lambda e: e['cumulative_us'], reverse=True)[:top]
+
+        click.echo(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+        for entry in ranked:
+            click.echo(f"{entry['cumulative_us'] / 1000:>10.1f} {entry['self_us'] / 1000:>10.1f}  {entry['module']}")
+
+        loaded = {e['module'].split('.')[0] for e in entries}
+        heavy = [name for name in HEAVY_MODULES if name in loaded]
+        if heavy:
+            click.echo(f"⚠️ 启动时加载了重量级库: {', '.join(heavy)}")
+        else:
+            click.echo(f"✅ 启动时未加载重量级库: {', '.join(HEAVY_MODULES)}")
+
+    @app.cli.command('provision-users')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--dry-run', is_flag=True, help='只校验不写入')
+    @click.option('--output', type=click.Path(dir_okay=False), help='逐行结果（含初始密码）写入CSV文件')
+    def provision_users_command(path, dry_run, output):
+        """从CSV/Excel文件批量创建用户"""
+        from app import get_db
+        from modules.user_management.provisioning import provision_users_from_file
+
+        with open(path, 'rb') as file:
+            result = provision_users_from_file(get_db(), file, os.path.basename(path), dry_run=dry_run)
+
+        action = '校验通过' if dry_run else '创建成功'
+        click.echo(f"共 {result['total']} 行，{action} {result['success']} 行，失败 {result['fail']} 行")
+        for error in result['errors']:
+            click.echo(f'  {error}')
+
+        if output:
+            with open(output, 'w', encoding='utf-8-sig', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['行号', '用户名', '状态', '用户ID', '初始密码', '说明'])
+                for row in result['rows']:
+                    writer.writerow([row['row'], row['username'], row['status'], row.get('id', ''),
+                                     row.get('initial_password', ''), row.get('message', '')])
+            click.echo(f'逐行结果已写入: {output}')
+
+    @app.cli.command('init-db')
+    @click.option('--force', is_flag=True, help='忽略表结构版本号，重新执行建表与默认数据')
+    def init_db_command(force):
+        """初始化数据库（表结构已是当前版本时跳过）"""
+        from db_manager import DatabaseManager
+
+        result = DatabaseManager.init_database(app.config['DATABASE'], force=force)
+        if result['bootstrapped']:
+            click.echo(f"数据库已初始化，表结构版本 {result['schema_version']}")
+        else:
+            click.echo(f"表结构已是版本 {result['schema_version']}，无需初始化（--force 强制执行）")
+
+    @app.cli.command('settlement-sync')
+    @click.option('--month', required=True, help='结算期 YYYY-MM')
+    @click.option('--rebuild-summary', is_flag=True, help='同时从台账重新汇总该结算期')
+    def settlement_sync_command(month, rebuild_summary):
+        """按当前运价核对结算台账：补录未入账的已结束任务，金额变化的冲销后重新入账"""
+        from app import get_db
+        from modules.reconciliation.ledger import parse_period, rebuild_summary as rebuild, sync_period
+
+        period = parse_period(month)
+        result = sync_period(get_db(), period, operator='cli')
+        click.echo(f"{period}: 入账 {result['posted']} 条，冲销 {result['reversed']} 条")
+        if rebuild_summary:
+            rebuild(get_db(), period)
+            click.echo('汇总已重建')
+
+    @app.cli.command('exceptions-refresh')
+    @click.option('--month', help='全量复核的结算期 YYYY-MM，不指定时只复核有变化的任务')
+    def exceptions_refresh_command(month):
+        """复核对账异常规则：默认处理待复核任务，指定月份时全量复核该结算期"""
+        from app import get_db
+        from modules.reconciliation.ledger import parse_period
+        from modules.reconciliation.exception_rules import evaluate_period, refresh_exceptions
+
+        if month:
+            period = parse_period(month)
+            result = evaluate_period(get_db(), period)
+            click.echo(f"{period}: 新增或变化 {result['opened']} 条，自动解决 {result['resolved']} 条")
+        else:
+            result = refresh_exceptions(get_db())
+            click.echo(f"复核任务 {result['tasks']} 个：新增或变化 {result['opened']} 条，"
+                       f"自动解决 {result['resolved']} 条")
+
+    @app.cli.command('archive-tasks')
+    @click.option('--days', type=int, help='保留天数，默认取配置 ARCHIVE_RETENTION_DAYS')
+    @click.option('--batch-size', default=5000, show_default=True, help='每批归档（单独提交）的任务数')
+    def archive_tasks_command(days, batch_size):
+        """把超过保留天数的已结束/已取消任务移入归档库（适合由cron定期执行）"""
+        from app import get_db
+        from config import ARCHIVE_RETENTION_DAYS
+        from task_archive import archive_tasks
+
+        result = archive_tasks(get_db(), ARCHIVE_RETENTION_DAYS if days is None else days, batch_size)
+        click.echo(f"已归档 {result['archived']} 个任务（用车日期早于 {result['cutoff']}）")
+
+    @app.cli.command('backup-create')
+    @click.option('--label', default='定时', show_default=True, help='快照类型说明')
+    def backup_create_command(label):
+        """在线创建数据库快照并按保留策略清理旧快照（适合由cron定期执行）"""
+        from backup_service import create_snapshot
+
+        manifest = create_snapshot(app.config['DATABASE'], label)
+        click.echo(f"快照 {manifest['id']} 已创建：{manifest['size'] / 1048576:.1f} MB，"
+                   f"耗时 {manifest['duration_ms'] / 1000:.1f} 秒")
+        if manifest['removed']:
+            click.echo(f"已清理过期快照: {', '.join(manifest['removed'])}")
+
+    @app.cli.command('backup-list')
+    def backup_list_command():
+        """列出数据库快照"""
+        from backup_service import list_snapshots
+
+        for manifest in list_snapshots():
+            click.echo(f"{manifest['id']}  {manifest['created_at']}  {manifest['size'] / 1048576:8.1f} MB  "
+                       f"{manifest['label']}")
+
+    @app.cli.command('backup-restore')
+    @click.argument('snapshot_id')
+    @click.confirmation_option(prompt='恢复会覆盖当前数据库，确定继续吗？')
+    def backup_restore_command(snapshot_id):
+        """从快照恢复数据库（恢复前自动为当前数据创建快照）"""
+        from backup_service import restore_snapshot
+
+        try:
+            result = restore_snapshot(app.config['DATABASE'], snapshot_id)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"已从快照 {result['snapshot_id']} 恢复，恢复前数据保存在快照 {result['pre_restore_snapshot']}")
+
+    @app.cli.command('feishu-sync')
+    @click.option('--purge', is_flag=True, help='同时清理超过保留天数的已同步事件')
+    def feishu_sync_command(purge):
+        """推送飞书审批同步发件箱中全部到期事件（未启动后台推送线程时适合由cron执行）"""
+        from app import get_db
+        from modules.reconciliation.feishu_sync import drain_outbox, get_approval_client, purge_synced
+
+        client = get_approval_client()
+        if client is None:
+            raise click.ClickException('未配置审批系统地址（FEISHU_APPROVAL_URL）')
+        conn = get_db()
+        result = drain_outbox(conn, client)
+        click.echo(f"推送 {result['claimed']} 条：成功 {result['synced']} 条，待重试 {result['retried']} 条，"
+                   f"失败 {result['failed']} 条")
+        if purge:
+            click.echo(f'已清理已同步事件 {purge_synced(conn)} 条')
+
+    @app.cli.command('cost-rollup')
+    @click.option('--full', is_flag=True, help='从在途库和归档库重建全部日期的成本汇总')
+    def cost_rollup_command(full):
+        """重算邮路成本汇总：默认处理待重算日期（适合由cron定期执行）"""
+        from app import get_db
+        from modules.cost_analysis.cost_engine import FULL_REFRESH_MARK, refresh_route_costs
+
+        conn = get_db()
+        if full:
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO route_cost_dirty_days (day) VALUES (?)', (FULL_REFRESH_MARK,))
+        result = refresh_route_costs(conn)
+        click.echo(f"已重算 {result['days']} 天的成本汇总")
+
+    @app.cli.command('rollup-refresh')
+    @click.option('--full', is_flag=True, help='从在途库和归档库重建全部日期的派车分析汇总')
+    def rollup_refresh_command(full):
+        """重算派车分析汇总：默认处理待重算日期（适合由cron定期执行）"""
+        from app import get_db
+        from dispatch_rollup import mark_full_refresh, refresh_rollup
+
+        conn = get_db()
+        if full:
+            mark_full_refresh(conn)
+        result = refresh_rollup(conn)
+        click.echo(f"已重算 {result['days']} 天的派车分析汇总")
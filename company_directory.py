@@ -0,0 +1,136 @@
+"""
+单位目录模块 - 内存中的单位名称索引
+按名称排序的数组 + 名称到ID的映射，支持名称前缀和拼音首字母检索
+与 reference_cache.company_cache 共用单位缓存版本号，随单位数据变更一起失效
+"""
+
+from bisect import bisect_left
+
+from cache_versions import COMPANY_CACHE
+from reference_cache import VersionedCache
+
+# 检索结果默认/最大返回数量
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 200
+
+# GB2312一级汉字按拼音排序，以各声母首字的区位码为分界即可得到首字母
+_PINYIN_BOUNDARIES = [
+    (-20319, 'a'), (-20283, 'b'), (-19775, 'c'), (-19218, 'd'), (-18710, 'e'),
+    (-18526, 'f'), (-18239, 'g'), (-17922, 'h'), (-17417, 'j'), (-16474, 'k'),
+    (-16212, 'l'), (-15640, 'm'), (-15165, 'n'), (-14922, 'o'), (-14914, 'p'),
+    (-14630, 'q'), (-14149, 'r'), (-14090, 's'), (-13318, 't'), (-12838, 'w'),
+    (-12556, 'x'), (-11847, 'y'), (-11055, 'z')
+]
+_PINYIN_CODES = [code for code, _ in _PINYIN_BOUNDARIES]
+_PINYIN_END = -10247
+
+
+def pinyin_initial(char):
+    """
+    获取单个字符的拼音首字母
+
+    字母数字原样返回（小写）；GB2312二级汉字按部首排序，无法推算，返回空字符串
+    """
+    if char.isascii():
+        return char.lower() if char.isalnum() else ''
+    try:
+        encoded = char.encode('gb2312')
+    except UnicodeEncodeError:
+        return ''
+    if len(encoded) != 2:
+        return ''
+    code = (encoded[0] << 8 | encoded[1]) - 65536
+    if code < _PINYIN_CODES[0] or code >= _PINYIN_END:
+        return ''
+    return _PINYIN_BOUNDARIES[bisect_left(_PINYIN_CODES, code + 1) - 1][1]
+
+
+def pinyin_initials(text):
+    """获取字符串的拼音首字母串，如 '顺丰速运' -> 'sfsy'"""
+    return ''.join(pinyin_initial(char) for char in text)
+
+
+def _prefix_matches(keys, prefix):
+    """在已排序的 (key, index) 列表中产出以 prefix 开头的索引"""
+    position = bisect_left(keys, (prefix,))
+    while position < len(keys) and keys[position][0].startswith(prefix):
+        yield keys[position][1]
+        position += 1
+
+
+class _Index:
+    """一次加载得到的不可变索引，重新加载时整体替换"""
+
+    def __init__(self, companies):
+        self.companies = companies
+        self.ids = {company['name']: company['id'] for company in companies}
+        self.folded_names = [company['name'].casefold() for company in companies]
+        self.name_keys = sorted((name, index) for index, name in enumerate(self.folded_names))
+        self.initial_keys = sorted((pinyin_initials(company['name']), index)
+                                   for index, company in enumerate(companies))
+
+
+def _load_index(conn):
+    rows = conn.execute('SELECT id, name FROM Company ORDER BY name').fetchall()
+    return _Index([{'id': row[0], 'name': row[1]} for row in rows])
+
+
+class CompanyDirectory:
+    """单位目录：首次使用或版本号变化时从数据库整体加载"""
+
+    def __init__(self):
+        self._cache = VersionedCache(COMPANY_CACHE, _load_index)
+
+    def _current(self, conn):
+        """返回当前索引，单位数据有变更时重新加载"""
+        return self._cache.get(conn)
+
+    def all(self, conn):
+        """按名称排序的全部单位"""
+        return list(self._current(conn).companies)
+
+    def get_id(self, conn, name):
+        """按名称精确查找单位ID，不存在时返回None"""
+        return self._current(conn).ids.get(name)
+
+    def search(self, conn, query, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        检索单位
+
+        依次返回名称前缀匹配、拼音首字母前缀匹配、名称包含匹配的结果（各组内按名称排序，整体去重）
+
+        Args:
+            conn: 数据库连接
+            query (str): 检索词
+            limit (int): 最大返回数量
+
+        Returns:
+            list: [{'id', 'name'}]
+        """
+        directory = self._current(conn)
+        companies = directory.companies
+
+        query = (query or '').strip().casefold()
+        if not query:
+            return companies[:limit]
+
+        matched = []
+        seen = set()
+
+        def collect(indexes):
+            for index in indexes:
+                if len(matched) >= limit:
+                    return
+                if index not in seen:
+                    seen.add(index)
+                    matched.append(index)
+
+        collect(sorted(_prefix_matches(directory.name_keys, query)))
+        if query.isascii():
+            collect(sorted(_prefix_matches(directory.initial_keys, query)))
+        collect(index for index, name in enumerate(directory.folded_names) if query in name)
+
+        return [companies[index] for index in matched]
+
+
+company_directory = CompanyDirectory()
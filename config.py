@@ -4,17 +4,62 @@ from secrets import token_hex
 
 # 数据库配置 - 集中管理数据库路径
 # 根据环境变量决定使用的数据库路径
-# 在 config.py 开头添加
-print("=== config.py 环境变量调试 ===")
-print(f"FLASK_ENV: {os.environ.get('FLASK_ENV')}")
-print(f"SECRET_KEY 存在吗: {os.environ.get('SECRET_KEY') is not None}")  # 应显示 True
-if os.environ.get('FLASK_ENV') == 'production':
+if os.environ.get('DATABASE_PATH'):
+    DATABASE = os.environ['DATABASE_PATH']  # 显式指定（基准测试等场景）
+elif os.environ.get('FLASK_ENV') == 'production':
     DATABASE = '/var/www/flask_app/database.db'  # 服务器环境
 else:
     DATABASE = 'database.db'  # 本地开发环境 (默认)
 
+# 后台任务配置 - 导入/导出等耗时操作在后台线程池中执行
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))
+JOB_RESULT_DIR = os.environ.get('JOB_RESULT_DIR') or 'job_results'  # 任务结果文件存放目录
+JOB_RETENTION_DAYS = 7  # 已结束任务及其结果文件的保留天数
+
+# 任务归档配置 - 超过保留天数的已结束/已取消任务移入归档库，分析查询合并读取
+ARCHIVE_DATABASE = os.environ.get('ARCHIVE_DATABASE_PATH')  # 未指定时放在主库文件旁（xxx_archive.db）
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 180))
+
+# 数据库备份配置 - 在线备份接口分批复制，快照压缩后按保留策略清理
+BACKUP_DIR = os.environ.get('BACKUP_DIR') or 'backups'
+BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', 30))
+BACKUP_MIN_KEEP = 5  # 无论是否过期，始终保留最近的快照份数
+BACKUP_PAGES_PER_STEP = 1024  # 每批复制的页数，批次之间释放读锁让写操作提交
+
+# 飞书审批同步配置 - 结算入账、异常审核事件在业务事务中写入发件箱，后台线程批量推送到审批系统
+FEISHU_APPROVAL_URL = os.environ.get('FEISHU_APPROVAL_URL')  # 审批系统地址，未配置时事件只保存在发件箱中
+FEISHU_APPROVAL_TOKEN = os.environ.get('FEISHU_APPROVAL_TOKEN')
+FEISHU_SYNC_BATCH_SIZE = int(os.environ.get('FEISHU_SYNC_BATCH_SIZE', 100))  # 每次请求推送的事件数
+FEISHU_SYNC_POLL_INTERVAL = float(os.environ.get('FEISHU_SYNC_POLL_INTERVAL', 2))  # 无待推送事件时的轮询间隔（秒）
+FEISHU_SYNC_TIMEOUT = 10  # 单次请求超时（秒）
+FEISHU_SYNC_MAX_ATTEMPTS = 8  # 超过后标记为同步失败，需手动重新同步
+FEISHU_SYNC_BACKOFF_BASE = 5  # 重试间隔（秒）按 5、10、20…… 递增
+FEISHU_SYNC_BACKOFF_MAX = 3600
+FEISHU_OUTBOX_RETENTION_DAYS = 30  # 已同步事件的保留天数
+
+# 批量开通账号配置 - 密码哈希在进程池中并行计算
+PROVISIONING_HASH_WORKERS = int(os.environ.get('PROVISIONING_HASH_WORKERS', os.cpu_count() or 2))
+
+# 密码哈希配置 - 修改算法或迭代次数后，用户下次登录时自动按新参数重新哈希
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')  # werkzeug哈希方法
+PASSWORD_SALT_LENGTH = 16
+PASSWORD_VERIFY_WORKERS = int(os.environ.get('PASSWORD_VERIFY_WORKERS', 2))  # 同时进行密码校验的线程数
+PASSWORD_VERIFY_QUEUE_SIZE = int(os.environ.get('PASSWORD_VERIFY_QUEUE_SIZE', 32))  # 排队等待校验的最大请求数
+PASSWORD_VERIFY_TIMEOUT = 10  # 排队已满时等待空位的秒数，超时返回登录繁忙
+
+# 会话配置 - 会话数据保存在服务端，Cookie中只有会话ID
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')  # sqlite（多进程共享）或 memory（单进程）
+SESSION_LIFETIME = int(os.environ.get('SESSION_LIFETIME', 3600))  # 会话有效期（秒）
+SESSION_MEMORY_MAX_ENTRIES = 10000  # memory后端最多保留的会话数
+
+# 性能指标配置 - 请求耗时、SQL次数与耗时，通过 /metrics 输出
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))  # 超过该耗时的SQL记录慢查询日志
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'  # 慢查询自动执行 EXPLAIN QUERY PLAN
+
 # 安全配置
 SECRET_KEY = os.environ.get('SECRET_KEY') or token_hex(32)  # 32字节的随机密钥
 
-print(f"FLASK_ENV: {os.environ.get('FLASK_ENV')}")
-print(f"当前数据库路径: {DATABASE}")
+# 日志配置
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')  # DEBUG/INFO/WARNING/ERROR
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text（便于阅读）或 json（便于日志采集）
@@ -84,6 +84,17 @@ class AuditStatus(Enum):
     def all_values(cls):
         return [status.value for status in cls]
 
+class JobStatus(Enum):
+    """后台任务状态枚举"""
+    QUEUED = "等待中"
+    RUNNING = "执行中"
+    SUCCEEDED = "已完成"
+    FAILED = "失败"
+    
+    @classmethod
+    def all_values(cls):
+        return [status.value for status in cls]
+
 class DatabaseTables(Enum):
     """数据库表名枚举"""
     USER = "User"
@@ -95,6 +106,9 @@ class DatabaseTables(Enum):
     MANUAL_DISPATCH_TASKS = "manual_dispatch_tasks"
     VEHICLES = "vehicles"
     DISPATCH_STATUS_HISTORY = "dispatch_status_history"
+    BACKGROUND_JOBS = "background_jobs"
+    CACHE_VERSIONS = "cache_versions"
+    SESSIONS = "sessions"
 
 class PermissionModules(Enum):
     """权限模块枚举"""
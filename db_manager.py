@@ -1,44 +1,59 @@
+import logging
 import sqlite3
 import os
+from contextlib import contextmanager
 from datetime import datetime
 from config import DATABASE  # 从config.py导入数据库路径配置
+from cache_versions import bump_cache_version, PERMISSION_CACHE
+from metrics import InstrumentedConnection
+
+logger = logging.getLogger(__name__)
+
+# 表结构版本，保存在 PRAGMA user_version 中；修改表结构或默认数据时递增
+SCHEMA_VERSION = 10
+
+# 等待其他工作进程完成初始化的最长时间（秒）
+BOOTSTRAP_LOCK_TIMEOUT = 300
+
 
 class DatabaseManager:
     def __init__(self, db_path=DATABASE):
+        """创建管理器并连接数据库；建表等初始化只在启动阶段通过 initialize() 执行"""
         self.db_path = db_path
         self.conn = None
         self.cursor = None
         self.connect()
-        self.create_tables()
-        self.insert_default_data()
-        self.insert_sample_dispatch_data()
-        self.update_manual_dispatch_tables()  # 更新现有表结构
 
     def connect(self):
-        """连接到数据库"""
+        """连接到数据库（已连接时直接返回）"""
+        if self.conn is not None:
+            return True
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            # 使用带计时的连接，SQL次数与耗时计入请求指标
+            self.conn = sqlite3.connect(self.db_path, factory=InstrumentedConnection)
             # 设置row_factory为sqlite3.Row，以便将查询结果转换为字典
             self.conn.row_factory = sqlite3.Row
             # 启用外键约束
             self.conn.execute('PRAGMA foreign_keys = ON')
             self.cursor = self.conn.cursor()
-            print(f'成功连接到数据库: {self.db_path}')
+            logger.debug(f'成功连接到数据库: {self.db_path}')
             return True
         except Exception as e:
-            print(f'连接数据库失败: {str(e)}')
+            logger.error(f'连接数据库失败: {str(e)}')
             return False
 
     def disconnect(self):
         """断开数据库连接"""
         if self.conn:
             self.conn.close()
-            print('数据库连接已关闭')
+            self.conn = None
+            self.cursor = None
+            logger.debug('数据库连接已关闭')
 
     def check_table_exists(self, table_name):
         """检查表是否存在"""
         if not self.cursor:
-            print('未连接到数据库')
+            logger.warning('未连接到数据库')
             return False
 
         try:
@@ -46,54 +61,54 @@ class DatabaseManager:
             result = self.cursor.fetchone()
             return result is not None
         except Exception as e:
-            print(f'检查表{table_name}失败: {str(e)}')
+            logger.error(f'检查表{table_name}失败: {str(e)}')
             return False
 
     def list_tables(self):
         """列出所有表"""
         if not self.cursor:
-            print('未连接到数据库')
+            logger.warning('未连接到数据库')
             return []
 
         try:
             self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             return [row[0] for row in self.cursor.fetchall()]
         except Exception as e:
-            print(f'列出表失败: {str(e)}')
+            logger.error(f'列出表失败: {str(e)}')
             return []
 
     def check_user_table(self):
         """检查用户表结构和数据"""
         if not self.check_table_exists('User'):
-            print('用户表不存在')
+            logger.info('用户表不存在')
             return False
 
         try:
             # 检查表结构
             self.cursor.execute("PRAGMA table_info(User);")
             columns = self.cursor.fetchall()
-            print('用户表结构:')
+            logger.info('用户表结构:')
             for column in columns:
-                print(f'  {column[1]} ({column[2]})')
+                logger.info(f'  {column[1]} ({column[2]})')
 
             # 检查数据
             self.cursor.execute("SELECT id, username, full_name, is_active FROM User;")
             users = self.cursor.fetchall()
-            print('用户数据:')
+            logger.info('用户数据:')
             if not users:
-                print('  没有找到用户数据')
+                logger.info('  没有找到用户数据')
             else:
                 for user in users:
-                    print(f'  ID: {user[0]}, 用户名: {user[1]}, 姓名: {user[2]}, 激活状态: {user[3]}')
+                    logger.info(f'  ID: {user[0]}, 用户名: {user[1]}, 姓名: {user[2]}, 激活状态: {user[3]}')
             return True
         except Exception as e:
-            print(f'检查用户表失败: {str(e)}')
+            logger.error(f'检查用户表失败: {str(e)}')
             return False
 
     def create_manual_dispatch_tables(self):
         """创建人工派车相关表"""
         if not self.cursor:
-            print('数据库未连接')
+            logger.warning('数据库未连接')
             return False
 
         try:
@@ -150,7 +165,7 @@ class DatabaseManager:
             existing_data = None
             if 'manifest_serial' in columns:
                 # 需要重建表来移除manifest_serial字段
-                print("检测到vehicles表包含manifest_serial字段，正在重建表...")
+                logger.warning("检测到vehicles表包含manifest_serial字段，正在重建表...")
                 
                 # 备份现有数据
                 self.cursor.execute("SELECT * FROM vehicles")
@@ -186,7 +201,7 @@ class DatabaseManager:
                         INSERT INTO vehicles (id, task_id, manifest_number, dispatch_number, license_plate, carriage_number, actual_volume, volume_photo_url, volume_modified_by, created_at)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                         ''', new_row)
-                    print(f"已迁移{len(existing_data)}条车辆记录到新表结构")
+                    logger.info(f"已迁移{len(existing_data)}条车辆记录到新表结构")
             else:
                 # 创建新表
                 self.cursor.execute('''
@@ -242,12 +257,12 @@ class DatabaseManager:
             self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_vehicle_capacity_type ON vehicle_capacity_reference(vehicle_type)')
 
             self.conn.commit()
-            print('人工派车相关表创建成功')
+            logger.debug('人工派车相关表创建成功')
             return True
             
         except Exception as e:
             self.conn.rollback()
-            print(f'创建表失败: {str(e)}')
+            logger.error(f'创建表失败: {str(e)}')
             return False
 
     def insert_sample_dispatch_data(self):
@@ -259,7 +274,7 @@ class DatabaseManager:
             # 检查是否已有数据
             self.cursor.execute('SELECT COUNT(*) FROM manual_dispatch_tasks')
             if self.cursor.fetchone()[0] > 0:
-                print('派车任务表中已有数据，跳过插入示例数据')
+                logger.debug('派车任务表中已有数据，跳过插入示例数据')
                 return True
 
             # 插入示例任务（包含双轨派车字段，使用新的清晰命名）
@@ -324,17 +339,17 @@ class DatabaseManager:
                 (vehicle_type, standard_volume, license_plate, suppliers, created_at, updated_at)
                 VALUES (?, ?, ?, ?, ?, ?)
                 ''', sample_capacity_data)
-                print('车辆容积参考表示例数据插入成功')
+                logger.info('车辆容积参考表示例数据插入成功')
             else:
-                print('车辆容积参考表中已有数据，跳过插入示例数据')
+                logger.debug('车辆容积参考表中已有数据，跳过插入示例数据')
 
             self.conn.commit()
-            print('示例数据插入成功')
+            logger.info('示例数据插入成功')
             return True
             
         except Exception as e:
             self.conn.rollback()
-            print(f'插入示例数据失败: {str(e)}')
+            logger.error(f'插入示例数据失败: {str(e)}')
             return False
 
     # 人工派车业务方法
@@ -344,7 +359,8 @@ class DatabaseManager:
             return {'success': False, 'error': '数据库未连接'}
 
         try:
-            task_id = f"T{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            # 精确到微秒，同一秒内创建多个任务时不会主键冲突
+            task_id = f"T{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
             
             # 确定流程轨道和审核需求
             initiator_role = task_data.get('initiator_role', '车间地调')
@@ -374,7 +390,7 @@ class DatabaseManager:
              transport_type, requirement_type, volume, weight, special_requirements,
              dispatch_track, initiator_role, initiator_user_id, initiator_department,
              audit_required, current_handler_role, current_handler_user_id, status, assigned_supplier_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 task_id,
                 task_data['required_date'],
@@ -456,7 +472,7 @@ class DatabaseManager:
             return {'success': True, 'data': data}
             
         except Exception as e:
-            print(f'获取车辆容积参考数据失败: {str(e)}')
+            logger.error(f'获取车辆容积参考数据失败: {str(e)}')
             return {'success': False, 'error': str(e), 'data': []}
     
     def upsert_vehicle_capacity_reference(self, vehicle_type, standard_volume, license_plate, suppliers):
@@ -570,7 +586,7 @@ class DatabaseManager:
             return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
             
         except Exception as e:
-            print(f'获取任务列表失败: {str(e)}')
+            logger.error(f'获取任务列表失败: {str(e)}')
             return []
 
     def update_task_status(self, task_id, new_status, operator, note=None):
@@ -607,7 +623,7 @@ class DatabaseManager:
             row = self.cursor.fetchone()
             return row[0] if row else None
         except Exception as e:
-            print(f'获取公司ID失败: {str(e)}')
+            logger.error(f'获取公司ID失败: {str(e)}')
             return None
 
     def assign_vehicle(self, task_id, vehicle_data):
@@ -652,7 +668,7 @@ class DatabaseManager:
             return None
             
         except Exception as e:
-            print(f'获取任务详情失败: {str(e)}')
+            logger.error(f'获取任务详情失败: {str(e)}')
             return None
 
     def get_task_status_history(self, task_id):
@@ -670,31 +686,82 @@ class DatabaseManager:
             return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
             
         except Exception as e:
-            print(f'获取状态历史失败: {str(e)}')
+            logger.error(f'获取状态历史失败: {str(e)}')
             return []
 
+    def schema_version(self):
+        """读取数据库中记录的表结构版本（PRAGMA user_version）"""
+        if not self.connect():
+            return None
+        # 读完结果，不让语句继续占用共享锁
+        return self.cursor.execute('PRAGMA user_version').fetchall()[0][0]
+
+    @contextmanager
+    def _bootstrap_lock(self):
+        """
+        初始化互斥锁：多个工作进程同时启动时只有一个执行建表，其余等待后重新读取版本号
+
+        各建表步骤会分别提交，无法在主库上用一个写事务覆盖全过程，
+        因此在主库旁的锁文件上持有排他事务作为跨进程锁
+        """
+        if self.db_path == ':memory:':
+            yield
+            return
+        lock_conn = sqlite3.connect(f'{self.db_path}.init-lock', timeout=BOOTSTRAP_LOCK_TIMEOUT,
+                                    isolation_level=None)
+        try:
+            lock_conn.execute('BEGIN EXCLUSIVE')
+            yield
+        finally:
+            lock_conn.close()
+
+    def initialize(self, force=False):
+        """
+        启动阶段的一次性初始化：建表、补齐字段、写入默认数据与示例数据
+        数据库已是当前版本时直接跳过，多个工作进程启动时只有一个执行建表，
+        任一步骤失败时不更新版本号，下次启动重新执行
+
+        Args:
+            force (bool): 忽略版本号强制执行
+
+        Returns:
+            dict: {'bootstrapped': 是否执行了初始化, 'schema_version': 当前版本}
+        """
+        current = self.schema_version()
+        if current is None:
+            raise RuntimeError('数据库连接失败')
+        if current >= SCHEMA_VERSION and not force:
+            logger.debug(f'表结构已是版本 {current}，跳过初始化')
+            return {'bootstrapped': False, 'schema_version': current}
+
+        with self._bootstrap_lock():
+            # 等待锁期间其他工作进程可能已完成初始化
+            current = self.schema_version()
+            if current >= SCHEMA_VERSION and not force:
+                logger.debug(f'表结构已由其他进程初始化到版本 {current}')
+                return {'bootstrapped': False, 'schema_version': current}
+
+            if not self.create_tables():
+                raise RuntimeError('初始化表失败，表结构版本未更新')
+            self.insert_sample_dispatch_data()
+            self.cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.conn.commit()
+        logger.info(f'表结构已初始化到版本 {SCHEMA_VERSION}（原版本 {current}）')
+        return {'bootstrapped': True, 'schema_version': SCHEMA_VERSION}
+
     @staticmethod
-    def init_database():
+    def init_database(db_path=DATABASE, force=False):
         """静态方法：初始化数据库，创建所有缺失的表"""
+        db_manager = DatabaseManager(db_path)
         try:
-            db_manager = DatabaseManager()
-            if db_manager.connect():
-                # 初始化所有数据库表
-                db_manager.create_tables()
-                print("✅ 数据库初始化完成")
-                db_manager.disconnect()
-                return True
-            else:
-                print("❌ 数据库连接失败")
-                return False
-        except Exception as e:
-            print(f"❌ 数据库初始化失败: {e}")
-            return False
+            return db_manager.initialize(force=force)
+        finally:
+            db_manager.disconnect()
 
     def update_manual_dispatch_tables(self):
         """更新现有表结构，添加双轨派车所需字段"""
         if not self.cursor:
-            print('数据库未连接')
+            logger.warning('数据库未连接')
             return False
 
         try:
@@ -721,9 +788,9 @@ class DatabaseManager:
             for column_name, column_def in new_columns:
                 if column_name not in existing_columns:
                     self.cursor.execute(f"ALTER TABLE manual_dispatch_tasks ADD COLUMN {column_name} {column_def}")
-                    print(f"✅ 添加字段: {column_name}")
+                    logger.info(f"添加字段: {column_name}")
                 else:
-                    print(f"⏭️ 字段已存在: {column_name}")
+                    logger.debug(f"字段已存在: {column_name}")
             
             # 添加外键约束
             if "auditor_user_id" in existing_columns:
@@ -731,7 +798,7 @@ class DatabaseManager:
                 self.cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='manual_dispatch_tasks'")
                 table_sql = self.cursor.fetchone()[0]
                 if "auditor_user_id" in table_sql and "REFERENCES User(id)" not in table_sql and "REFERENCES users(id)" not in table_sql:
-                    print("注意：无法直接添加外键约束，需要重新创建表")
+                    logger.warning("注意：无法直接添加外键约束，需要重新创建表")
             
             # 添加索引
             self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_manual_dispatch_status ON manual_dispatch_tasks(status)")
@@ -743,52 +810,663 @@ class DatabaseManager:
             self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_manual_dispatch_supplier ON manual_dispatch_tasks(assigned_supplier_id)")
             
             self.conn.commit()
-            print("✅ 表结构更新完成")
+            logger.debug("表结构更新完成")
             return True
             
         except Exception as e:
             self.conn.rollback()
-            print(f"❌ 更新表结构失败: {str(e)}")
+            logger.error(f"更新表结构失败: {str(e)}")
             return False
 
     def create_tables(self):
         """
         初始化所有数据库表
-        包括用户管理、公司管理、人工派车等所有表
+        包括用户管理、公司管理、人工派车等所有表；任一步骤失败即停止并返回False
         """
         if not self.connect():
             return False
-        
+
+        steps = [
+            (self.create_user_tables, '用户管理相关表创建'),
+            (self.create_user_search_index, '用户检索全文索引创建'),
+            (self.create_manual_dispatch_tables, '人工派车相关表创建'),
+            # 添加双轨派车字段
+            (self.update_manual_dispatch_tables, '表结构更新'),
+            (self.validate_and_update_status_fields, '状态字段验证'),
+            (self.create_job_tables, '后台任务表创建'),
+            (self.create_cache_version_table, '缓存版本表创建'),
+            (self.create_session_table, '服务端会话表创建'),
+            (self.create_settlement_tables, '结算相关表创建'),
+            (self.create_statement_tables, '对账单接入表创建'),
+            (self.create_exception_tables, '对账异常表创建'),
+            (self.create_feishu_outbox_table, '飞书审批同步发件箱创建'),
+            (self.create_cost_tables, '邮路成本汇总表创建'),
+            (self.create_rollup_tables, '派车分析汇总表创建'),
+            (self.insert_default_data, '默认数据插入'),
+        ]
         try:
-            # 创建用户管理相关表
-            self.create_user_tables()
-            print("✅ 用户管理相关表创建成功")
-            
-            # 创建人工派车相关表
-            self.create_manual_dispatch_tables()
-            print("✅ 人工派车相关表创建成功")
-            
-            # 更新现有表结构（添加双轨派车字段）
-            self.update_manual_dispatch_tables()
-            print("✅ 表结构更新完成")
-            
-            # 验证和更新状态字段
-            self.validate_and_update_status_fields()
-            print("✅ 状态字段验证完成")
-            
-            # 插入默认数据
-            self.insert_default_data()
-            
+            for step, name in steps:
+                # 各步骤出错时自行回滚并返回False
+                if not step():
+                    logger.error(f'{name}失败，停止初始化')
+                    return False
+                logger.debug(f'{name}完成')
+            return True
+        except Exception as e:
+            logger.error(f"初始化表失败: {str(e)}")
+            self.conn.rollback()
+            return False
+
+    def create_job_tables(self):
+        """创建后台任务表（导入/导出等耗时操作的状态与进度）"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT '等待中' CHECK(status IN ('等待中', '执行中', '已完成', '失败')),
+                progress_current INTEGER DEFAULT 0,
+                progress_total INTEGER,
+                message TEXT,
+                result_json TEXT,
+                result_file TEXT,
+                result_filename TEXT,
+                error TEXT,
+                created_by INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                started_at TEXT,
+                finished_at TEXT,
+                FOREIGN KEY (created_by) REFERENCES User(id) ON DELETE SET NULL
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON background_jobs(status, finished_at)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建后台任务表失败: {str(e)}')
+            return False
+
+    def create_settlement_tables(self):
+        """创建结算相关表：承运商运价、结算台账与汇总"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            # 重量段为 [weight_min, weight_max)，weight_max 为空表示不设上限
+            # 每趟费用 = base_price + volume_price * 计费容积（实际装载容积，未录入时取需求容积）
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS carrier_tariffs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                carrier_company TEXT NOT NULL,
+                transport_type TEXT CHECK(transport_type IN ('单程', '往返')) NOT NULL,
+                requirement_type TEXT CHECK(requirement_type IN ('正班', '加班')) NOT NULL,
+                weight_min REAL NOT NULL DEFAULT 0 CHECK(weight_min >= 0),
+                weight_max REAL CHECK(weight_max IS NULL OR weight_max > weight_min),
+                base_price REAL NOT NULL DEFAULT 0,
+                volume_price REAL NOT NULL DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (carrier_company, transport_type, requirement_type, weight_min)
+            )
+            ''')
+            # 结算台账：只追加，更正时写入冲销记录再重新入账；period 为用车日期所在月份
+            # task_id 引用在途库或归档库中的任务，不设外键（任务归档后仍保留台账记录）
+            ledger_sql = '''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                period TEXT NOT NULL,
+                carrier_company TEXT NOT NULL,
+                tariff_id INTEGER,
+                weight REAL NOT NULL DEFAULT 0,
+                billed_volume REAL NOT NULL DEFAULT 0,
+                amount REAL NOT NULL DEFAULT 0,
+                entry_type TEXT NOT NULL CHECK(entry_type IN ('入账', '冲销')),
+                operator TEXT,
+                note TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            '''
+            self.cursor.execute(ledger_sql.format(table='settlement_ledger'))
+            # 旧版本的台账表带有到 manual_dispatch_tasks 的外键，重建表去掉外键
+            self.cursor.execute('PRAGMA foreign_key_list(settlement_ledger)')
+            if any(row[2] == 'manual_dispatch_tasks' for row in self.cursor.fetchall()):
+                self.cursor.execute(ledger_sql.format(table='settlement_ledger_new'))
+                self.cursor.execute('INSERT INTO settlement_ledger_new SELECT * FROM settlement_ledger')
+                self.cursor.execute('DROP TABLE settlement_ledger')
+                self.cursor.execute('ALTER TABLE settlement_ledger_new RENAME TO settlement_ledger')
+                logger.info('结算台账表已去掉到派车任务表的外键')
+            # 按承运商、结算期的累计汇总，随台账增量更新
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settlement_summary (
+                period TEXT NOT NULL,
+                carrier_company TEXT NOT NULL,
+                task_count INTEGER NOT NULL DEFAULT 0,
+                unpriced_count INTEGER NOT NULL DEFAULT 0,
+                total_weight REAL NOT NULL DEFAULT 0,
+                billed_volume REAL NOT NULL DEFAULT 0,
+                amount REAL NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (period, carrier_company)
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_task ON settlement_ledger(task_id)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_period ON settlement_ledger(period, carrier_company)')
+            # 结算按状态和用车日期筛选已结束的任务
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_date ON manual_dispatch_tasks(status, required_date)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建结算相关表失败: {str(e)}')
+            return False
+
+    def create_statement_tables(self):
+        """创建对账单接入相关表：字段映射方案、导入批次、暂存数据、匹配结果"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            # field_mapping 为 JSON：标准字段 -> 文件表头
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_mapping_profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                carrier_company TEXT,
+                field_mapping TEXT NOT NULL,
+                date_format TEXT,
+                created_by INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (created_by) REFERENCES User(id) ON DELETE SET NULL
+            )
+            ''')
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                carrier_company TEXT NOT NULL,
+                data_source TEXT NOT NULL CHECK(data_source IN ('supplier', 'reimbursement')),
+                filename TEXT,
+                profile_id INTEGER,
+                status TEXT NOT NULL DEFAULT '导入中' CHECK(status IN ('导入中', '已完成', '失败')),
+                total_rows INTEGER DEFAULT 0,
+                error_rows INTEGER DEFAULT 0,
+                created_by INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                finished_at TEXT,
+                FOREIGN KEY (profile_id) REFERENCES statement_mapping_profiles(id) ON DELETE SET NULL,
+                FOREIGN KEY (created_by) REFERENCES User(id) ON DELETE SET NULL
+            )
+            ''')
+            # 规范化后的对账单明细；error 不为空的行解析失败，匹配时忽略
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_staging (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id INTEGER NOT NULL,
+                row_number INTEGER NOT NULL,
+                carrier_company TEXT NOT NULL,
+                statement_date TEXT,
+                dispatch_number TEXT,
+                manifest_number TEXT,
+                license_plate TEXT,
+                route_name TEXT,
+                volume REAL,
+                weight REAL,
+                amount REAL,
+                error TEXT,
+                FOREIGN KEY (batch_id) REFERENCES statement_batches(id) ON DELETE CASCADE
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_staging_batch ON statement_staging(batch_id, row_number)')
+            # 对账匹配：每次匹配一条运行记录，结果只保留批次最近一次完成的匹配
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_match_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id INTEGER NOT NULL,
+                carrier_company TEXT NOT NULL,
+                date_from TEXT,
+                date_to TEXT,
+                date_tolerance INTEGER NOT NULL DEFAULT 1,
+                status TEXT NOT NULL DEFAULT '匹配中' CHECK(status IN ('匹配中', '已完成', '失败')),
+                matched_count INTEGER DEFAULT 0,
+                discrepancy_count INTEGER DEFAULT 0,
+                unmatched_count INTEGER DEFAULT 0,
+                unbilled_count INTEGER DEFAULT 0,
+                duration_ms INTEGER,
+                created_by INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                finished_at TEXT,
+                FOREIGN KEY (batch_id) REFERENCES statement_batches(id) ON DELETE CASCADE,
+                FOREIGN KEY (created_by) REFERENCES User(id) ON DELETE SET NULL
+            )
+            ''')
+            # staging_id 为空的是派车记录中已结束但对账单未列出的车辆（未对账）
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_match_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER NOT NULL,
+                batch_id INTEGER NOT NULL,
+                staging_id INTEGER,
+                task_id TEXT,
+                vehicle_id INTEGER,
+                result TEXT NOT NULL CHECK(result IN ('已匹配', '差异', '未匹配', '未对账')),
+                match_key TEXT,
+                match_level TEXT CHECK(match_level IN ('精确', '模糊')),
+                date_diff INTEGER,
+                statement_volume REAL,
+                our_volume REAL,
+                discrepancy TEXT,
+                FOREIGN KEY (run_id) REFERENCES statement_match_runs(id) ON DELETE CASCADE
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_runs_batch ON statement_match_runs(batch_id, status)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_results_run ON statement_match_results(run_id, result)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_results_task ON statement_match_results(task_id)')
+            # 匹配时按承运商和用车日期加载派车记录
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_carrier_date ON manual_dispatch_tasks(carrier_company, required_date)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建对账单接入表失败: {str(e)}')
+            return False
+
+    def create_exception_tables(self):
+        """创建对账异常表：异常队列、待复核任务及其触发器、结算期复核记录"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            # 规则命中记录；ref_id 为车辆ID或对账单暂存行ID，规则不针对具体记录时为0
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reconciliation_exceptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                rule_code TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                ref_id INTEGER NOT NULL DEFAULT 0,
+                period TEXT NOT NULL,
+                detail TEXT,
+                status TEXT NOT NULL DEFAULT '待处理' CHECK(status IN ('待处理', '处理中', '已解决', '已驳回')),
+                detected_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                resolved_at TEXT,
+                handled_by INTEGER,
+                handle_note TEXT,
+                UNIQUE (rule_code, task_id, ref_id),
+                FOREIGN KEY (handled_by) REFERENCES User(id) ON DELETE SET NULL
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_exceptions_task ON reconciliation_exceptions(task_id)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_exceptions_period ON reconciliation_exceptions(period, status, rule_code)')
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS exception_periods (
+                period TEXT PRIMARY KEY,
+                evaluated_at TEXT NOT NULL
+            )
+            ''')
+
+            # 待复核任务：任务、车辆、车辆容积参考变化时由触发器登记，复核后移除
+            seed = self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'exception_dirty_tasks'"
+            ).fetchone() is None
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS exception_dirty_tasks (
+                task_id TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+            ''')
+            # 派车单号重复和容积超限规则按单号、车牌关联其他车辆
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_dispatch ON vehicles(dispatch_number)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_plate ON vehicles(license_plate)')
+
+            mark_task = 'INSERT OR IGNORE INTO exception_dirty_tasks (task_id) SELECT {0} WHERE {0} IS NOT NULL;'
+            mark_dispatch = ('INSERT OR IGNORE INTO exception_dirty_tasks (task_id) '
+                             'SELECT task_id FROM vehicles WHERE dispatch_number = {0} AND task_id IS NOT NULL;')
+            mark_plate = ('INSERT OR IGNORE INTO exception_dirty_tasks (task_id) '
+                          'SELECT task_id FROM vehicles WHERE license_plate = {0} AND task_id IS NOT NULL;')
+            triggers = {
+                'exception_dirty_task_ai': ('AFTER INSERT ON manual_dispatch_tasks', mark_task.format('new.task_id')),
+                'exception_dirty_task_au': ('AFTER UPDATE OF status, required_date ON manual_dispatch_tasks',
+                                            mark_task.format('new.task_id')),
+                'exception_dirty_task_ad': ('AFTER DELETE ON manual_dispatch_tasks', mark_task.format('old.task_id')),
+                'exception_dirty_vehicle_ai': ('AFTER INSERT ON vehicles',
+                                               mark_task.format('new.task_id') + mark_dispatch.format('new.dispatch_number')),
+                'exception_dirty_vehicle_au': ('AFTER UPDATE OF task_id, dispatch_number, license_plate, actual_volume ON vehicles',
+                                               mark_task.format('old.task_id') + mark_task.format('new.task_id')
+                                               + mark_dispatch.format('old.dispatch_number')
+                                               + mark_dispatch.format('new.dispatch_number')),
+                'exception_dirty_vehicle_ad': ('AFTER DELETE ON vehicles',
+                                               mark_task.format('old.task_id') + mark_dispatch.format('old.dispatch_number')),
+                'exception_dirty_capacity_ai': ('AFTER INSERT ON vehicle_capacity_reference',
+                                                mark_plate.format('new.license_plate')),
+                'exception_dirty_capacity_au': ('AFTER UPDATE OF license_plate, standard_volume ON vehicle_capacity_reference',
+                                                mark_plate.format('old.license_plate') + mark_plate.format('new.license_plate')),
+                'exception_dirty_capacity_ad': ('AFTER DELETE ON vehicle_capacity_reference',
+                                                mark_plate.format('old.license_plate'))
+            }
+            for name, (event, body) in triggers.items():
+                self.cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+            # 首次创建时登记全部已有任务，由后台复核逐批补算
+            if seed:
+                self.cursor.execute('INSERT OR IGNORE INTO exception_dirty_tasks (task_id) SELECT task_id FROM manual_dispatch_tasks')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建对账异常表失败: {str(e)}')
+            return False
+
+    def create_feishu_outbox_table(self):
+        """创建飞书审批同步发件箱：业务事务中写入事件，后台线程批量推送"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            # next_attempt_at：待同步事件的下次推送时间；同步中事件的租期截止时间（进程退出后超时重新推送）
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feishu_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                document_no TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT '待同步' CHECK(status IN ('待同步', '同步中', '已同步', '失败')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                external_id TEXT,
+                approval_status TEXT,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                synced_at TEXT
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_feishu_outbox_due ON feishu_outbox(status, next_attempt_at)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_feishu_outbox_synced ON feishu_outbox(status, synced_at)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_feishu_outbox_document ON feishu_outbox(document_no, status)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建飞书审批同步发件箱失败: {str(e)}')
+            return False
+
+    def create_cost_tables(self):
+        """创建邮路成本表：邮路里程、按日/按月成本汇总、待重算日期及其触发器"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS route_distances (
+                route_name TEXT NOT NULL,
+                route_direction TEXT NOT NULL,
+                distance_km REAL NOT NULL CHECK(distance_km > 0),
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (route_name, route_direction)
+            )
+            ''')
+
+            # 已结束任务按 (日期/月份, 邮路, 方向, 承运商) 汇总；priced_* 只累计匹配到运价的任务，
+            # measured_volume 为有实际装载容积的任务的计划容积，用于计算装载率
+            for table, key in (('route_cost_daily', 'day'), ('route_cost_monthly', 'month')):
+                self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key} TEXT NOT NULL,
+                    route_name TEXT NOT NULL,
+                    route_direction TEXT NOT NULL,
+                    carrier_company TEXT NOT NULL,
+                    task_count INTEGER NOT NULL,
+                    priced_count INTEGER NOT NULL,
+                    total_weight REAL NOT NULL,
+                    priced_weight REAL NOT NULL,
+                    planned_volume REAL NOT NULL,
+                    billed_volume REAL NOT NULL,
+                    priced_volume REAL NOT NULL,
+                    amount REAL NOT NULL,
+                    measured_volume REAL NOT NULL,
+                    actual_volume REAL NOT NULL,
+                    PRIMARY KEY ({key}, route_name, route_direction, carrier_company)
+                ) WITHOUT ROWID
+                ''')
+            # 运价变化时按承运商查找受影响的日期
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_route_cost_daily_carrier ON route_cost_daily(carrier_company, day)')
+
+            # 待重算日期：任务、车辆、运价变化时由触发器登记；'*' 表示需要全量重算（首次创建时）
+            seed = self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'route_cost_dirty_days'"
+            ).fetchone() is None
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS route_cost_dirty_days (
+                day TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+            ''')
+
+            mark_day = 'INSERT OR IGNORE INTO route_cost_dirty_days (day) SELECT {0} WHERE {0} IS NOT NULL;'
+            mark_task_day = ("INSERT OR IGNORE INTO route_cost_dirty_days (day) SELECT required_date "
+                             "FROM manual_dispatch_tasks WHERE task_id = {0} AND status = '任务结束';")
+            mark_carrier = ('INSERT OR IGNORE INTO route_cost_dirty_days (day) '
+                            'SELECT day FROM route_cost_daily WHERE carrier_company = {0};')
+            triggers = {
+                'route_cost_task_ai': ("AFTER INSERT ON manual_dispatch_tasks WHEN new.status = '任务结束'",
+                                       mark_day.format('new.required_date')),
+                'route_cost_task_au': ('AFTER UPDATE OF status, required_date, route_name, route_direction, carrier_company, '
+                                       'transport_type, requirement_type, weight, volume ON manual_dispatch_tasks '
+                                       "WHEN old.status = '任务结束' OR new.status = '任务结束'",
+                                       mark_day.format('old.required_date') + mark_day.format('new.required_date')),
+                'route_cost_task_ad': ("AFTER DELETE ON manual_dispatch_tasks WHEN old.status = '任务结束'",
+                                       mark_day.format('old.required_date')),
+                'route_cost_vehicle_ai': ('AFTER INSERT ON vehicles', mark_task_day.format('new.task_id')),
+                'route_cost_vehicle_au': ('AFTER UPDATE OF task_id, actual_volume ON vehicles',
+                                          mark_task_day.format('old.task_id') + mark_task_day.format('new.task_id')),
+                'route_cost_vehicle_ad': ('AFTER DELETE ON vehicles', mark_task_day.format('old.task_id')),
+                'route_cost_tariff_ai': ('AFTER INSERT ON carrier_tariffs', mark_carrier.format('new.carrier_company')),
+                'route_cost_tariff_au': ('AFTER UPDATE ON carrier_tariffs',
+                                         mark_carrier.format('old.carrier_company') + mark_carrier.format('new.carrier_company')),
+                'route_cost_tariff_ad': ('AFTER DELETE ON carrier_tariffs', mark_carrier.format('old.carrier_company')),
+            }
+            for name, (event, body) in triggers.items():
+                self.cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+            # 首次创建时标记全量重算（含归档库中的任务），由后台任务补算
+            if seed:
+                self.cursor.execute("INSERT INTO route_cost_dirty_days (day) VALUES ('*')")
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建邮路成本表失败: {str(e)}')
+            return False
+
+    def create_rollup_tables(self):
+        """创建派车分析汇总表：按日/按月汇总、待重算日期及其触发器"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            # 任务按 (日期/月份, 承运商, 邮路, 方向, 轨道, 需求类型, 状态) 汇总，另有不含邮路维度的承运商级汇总
+            # （行数少得多，不涉及邮路的查询读取该级）；各环节时效保存累计小时数和任务数，平均值在查询时计算
+            dimensions = ['carrier_company', 'route_name', 'route_direction', 'dispatch_track', 'requirement_type', 'status']
+            levels = {'dispatch_rollup': dimensions,
+                      'dispatch_rollup_carrier': [d for d in dimensions if not d.startswith('route_')]}
+            for level, level_dimensions in levels.items():
+                for grain, key in (('daily', 'day'), ('monthly', 'month')):
+                    columns = ',\n'.join(f'{d} TEXT NOT NULL' for d in [key] + level_dimensions)
+                    self.cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {level}_{grain} (
+                        {columns},
+                        task_count INTEGER NOT NULL,
+                        total_volume REAL NOT NULL,
+                        total_weight REAL NOT NULL,
+                        response_count INTEGER NOT NULL,
+                        response_hours REAL NOT NULL,
+                        confirm_count INTEGER NOT NULL,
+                        confirm_hours REAL NOT NULL,
+                        complete_count INTEGER NOT NULL,
+                        complete_hours REAL NOT NULL,
+                        PRIMARY KEY ({', '.join([key] + level_dimensions)})
+                    ) WITHOUT ROWID
+                    ''')
+
+            # 待重算日期：任务、状态历史变化时由触发器登记；'*' 表示需要全量重算（首次创建时）
+            seed = self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dispatch_rollup_dirty_days'"
+            ).fetchone() is None
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dispatch_rollup_dirty_days (
+                day TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+            ''')
+
+            mark_day = 'INSERT OR IGNORE INTO dispatch_rollup_dirty_days (day) SELECT {0} WHERE {0} IS NOT NULL;'
+            mark_task_day = ('INSERT OR IGNORE INTO dispatch_rollup_dirty_days (day) SELECT required_date '
+                             'FROM manual_dispatch_tasks WHERE task_id = {0};')
+            triggers = {
+                'dispatch_rollup_task_ai': ('AFTER INSERT ON manual_dispatch_tasks', mark_day.format('new.required_date')),
+                'dispatch_rollup_task_au': ('AFTER UPDATE OF required_date, carrier_company, route_name, route_direction, '
+                                            'dispatch_track, requirement_type, status, volume, weight, created_at '
+                                            'ON manual_dispatch_tasks',
+                                            mark_day.format('old.required_date') + mark_day.format('new.required_date')),
+                'dispatch_rollup_task_ad': ('AFTER DELETE ON manual_dispatch_tasks', mark_day.format('old.required_date')),
+                'dispatch_rollup_history_ai': ('AFTER INSERT ON dispatch_status_history',
+                                               mark_task_day.format('new.task_id')),
+                'dispatch_rollup_history_au': ('AFTER UPDATE OF task_id, status_change, timestamp ON dispatch_status_history',
+                                               mark_task_day.format('old.task_id') + mark_task_day.format('new.task_id')),
+                'dispatch_rollup_history_ad': ('AFTER DELETE ON dispatch_status_history',
+                                               mark_task_day.format('old.task_id')),
+            }
+            for name, (event, body) in triggers.items():
+                self.cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+            # 首次创建时标记全量重算（含归档库中的任务），由后台任务补算
+            if seed:
+                self.cursor.execute("INSERT INTO dispatch_rollup_dirty_days (day) VALUES ('*')")
+            self.conn.commit()
             return True
+
         except Exception as e:
-            print(f"❌ 初始化表失败: {str(e)}")
             self.conn.rollback()
+            logger.error(f'创建派车分析汇总表失败: {str(e)}')
+            return False
+
+    def create_user_search_index(self):
+        """
+        创建用户检索全文索引（FTS5 trigram分词，支持任意位置的子串检索）
+        通过触发器与User表保持同步；SQLite不支持FTS5时跳过，检索退回LIKE
+        """
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            exists = self.check_table_exists('user_search')
+            self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+                username, full_name, email,
+                content='User', content_rowid='id', tokenize='trigram'
+            )
+            ''')
+            self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON User BEGIN
+                INSERT INTO user_search (rowid, username, full_name, email)
+                VALUES (new.id, new.username, new.full_name, new.email);
+            END
+            ''')
+            self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON User BEGIN
+                INSERT INTO user_search (user_search, rowid, username, full_name, email)
+                VALUES ('delete', old.id, old.username, old.full_name, old.email);
+            END
+            ''')
+            self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF username, full_name, email ON User BEGIN
+                INSERT INTO user_search (user_search, rowid, username, full_name, email)
+                VALUES ('delete', old.id, old.username, old.full_name, old.email);
+                INSERT INTO user_search (rowid, username, full_name, email)
+                VALUES (new.id, new.username, new.full_name, new.email);
+            END
+            ''')
+            if not exists:
+                # 首次创建时为已有用户建立索引
+                self.cursor.execute("INSERT INTO user_search (user_search) VALUES ('rebuild')")
+
+            # 用户列表按创建时间倒序分页
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_created_at ON User(created_at DESC, id DESC)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建用户检索索引失败: {str(e)}')
+            return False
+
+    def create_cache_version_table(self):
+        """创建缓存版本表，数据变更时递增版本号，使各进程的内存缓存失效"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建缓存版本表失败: {str(e)}')
+            return False
+
+    def create_session_table(self):
+        """创建服务端会话表"""
+        if not self.cursor:
+            logger.warning('数据库未连接')
+            return False
+
+        try:
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                user_id INTEGER,
+                expires_at REAL NOT NULL
+            )
+            ''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)')
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f'创建会话表失败: {str(e)}')
             return False
 
     def validate_and_update_status_fields(self):
         """验证和更新状态字段，确保使用新的清晰命名"""
         if not self.cursor:
-            print('数据库未连接')
+            logger.warning('数据库未连接')
             return False
 
         try:
@@ -798,13 +1476,13 @@ class DatabaseManager:
             
             status_column = next((col for col in columns if col[1] == 'status'), None)
             if status_column:
-                print(f"✅ 状态字段类型: {status_column[2]}")
+                logger.debug(f"状态字段类型: {status_column[2]}")
                 
                 # 检查是否有CHECK约束
                 if 'CHECK' not in str(status_column[2]).upper():
-                    print("⚠️ 状态字段缺少CHECK约束")
+                    logger.warning("状态字段缺少CHECK约束")
                 else:
-                    print("✅ 状态字段包含CHECK约束")
+                    logger.debug("状态字段包含CHECK约束")
             
             # 验证当前数据中的状态值
             self.cursor.execute("SELECT DISTINCT status FROM manual_dispatch_tasks")
@@ -813,7 +1491,7 @@ class DatabaseManager:
             
             invalid_statuses = [status for status in current_statuses if status and status not in valid_statuses]
             if invalid_statuses:
-                print(f"⚠️ 发现无效状态值: {invalid_statuses}")
+                logger.warning(f"发现无效状态值: {invalid_statuses}")
                 # 更新无效状态为最接近的有效状态
                 status_mapping = {
                     '待区域调度员审核': '待调度员审核',
@@ -827,22 +1505,22 @@ class DatabaseManager:
                 for old_status, new_status in status_mapping.items():
                     if old_status in invalid_statuses:
                         self.cursor.execute("UPDATE manual_dispatch_tasks SET status = ? WHERE status = ?", (new_status, old_status))
-                        print(f"✅ 更新状态: {old_status} → {new_status}")
+                        logger.info(f"更新状态: {old_status} → {new_status}")
             else:
-                print("✅ 所有状态值均有效")
+                logger.debug("所有状态值均有效")
             
             self.conn.commit()
             return True
             
         except Exception as e:
             self.conn.rollback()
-            print(f"❌ 验证状态字段失败: {str(e)}")
+            logger.error(f"验证状态字段失败: {str(e)}")
             return False
 
     def create_user_tables(self):
         """创建用户管理相关表"""
         if not self.cursor:
-            print('数据库未连接')
+            logger.warning('数据库未连接')
             return False
 
         try:
@@ -947,7 +1625,7 @@ class DatabaseManager:
             
         except Exception as e:
             self.conn.rollback()
-            print(f'创建用户管理相关表失败: {str(e)}')
+            logger.error(f'创建用户管理相关表失败: {str(e)}')
             return False
 
     def insert_default_data(self):
@@ -1007,8 +1685,8 @@ class DatabaseManager:
             self.cursor.execute('SELECT id FROM User WHERE username = ?', (admin_username,))
             if not self.cursor.fetchone():
                 # 对密码进行哈希处理
-                from werkzeug.security import generate_password_hash
-                hashed_password = generate_password_hash(admin_password)
+                from security import hash_password
+                hashed_password = hash_password(admin_password)
                 
                 self.cursor.execute('''
                     INSERT INTO User (username, password, full_name, email, is_active)
@@ -1049,12 +1727,12 @@ class DatabaseManager:
             self._configure_role_permissions()
 
             self.conn.commit()
-            print("✅ 默认数据插入成功")
+            logger.info("默认数据插入成功")
             return True
             
         except Exception as e:
             self.conn.rollback()
-            print(f"❌ 默认数据插入失败: {str(e)}")
+            logger.error(f"默认数据插入失败: {str(e)}")
             return False
 
     def _configure_role_permissions(self):
@@ -1115,14 +1793,16 @@ class DatabaseManager:
                     configured_count += 1
         
         if configured_count > 0:
-            print(f"✅ 配置了 {configured_count} 个角色权限关系")
+            # 使其他进程中的权限缓存失效
+            bump_cache_version(self.conn, PERMISSION_CACHE)
+            logger.info(f"配置了 {configured_count} 个角色权限关系")
         
         return True
 
     def check_and_fix_permissions(self):
         """检查并修复权限配置（整合自init_permissions.py）"""
         if not self.connect():
-            print("❌ 数据库连接失败，无法检查权限")
+            logger.error("数据库连接失败，无法检查权限")
             return False
         
         try:
@@ -1145,25 +1825,28 @@ class DatabaseManager:
             for role_name, count in roles_with_permissions:
                 expected_count = ROLE_PERMISSIONS_CONFIG.get(role_name, 0)
                 if count != expected_count and expected_count > 0:
-                    print(f"⚠️ 角色 {role_name} 权限不完整: 现有 {count}, 期望 {expected_count}")
+                    logger.warning(f"角色 {role_name} 权限不完整: 现有 {count}, 期望 {expected_count}")
                     needs_fix = True
             
             if needs_fix:
-                print("🔄 检测到权限配置问题，开始修复...")
+                logger.warning("检测到权限配置问题，开始修复...")
                 self._configure_role_permissions()
                 self.conn.commit()
-                print("✅ 权限修复完成")
+                logger.info("权限修复完成")
             else:
-                print("✅ 权限配置检查完成，无需修复")
+                logger.debug("权限配置检查完成，无需修复")
             
             return True
             
         except Exception as e:
-            print(f"❌ 权限检查失败: {str(e)}")
+            logger.error(f"权限检查失败: {str(e)}")
             return False
 
 # 使用示例
 if __name__ == '__main__':
+    from logging_config import configure_logging
+    configure_logging()
+
     # 创建数据库管理器实例
     db_manager = DatabaseManager()
 
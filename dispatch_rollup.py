@@ -0,0 +1,296 @@
+"""
+派车分析汇总 - 任务按 (用车日期, 承运商, 邮路, 方向, 轨道, 需求类型, 状态) 汇总数量、容积、重量和各环节时效，
+结果保存在按日、按月两级汇总表中（含已归档任务）；任务和状态历史变化时由触发器登记待重算日期，查询前增量重算。
+查询按任意维度组合上卷（group_by），按维度取值过滤即下钻，分析类查询不再扫描派车任务表
+"""
+
+from datetime import date, timedelta
+
+from constants import DispatchStatus
+from task_archive import open_archive, union_sources
+
+# 每个事务重算的天数
+REFRESH_CHUNK_DAYS = 31
+
+# 查询前同步重算的天数上限（只重算查询范围内的日期），其余由后台任务处理
+READ_REFRESH_DAYS = 7
+
+FULL_REFRESH_MARK = '*'
+
+# 可上卷/下钻的维度；时间维度 day、month 只能用于分组
+DIMENSIONS = ['carrier_company', 'route_name', 'route_direction', 'dispatch_track', 'requirement_type', 'status']
+TIME_DIMENSIONS = ['day', 'month']
+
+# 环节时效：环节 -> (起点状态, 终点状态)，起点为None时从任务创建时间算起；取首次进入该状态的时间
+LEAD_STAGES = {
+    'response': (None, DispatchStatus.SUPPLIER_RESPONDED.value),
+    'confirm': (DispatchStatus.SUPPLIER_RESPONDED.value, DispatchStatus.SUPPLIER_CONFIRMED.value),
+    'complete': (DispatchStatus.SUPPLIER_CONFIRMED.value, DispatchStatus.TASK_COMPLETED.value),
+}
+
+# 汇总级别（表名前缀 -> 维度），按行数从少到多排列，查询读取第一个包含所需维度的级别；
+# 承运商级不含邮路维度，一年约1.5万行（完整维度约70万行）
+LEVELS = {
+    'dispatch_rollup_carrier': [d for d in DIMENSIONS if not d.startswith('route_')],
+    'dispatch_rollup': DIMENSIONS,
+}
+
+MEASURES = ['task_count', 'total_volume', 'total_weight'] + [
+    f'{stage}_{suffix}' for stage in LEAD_STAGES for suffix in ('count', 'hours')]
+
+
+def _reached_sql(status):
+    """任务首次进入某状态的时间（儒略日）；状态历史记为"原状态→新状态"或直接记新状态"""
+    return (f"(SELECT MIN(julianday(h.timestamp)) FROM {{history}} h WHERE h.task_id = m.task_id "
+            f"AND (h.status_change = '{status}' OR h.status_change LIKE '%→{status}'))")
+
+
+_MILESTONES = sorted({status for stages in LEAD_STAGES.values() for status in stages if status})
+
+# 单个库中待重算日期的任务及其各状态首次进入时间
+TASK_SOURCE_SQL = f'''
+        SELECT m.required_date, {', '.join(f'm.{d}' for d in DIMENSIONS)}, m.volume, m.weight,
+               julianday(m.created_at) AS created,
+               {', '.join(f'{_reached_sql(status)} AS "{status}"' for status in _MILESTONES)}
+        FROM {{tasks}} m
+        WHERE m.required_date IN (SELECT day FROM temp.rollup_refresh_days)
+'''
+
+
+def _stage_sql(start, end):
+    start_column = 'created' if start is None else f'"{start}"'
+    return f'("{end}" - {start_column}) * 24'
+
+
+DAILY_ROLLUP_SQL = f'''
+    INSERT INTO dispatch_rollup_daily (day, {', '.join(DIMENSIONS)}, {', '.join(MEASURES)})
+    SELECT required_date, {', '.join(DIMENSIONS)},
+           COUNT(*), COALESCE(SUM(volume), 0), COALESCE(SUM(weight), 0),
+           {', '.join(f'COUNT({_stage_sql(*stages)}), ROUND(COALESCE(SUM({_stage_sql(*stages)}), 0), 3)'
+                      for stages in LEAD_STAGES.values())}
+    FROM ({{source}})
+    GROUP BY required_date, {', '.join(DIMENSIONS)}
+'''
+
+# 从最细的按日汇总生成较粗级别的按日汇总
+def _coarse_daily_sql(level, dimensions):
+    return f'''
+    INSERT INTO {level}_daily (day, {', '.join(dimensions)}, {', '.join(MEASURES)})
+    SELECT day, {', '.join(dimensions)}, {', '.join(f'SUM({c})' for c in MEASURES)}
+    FROM dispatch_rollup_daily
+    WHERE day IN (SELECT day FROM temp.rollup_refresh_days)
+    GROUP BY day, {', '.join(dimensions)}
+'''
+
+
+# 把待重算日期的按日汇总乘以 :sign（1 或 -1）累加到按月汇总
+def _monthly_delta_sql(level, dimensions):
+    return f'''
+    INSERT INTO {level}_monthly (month, {', '.join(dimensions)}, {', '.join(MEASURES)})
+    SELECT substr(day, 1, 7), {', '.join(dimensions)}, {', '.join(f'SUM({c}) * :sign' for c in MEASURES)}
+    FROM {level}_daily
+    WHERE day IN (SELECT day FROM temp.rollup_refresh_days)
+    GROUP BY substr(day, 1, 7), {', '.join(dimensions)}
+    ON CONFLICT (month, {', '.join(dimensions)}) DO UPDATE SET
+        {', '.join(f'{c} = ROUND({c} + excluded.{c}, 3)' for c in MEASURES)}
+'''
+
+
+COARSE_DAILY_SQL = {level: _coarse_daily_sql(level, dims) for level, dims in LEVELS.items() if dims != DIMENSIONS}
+MONTHLY_DELTA_SQL = {level: _monthly_delta_sql(level, dims) for level, dims in LEVELS.items()}
+
+
+def _prepare_temp_tables(conn):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS rollup_refresh_days (day TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.execute('DELETE FROM temp.rollup_refresh_days')
+
+
+def _expand_full_refresh(conn):
+    """把全量重算标记展开为在途库与归档库中全部有任务的日期"""
+    with conn:
+        if not conn.execute('DELETE FROM dispatch_rollup_dirty_days WHERE day = ?', (FULL_REFRESH_MARK,)).rowcount:
+            return
+        conn.execute(f'''
+            INSERT OR IGNORE INTO dispatch_rollup_dirty_days (day)
+            {union_sources('SELECT DISTINCT required_date FROM {tasks} WHERE required_date IS NOT NULL')}
+        ''')
+
+
+def pending_days(conn):
+    """待重算日期数（全量重算标记未展开时为None）"""
+    if conn.execute('SELECT 1 FROM dispatch_rollup_dirty_days WHERE day = ?', (FULL_REFRESH_MARK,)).fetchone():
+        return None
+    return conn.execute('SELECT COUNT(*) FROM dispatch_rollup_dirty_days').fetchone()[0]
+
+
+def mark_full_refresh(conn):
+    """标记全量重算（下次重算时从在途库和归档库重建全部日期）"""
+    with conn:
+        conn.execute('INSERT OR IGNORE INTO dispatch_rollup_dirty_days (day) VALUES (?)', (FULL_REFRESH_MARK,))
+
+
+def refresh_rollup(conn, date_from=None, date_to=None, limit=None, progress_callback=None):
+    """
+    重算待重算日期的按日汇总，并把变化量累加到按月汇总；每 REFRESH_CHUNK_DAYS 天一个事务
+
+    Args:
+        date_from, date_to (str, optional): 只重算该范围内的日期
+        limit (int, optional): 本次最多重算的天数，默认全部
+        progress_callback (callable, optional): 每批重算后回调，参数为已重算天数
+
+    Returns:
+        dict: {'days': 重算天数, 'pending': 剩余待重算天数}
+    """
+    open_archive(conn)
+    _expand_full_refresh(conn)
+    scope, scope_params = 'day != ?', [FULL_REFRESH_MARK]
+    if date_from and date_to:
+        scope, scope_params = 'day BETWEEN ? AND ?', [date_from, date_to]
+
+    refreshed = 0
+    while limit is None or refreshed < limit:
+        size = REFRESH_CHUNK_DAYS if limit is None else min(REFRESH_CHUNK_DAYS, limit - refreshed)
+        with conn:
+            _prepare_temp_tables(conn)
+            count = conn.execute(f'''
+                INSERT INTO temp.rollup_refresh_days
+                SELECT day FROM dispatch_rollup_dirty_days WHERE {scope} ORDER BY day LIMIT ?
+            ''', scope_params + [size]).rowcount
+            if not count:
+                break
+            conn.execute('DELETE FROM dispatch_rollup_dirty_days WHERE day IN (SELECT day FROM temp.rollup_refresh_days)')
+            # 按月汇总先减去这些日期旧的按日汇总，重算后再加上新的
+            for level in LEVELS:
+                conn.execute(MONTHLY_DELTA_SQL[level], {'sign': -1})
+                conn.execute(f'DELETE FROM {level}_daily WHERE day IN (SELECT day FROM temp.rollup_refresh_days)')
+            conn.execute(DAILY_ROLLUP_SQL.format(source=union_sources(TASK_SOURCE_SQL)))
+            for sql in COARSE_DAILY_SQL.values():
+                conn.execute(sql)
+            for level in LEVELS:
+                conn.execute(MONTHLY_DELTA_SQL[level], {'sign': 1})
+                conn.execute(f'''
+                    DELETE FROM {level}_monthly
+                    WHERE task_count = 0 AND month IN (SELECT substr(day, 1, 7) FROM temp.rollup_refresh_days)
+                ''')
+        refreshed += count
+        if progress_callback:
+            progress_callback(refreshed)
+    return {'days': refreshed, 'pending': pending_days(conn)}
+
+
+def refresh_job(context, full=False):
+    """后台任务：重算全部待重算日期；full 为真时先标记全量重算"""
+    if full:
+        mark_full_refresh(context.conn)
+    open_archive(context.conn)
+    _expand_full_refresh(context.conn)
+    total = pending_days(context.conn)
+    result = refresh_rollup(
+        context.conn,
+        progress_callback=lambda done: context.update_progress(done, total, message=f'已重算{done}天')
+    )
+    context.update_progress(result['days'], total, message=f"已重算{result['days']}天", force=True)
+    return result
+
+
+def split_date_range(date_from, date_to):
+    """
+    把日期范围拆成整月部分（读按月汇总）和首尾不足整月的部分（读按日汇总）
+
+    Returns:
+        list: [('day' 或 'month', 起, 止)]，起止均为闭区间
+    """
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    first_full = start if start.day == 1 else (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    after_end = end + timedelta(days=1)
+    last_full_end = after_end if after_end.day == 1 else after_end.replace(day=1)
+    if first_full >= last_full_end:
+        return [('day', date_from, date_to)]
+
+    parts = []
+    if start < first_full:
+        parts.append(('day', date_from, (first_full - timedelta(days=1)).isoformat()))
+    parts.append(('month', first_full.strftime('%Y-%m'), (last_full_end - timedelta(days=1)).strftime('%Y-%m')))
+    if last_full_end <= end:
+        parts.append(('day', last_full_end.isoformat(), date_to))
+    return parts
+
+
+def _with_averages(row):
+    """补充各环节平均时效（小时）"""
+    item = dict(row)
+    for stage in LEAD_STAGES:
+        count = item[f'{stage}_count']
+        item[f'avg_{stage}_hours'] = round(item[f'{stage}_hours'] / count, 2) if count else None
+    return item
+
+
+def query_rollup(conn, date_from, date_to, group_by=(), filters=None):
+    """
+    按维度上卷/下钻查询（读取前重算查询范围内最多 READ_REFRESH_DAYS 个待重算日期）
+
+    Args:
+        group_by (list): 分组维度，取自 DIMENSIONS 与 day、month；为空时只返回合计
+        filters (dict, optional): 维度 -> 取值，下钻到指定取值
+
+    Returns:
+        dict: {'list': 分组结果, 'total': 合计, 'pending_days': 剩余待重算天数}
+    """
+    group_by = list(group_by)
+    filters = filters or {}
+    invalid = [d for d in group_by if d not in DIMENSIONS + TIME_DIMENSIONS] + [d for d in filters if d not in DIMENSIONS]
+    if invalid:
+        raise ValueError(f"维度无效: {'、'.join(invalid)}")
+    if len(set(group_by)) != len(group_by):
+        raise ValueError('分组维度不能重复')
+    refresh = refresh_rollup(conn, date_from, date_to, limit=READ_REFRESH_DAYS)
+    level = next(name for name, dims in LEVELS.items() if set(group_by + list(filters)) <= set(dims + TIME_DIMENSIONS))
+
+    # 按日分组只能读按日汇总；按月分组时首尾不足整月的部分按所在月份归组
+    parts = [('day', date_from, date_to)] if 'day' in group_by else split_date_range(date_from, date_to)
+    filter_sql = ''.join(f' AND {d} = ?' for d in filters)
+    sums = ', '.join(f'SUM({c}) AS {c}' for c in MEASURES)
+    group_sql = f"GROUP BY {', '.join(group_by)}" if group_by else ''
+
+    selects, params = [], []
+    for key, start, end in parts:
+        keys = [f'substr({key}, 1, 7) AS month' if d == 'month' else d for d in group_by]
+        selects.append(f'''
+            SELECT {', '.join(keys + [sums])} FROM {level}_{'daily' if key == 'day' else 'monthly'}
+            WHERE {key} BETWEEN ? AND ?{filter_sql}
+            {group_sql}
+        ''')
+        params += [start, end, *filters.values()]
+
+    time_keys = [d for d in group_by if d in TIME_DIMENSIONS]
+    order = ', '.join(time_keys + ['task_count DESC'])
+    rows = conn.execute(f'''
+        SELECT {', '.join(group_by + [sums])} FROM ({' UNION ALL '.join(selects)})
+        {group_sql}
+        {f'HAVING task_count > 0 ORDER BY {order}' if group_by else ''}
+    ''', params).fetchall()
+
+    items = [_with_averages(dict(zip(group_by + MEASURES, row))) for row in rows]
+    if group_by:
+        total = {c: round(sum(item[c] for item in items), 3) for c in MEASURES}
+    else:
+        total = {c: items[0][c] or 0 for c in MEASURES}
+        items = []
+    return {'list': items, 'total': _with_averages(total), 'pending_days': refresh['pending']}
+
+
+def get_daily_task_stats(conn, date_from, date_to, carrier=None):
+    """按日、按承运商统计任务数量、容积与重量（含已归档任务）"""
+    result = query_rollup(conn, date_from, date_to, ['day', 'carrier_company', 'status'],
+                          {'carrier_company': carrier} if carrier else None)
+    stats = {}
+    for row in result['list']:
+        item = stats.setdefault((row['day'], row['carrier_company']), {
+            'day': row['day'], 'carrier_company': row['carrier_company'], 'task_count': 0,
+            'completed_count': 0, 'cancelled_count': 0, 'volume': 0, 'weight': 0})
+        item['task_count'] += row['task_count']
+        item['completed_count'] += row['task_count'] if row['status'] == DispatchStatus.TASK_COMPLETED.value else 0
+        item['cancelled_count'] += row['task_count'] if row['status'] == DispatchStatus.TASK_CANCELLED.value else 0
+        item['volume'] = round(item['volume'] + row['total_volume'], 3)
+        item['weight'] = round(item['weight'] + row['total_weight'], 3)
+    return [stats[key] for key in sorted(stats)]
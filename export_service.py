@@ -0,0 +1,258 @@
+"""
+导出服务模块 - 流式生成Excel/CSV导出文件
+从数据库游标分批拉取数据，逐行写出，避免整表加载到内存
+派车任务、状态历史、车辆导出读取在途库与归档库的合并视图，包含已归档任务
+"""
+
+import csv
+import io
+import logging
+import tempfile
+from urllib.parse import quote
+
+from flask import Response, send_file, stream_with_context
+
+from task_archive import open_archive
+
+logger = logging.getLogger(__name__)
+
+# 每次从游标拉取的行数
+EXPORT_CHUNK_SIZE = 500
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+
+SUPPORTED_FORMATS = ('xlsx', 'csv')
+
+# 导出定义：查询字段、表头、可用筛选条件、文件名；include_archived 为 True 时查询归档合并视图
+EXPORT_DEFINITIONS = {
+    'company': {
+        'select': 'SELECT id, name, contact_person, contact_phone FROM Company',
+        'order_by': 'name',
+        'headers': ['id', 'name', 'contact_person', 'contact_phone'],
+        'filters': {},
+        'filename': '单位信息导出',
+        'sheet_name': '单位信息'
+    },
+    'task': {
+        'select': '''
+            SELECT task_id, required_date, start_bureau, route_direction, route_name,
+                   carrier_company, transport_type, requirement_type, volume, weight,
+                   status, dispatch_track, initiator_role, audit_status, created_at, updated_at,
+                   CASE archived WHEN 1 THEN '是' ELSE '否' END AS archived
+            FROM all_tasks
+        ''',
+        'include_archived': True,
+        'order_by': 'created_at DESC',
+        'headers': ['任务编号', '用车时间', '始发局', '路向', '邮路名称',
+                    '承运公司', '运输类型', '需求类型', '容积', '重量',
+                    '状态', '流程轨道', '发起角色', '审核状态', '创建时间', '更新时间', '已归档'],
+        'filters': {
+            'status': 'status = ?',
+            'carrier_company': 'carrier_company = ?',
+            'date_from': 'required_date >= ?',
+            'date_to': 'required_date <= ?'
+        },
+        'filename': '派车任务导出',
+        'sheet_name': '派车任务'
+    },
+    'history': {
+        'select': '''
+            SELECT task_id, status_change, operator, timestamp, note
+            FROM all_status_history
+        ''',
+        'include_archived': True,
+        'order_by': 'task_id, timestamp',
+        'headers': ['任务编号', '状态变更', '操作人', '操作时间', '备注'],
+        'filters': {
+            'task_id': 'task_id = ?',
+            'date_from': 'timestamp >= ?',
+            'date_to': 'timestamp <= ?'
+        },
+        'filename': '状态历史导出',
+        'sheet_name': '状态历史'
+    },
+    'vehicle': {
+        'select': '''
+            SELECT task_id, manifest_number, dispatch_number, license_plate,
+                   carriage_number, actual_volume, created_at
+            FROM all_vehicles
+        ''',
+        'include_archived': True,
+        'order_by': 'created_at DESC',
+        'headers': ['任务编号', '路单流水号', '派车单号', '车牌号', '车厢号', '实际容积', '登记时间'],
+        'filters': {
+            'task_id': 'task_id = ?',
+            'license_plate': 'license_plate = ?',
+            'date_from': 'created_at >= ?',
+            'date_to': 'created_at <= ?'
+        },
+        'filename': '车辆信息导出',
+        'sheet_name': '车辆信息'
+    }
+}
+
+
+def _open_sources(conn, kind):
+    """需要包含已归档数据的导出先挂载归档库（创建合并视图）"""
+    if EXPORT_DEFINITIONS[kind].get('include_archived'):
+        open_archive(conn)
+
+
+def build_export_query(kind, filters=None):
+    """根据导出类型和筛选条件构建查询语句，返回(sql, params)"""
+    definition = EXPORT_DEFINITIONS[kind]
+    conditions = []
+    params = []
+
+    for name, value in (filters or {}).items():
+        clause = definition['filters'].get(name)
+        if clause and value not in (None, ''):
+            conditions.append(clause)
+            params.append(value)
+
+    sql = definition['select']
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f" ORDER BY {definition['order_by']}"
+    return sql, params
+
+
+def count_export_rows(conn, kind, filters=None):
+    """统计导出数据总行数，用于后台任务进度"""
+    _open_sources(conn, kind)
+    sql, params = build_export_query(kind, filters)
+    return conn.execute(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
+
+
+def iter_query_rows(conn, sql, params=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """按批从游标拉取数据，逐行产出元组"""
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        cursor.close()
+
+
+def iter_csv_chunks(headers, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """将数据行编码为CSV字节块，带BOM以便Excel正确识别中文"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def write_xlsx(fileobj, headers, rows, sheet_name='Sheet1'):
+    """使用openpyxl只写模式逐行写出Excel，返回写入的数据行数"""
+    # 延迟导入，仅在实际导出Excel时加载openpyxl
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    sheet.append(headers)
+
+    row_count = 0
+    for row in rows:
+        sheet.append(row)
+        row_count += 1
+
+    workbook.save(fileobj)
+    return row_count
+
+
+def export_response(conn, kind, file_format='xlsx', filters=None, on_close=None):
+    """
+    生成导出响应
+
+    Args:
+        conn: 数据库连接
+        kind (str): 导出类型，见 EXPORT_DEFINITIONS
+        file_format (str): xlsx 或 csv
+        filters (dict, optional): 筛选条件
+        on_close (callable, optional): 数据读取完毕后的回调（用于释放连接）
+
+    Returns:
+        Response: Flask响应对象
+    """
+    definition = EXPORT_DEFINITIONS[kind]
+    _open_sources(conn, kind)
+    sql, params = build_export_query(kind, filters)
+    rows = iter_query_rows(conn, sql, params)
+
+    if file_format == 'csv':
+        filename = f"{definition['filename']}.csv"
+
+        def generate():
+            try:
+                yield from iter_csv_chunks(definition['headers'], rows)
+            finally:
+                if on_close:
+                    on_close()
+
+        response = Response(stream_with_context(generate()), mimetype=CSV_MIMETYPE)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return response
+
+    # Excel需要在末尾写入zip目录，先落盘到临时文件再发送，内存占用与数据量无关
+    output = tempfile.TemporaryFile()
+    try:
+        row_count = write_xlsx(output, definition['headers'], rows, definition['sheet_name'])
+    except Exception:
+        output.close()
+        raise
+    finally:
+        if on_close:
+            on_close()
+    output.seek(0)
+    logger.debug(f"{kind}导出完成: {row_count}行")
+
+    return send_file(
+        output,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=f"{definition['filename']}.xlsx"
+    )
+
+
+def export_job(context, kind, file_format='xlsx', filters=None):
+    """后台任务：将导出结果写入任务结果文件，返回导出行数"""
+    definition = EXPORT_DEFINITIONS[kind]
+    total = count_export_rows(context.conn, kind, filters)
+    path = context.result_path(f"{definition['filename']}.{file_format}")
+    sql, params = build_export_query(kind, filters)
+
+    def tracked_rows():
+        for written, row in enumerate(iter_query_rows(context.conn, sql, params), start=1):
+            if written % EXPORT_CHUNK_SIZE == 0:
+                context.update_progress(written, total)
+            yield row
+
+    if file_format == 'csv':
+        with open(path, 'wb') as output:
+            for chunk in iter_csv_chunks(definition['headers'], tracked_rows()):
+                output.write(chunk)
+    else:
+        with open(path, 'wb') as output:
+            write_xlsx(output, definition['headers'], tracked_rows(), definition['sheet_name'])
+
+    context.update_progress(total, total, force=True)
+    return {'rows': total}
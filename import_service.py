@@ -0,0 +1,94 @@
+"""
+导入服务模块 - 流式读取Excel/CSV上传文件
+逐行产出数据，配合分批事务写库，避免整表加载到内存
+"""
+
+import csv
+import io
+import os
+from itertools import islice
+
+# 每个事务处理的行数
+IMPORT_CHUNK_SIZE = 500
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.csv')
+
+
+def normalize_cell(value):
+    """规范化单元格值：去除首尾空白，整数型浮点数转为整数文本，空值返回None"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def _iter_xlsx_rows(file):
+    """只读模式逐行读取Excel第一个工作表"""
+    # 延迟导入，仅在实际读取Excel时加载openpyxl
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(file):
+    """逐行读取CSV文件，兼容带BOM的UTF-8"""
+    stream = file.stream if hasattr(file, 'stream') else file
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='') \
+        if not isinstance(stream, io.TextIOBase) else stream
+    try:
+        yield from csv.reader(text_stream)
+    finally:
+        if text_stream is not stream:
+            text_stream.detach()
+
+
+def open_table_reader(file, filename=None):
+    """
+    打开上传的表格文件
+
+    Args:
+        file: 文件对象（werkzeug FileStorage 或二进制文件对象）
+        filename (str, optional): 文件名，用于判断格式
+
+    Returns:
+        tuple: (表头列表, 行迭代器)，行迭代器产出 (Excel行号, 单元格值元组)，自动跳过空行
+    """
+    filename = filename or getattr(file, 'filename', '') or ''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f'不支持的文件格式: {extension or filename}')
+
+    raw_rows = _iter_csv_rows(file) if extension == '.csv' else _iter_xlsx_rows(file)
+
+    headers = []
+    header_row_number = 0
+    for header_row_number, row in enumerate(raw_rows, start=1):
+        if any(normalize_cell(cell) for cell in row):
+            headers = [normalize_cell(cell) or '' for cell in row]
+            break
+
+    def data_rows():
+        for row_number, row in enumerate(raw_rows, start=header_row_number + 1):
+            values = tuple(normalize_cell(cell) for cell in row)
+            if any(values):
+                yield row_number, values
+
+    return headers, data_rows()
+
+
+def chunked(iterable, size=IMPORT_CHUNK_SIZE):
+    """将迭代器切分为固定大小的批次"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,213 @@
+"""
+后台任务模块 - 在进程内线程池中执行导入/导出等耗时操作
+任务状态与进度保存在 background_jobs 表中，请求线程提交后立即返回任务ID
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from config import DATABASE, JOB_MAX_WORKERS, JOB_RESULT_DIR, JOB_RETENTION_DAYS
+from constants import JobStatus
+from metrics import InstrumentedConnection
+
+logger = logging.getLogger(__name__)
+
+# 进度写库的最小间隔（秒），避免频繁更新拖慢任务
+PROGRESS_FLUSH_INTERVAL = 0.5
+
+
+def _connect(db_path):
+    """为后台线程创建独立的数据库连接"""
+    conn = sqlite3.connect(db_path, timeout=30, factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+class JobContext:
+    """传递给任务函数的上下文：独立数据库连接、进度上报、结果文件路径"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.conn = _connect(manager.db_path)
+        self.result_file = None
+        self.result_filename = None
+        self._last_flush = 0.0
+
+    def update_progress(self, current, total=None, message=None, force=False):
+        """上报任务进度，按时间间隔节流写库"""
+        now = time.monotonic()
+        if not force and now - self._last_flush < PROGRESS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        # 复用任务自身连接写进度：任务读游标未关闭时，另开连接提交会因共享锁而阻塞
+        self.manager._update_job(self.job_id, conn=self.conn, progress_current=current,
+                                 progress_total=total, message=message)
+
+    def result_path(self, filename):
+        """登记并返回结果文件的保存路径"""
+        job_dir = os.path.join(self.manager.result_dir, self.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        self.result_filename = filename
+        self.result_file = os.path.join(job_dir, os.path.basename(filename))
+        return self.result_file
+
+    def close(self):
+        self.conn.close()
+
+
+class JobManager:
+    """后台任务管理器"""
+
+    def __init__(self, db_path=DATABASE, max_workers=JOB_MAX_WORKERS, result_dir=JOB_RESULT_DIR):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.result_dir = result_dir
+        self._executor = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _get_executor(self):
+        """首次提交任务时再创建线程池"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='background-job')
+            return self._executor
+
+    def upload_path(self, filename):
+        """为上传文件分配暂存路径，供导入任务读取"""
+        upload_dir = os.path.join(self.result_dir, 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        return os.path.join(upload_dir, f'{uuid.uuid4().hex}_{os.path.basename(filename)}')
+
+    def submit(self, job_type, func, *args, created_by=None, **kwargs):
+        """
+        提交后台任务
+
+        Args:
+            job_type (str): 任务类型，如 company_import、company_export
+            func (callable): 任务函数，签名为 func(context, *args, **kwargs)，返回可JSON序列化的结果
+            created_by (int, optional): 提交任务的用户ID
+
+        Returns:
+            str: 任务ID
+        """
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        conn = _connect(self.db_path)
+        try:
+            conn.execute('''
+                INSERT INTO background_jobs (id, job_type, status, created_by, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (job_id, job_type, JobStatus.QUEUED.value, created_by, datetime.now().isoformat(sep=' ')))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._get_executor().submit(self._run, job_id, func, args, kwargs)
+        logger.info(f'后台任务已提交: {job_type} ({job_id})')
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        """在工作线程中执行任务并记录结果"""
+        context = None
+        try:
+            context = JobContext(self, job_id)
+            self._update_job(job_id, status=JobStatus.RUNNING.value,
+                             started_at=datetime.now().isoformat(sep=' '))
+            result = func(context, *args, **kwargs)
+            self._update_job(
+                job_id,
+                status=JobStatus.SUCCEEDED.value,
+                result_json=json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                result_file=context.result_file,
+                result_filename=context.result_filename,
+                finished_at=datetime.now().isoformat(sep=' ')
+            )
+        except Exception as e:
+            logger.exception(f'后台任务执行失败: {job_id}')
+            self._update_job(job_id, status=JobStatus.FAILED.value, error=str(e),
+                             finished_at=datetime.now().isoformat(sep=' '))
+        finally:
+            if context:
+                context.close()
+
+    def _update_job(self, job_id, conn=None, **fields):
+        """更新任务记录中非空的字段，未传入连接时使用临时连接"""
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if not fields:
+            return
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        own_conn = conn is None
+        if own_conn:
+            conn = _connect(self.db_path)
+        try:
+            conn.execute(f'UPDATE background_jobs SET {assignments} WHERE id = ?',
+                         list(fields.values()) + [job_id])
+            conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def get_job(self, job_id):
+        """查询任务状态，返回字典，不存在时返回None"""
+        conn = _connect(self.db_path)
+        try:
+            row = conn.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+
+        job = dict(row)
+        job['result'] = json.loads(job.pop('result_json')) if job['result_json'] else None
+        job['has_file'] = bool(job['result_file']) and os.path.exists(job['result_file'])
+        return job
+
+    def _purge_expired(self):
+        """清理超过保留期的已结束任务及结果文件，每小时最多执行一次"""
+        now = time.monotonic()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+
+        cutoff = (datetime.now() - timedelta(days=JOB_RETENTION_DAYS)).isoformat(sep=' ')
+        conn = _connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT id, result_file FROM background_jobs
+                WHERE status IN (?, ?) AND finished_at < ?
+            ''', (JobStatus.SUCCEEDED.value, JobStatus.FAILED.value, cutoff)).fetchall()
+            for row in rows:
+                if row['result_file'] and os.path.exists(row['result_file']):
+                    os.remove(row['result_file'])
+                    os.rmdir(os.path.dirname(row['result_file']))
+            conn.executemany('DELETE FROM background_jobs WHERE id = ?', [(row['id'],) for row in rows])
+            conn.commit()
+        except Exception as e:
+            logger.warning(f'清理过期后台任务失败: {str(e)}')
+        finally:
+            conn.close()
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """获取全局任务管理器实例"""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
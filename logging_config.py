@@ -0,0 +1,55 @@
+"""
+日志配置 - 统一的日志格式与级别
+text 格式供本地开发阅读，json 格式每行一条记录，便于日志采集系统解析
+"""
+
+import json
+import logging
+import sys
+from datetime import datetime
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-7s [%(process)d] %(name)s: %(message)s'
+
+# LogRecord 的标准属性，其余属性视为 extra 字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """输出单行JSON：时间、级别、进程、logger、消息以及 extra 传入的字段"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'pid': record.process,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level='INFO', fmt='text'):
+    """
+    配置根日志：输出到stderr，重复调用时替换之前的处理器
+
+    Args:
+        level (str): 日志级别 DEBUG/INFO/WARNING/ERROR
+        fmt (str): text 或 json
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, '_app_handler', False):
+            root.removeHandler(existing)
+    handler._app_handler = True
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    # werkzeug 的访问日志仅在 DEBUG 级别输出
+    logging.getLogger('werkzeug').setLevel(logging.INFO if root.level <= logging.DEBUG else logging.WARNING)
@@ -0,0 +1,321 @@
+"""
+性能指标模块 - 请求耗时、SQL次数与耗时、响应大小
+DatabaseManager 使用带计时的连接/游标，请求结束时按端点汇总，/metrics 以 Prometheus 文本格式输出
+指标保存在进程内存中，多进程部署时每个进程各自统计
+"""
+
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import Response, g, request
+
+# 请求耗时直方图分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求SQL语句数分桶
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# 响应大小分桶（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# 迭代游标时每批读取的行数
+ITER_BATCH_SIZE = 256
+
+# SQL执行观察者：observer(cursor, sql, params, elapsed_seconds, executemany)
+_sql_observers = []
+
+# 当前请求的SQL统计 [语句数, 总耗时]
+_request_sql = ContextVar('request_sql', default=None)
+
+
+def add_sql_observer(observer):
+    """注册SQL执行观察者（如慢查询日志）"""
+    if observer not in _sql_observers:
+        _sql_observers.append(observer)
+
+
+def _record_sql(cursor, sql, params, elapsed, many=False):
+    stats = _request_sql.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+    for observer in _sql_observers:
+        observer(cursor, sql, params, elapsed, many)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    记录每条语句耗时的游标
+
+    SQLite 在 fetch*/迭代时才逐步执行查询，返回结果的语句耗时为执行与读取结果的合计，
+    在结果读完、游标重新执行、关闭或被回收时记录；不返回结果的语句执行后立即记录
+    """
+
+    # 尚未记录的语句 [sql, 参数, 累计耗时]
+    _pending = None
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            _record_sql(self, *pending)
+
+    def _add_fetch_time(self, started, exhausted):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += time.perf_counter() - started
+            if exhausted:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            _record_sql(self, sql, parameters, time.perf_counter() - started)
+            raise
+        self._pending = [sql, parameters, time.perf_counter() - started]
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(self, sql, None, time.perf_counter() - started, many=True)
+
+    def executescript(self, sql_script):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_sql(self, sql_script, None, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = None
+        try:
+            row = super().fetchone()
+            return row
+        finally:
+            self._add_fetch_time(started, row is None)
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = []
+        try:
+            rows = super().fetchmany(size)
+            return rows
+        finally:
+            self._add_fetch_time(started, len(rows) < size)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._add_fetch_time(started, True)
+
+    def __iter__(self):
+        # 迭代按批读取，避免逐行调用 Python 层的 __next__
+        while True:
+            rows = self.fetchmany(ITER_BATCH_SIZE)
+            yield from rows
+            if len(rows) < ITER_BATCH_SIZE:
+                return
+
+    def __next__(self):
+        started = time.perf_counter()
+        exhausted = True
+        try:
+            row = super().__next__()
+            exhausted = False
+            return row
+        finally:
+            self._add_fetch_time(started, exhausted)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone() 这类用法读完一行后游标即被回收
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """默认使用 InstrumentedCursor 的连接（Connection.execute 等快捷方法也经过计时游标）"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series['counts']):
+                lines.append(_sample(f'{self.name}_bucket', self.label_names + ('le',), labels + (bound,), count))
+            lines.append(_sample(f'{self.name}_bucket', self.label_names + ('le',), labels + ('+Inf',),
+                                 series['count']))
+            lines.append(_sample(f'{self.name}_sum', self.label_names, labels, series['sum']))
+            lines.append(_sample(f'{self.name}_count', self.label_names, labels, series['count']))
+        return lines
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(_sample(self.name, self.label_names, labels, value))
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, label_names, labels, value):
+    """输出一行样本：name{k="v",...} value"""
+    if isinstance(value, float):
+        value = f'{value:.6f}'
+    if not label_names:
+        return f'{name} {value}'
+    pairs = ','.join(f'{key}="{_escape_label(label)}"' for key, label in zip(label_names, labels))
+    return f'{name}{{{pairs}}} {value}'
+
+
+class MetricsRegistry:
+    """请求指标汇总"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter('http_requests_total', '请求总数', ('method', 'endpoint', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', '请求耗时（秒）',
+                                 LATENCY_BUCKETS, ('method', 'endpoint'))
+        self.response_size = Histogram('http_response_size_bytes', '响应大小（字节，流式响应不计）',
+                                       SIZE_BUCKETS, ('method', 'endpoint'))
+        self.sql_per_request = Histogram('http_request_sql_statements', '每个请求执行的SQL语句数',
+                                         SQL_COUNT_BUCKETS, ('method', 'endpoint'))
+        self.sql_statements = Counter('sql_statements_total', 'SQL语句总数', ('endpoint',))
+        self.sql_seconds = Counter('sql_duration_seconds_total', 'SQL执行总耗时（秒）', ('endpoint',))
+        self._extra = []
+
+    def record_request(self, method, endpoint, status, elapsed, size, sql_count, sql_seconds):
+        with self._lock:
+            self.requests.inc((method, endpoint, str(status)))
+            self.latency.observe((method, endpoint), elapsed)
+            if size is not None:
+                self.response_size.observe((method, endpoint), size)
+            self.sql_per_request.observe((method, endpoint), sql_count)
+            self.sql_statements.inc((endpoint,), sql_count)
+            self.sql_seconds.inc((endpoint,), sql_seconds)
+
+    def register(self, metric):
+        """注册请求以外的指标（如后台同步吞吐量），随 /metrics 一起输出"""
+        with self._lock:
+            self._extra.append(metric)
+        return metric
+
+    def inc(self, counter, labels, amount=1):
+        with self._lock:
+            counter.inc(labels, amount)
+
+    def observe(self, histogram, labels, value):
+        with self._lock:
+            histogram.observe(labels, value)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.response_size,
+                           self.sql_per_request, self.sql_statements, self.sql_seconds, *self._extra):
+                lines.extend(metric.render())
+            return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_sql_token = _request_sql.set([0, 0.0])
+
+
+def _after_request(response):
+    started = getattr(g, '_metrics_started', None)
+    stats = _request_sql.get()
+    if started is None or stats is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    registry.record_request(request.method, endpoint, response.status_code,
+                            time.perf_counter() - started, size, stats[0], stats[1])
+    return response
+
+
+def _teardown_request(exception=None):
+    token = g.pop('_metrics_sql_token', None)
+    if token is not None:
+        _request_sql.reset(token)
+
+
+def init_metrics(app, endpoint='/metrics'):
+    """注册请求计时中间件和 /metrics 端点"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    @app.route(endpoint)
+    def metrics():
+        """Prometheus 文本格式指标"""
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,14 +1,16 @@
 from flask import Blueprint, render_template, request, redirect, url_for, make_response, send_file, jsonify
-import pandas as pd
 from flask_login import login_required
-from io import BytesIO
 import logging
 from flask_login import current_user
 from urllib.parse import quote
 import os
 import datetime
-import openpyxl
-from io import BytesIO
+import tempfile
+from export_service import export_response, export_job, write_xlsx, SUPPORTED_FORMATS, XLSX_MIMETYPE
+from import_service import open_table_reader, chunked, IMPORT_CHUNK_SIZE, SUPPORTED_EXTENSIONS
+from job_queue import get_job_manager
+from api.decorators import create_response
+from reference_cache import company_cache
 
 basic_data_bp = Blueprint('basic_data_bp', __name__, template_folder='templates')
 
@@ -39,7 +41,7 @@ def data_maintenance():
 def company_list():
     from app import get_db
     conn = get_db()
-    companies = conn.execute('SELECT * FROM Company ORDER BY name').fetchall()
+    companies = company_cache.get(conn)
     return render_template('basic_data/company_list.html', companies=companies)
 
 @basic_data_bp.route('/company_new', methods=['GET', 'POST'])
@@ -59,6 +61,7 @@ def company_new():
             INSERT INTO Company (name, bank_name, account_number, address, contact_person, contact_phone)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (name, bank_name, account_number, address, contact_person, contact_phone))
+        company_cache.invalidate(conn)
         conn.commit()
         return redirect(url_for('basic_data_bp.company_list'))
     return render_template('basic_data/company_edit.html', company=None)
@@ -83,6 +86,7 @@ def company_edit(id):
             SET name = ?, bank_name = ?, account_number = ?, address = ?, contact_person = ?, contact_phone = ?
             WHERE id = ?
         ''', (name, bank_name, account_number, address, contact_person, contact_phone, id))
+        company_cache.invalidate(conn)
         conn.commit()
         return redirect(url_for('basic_data_bp.company_list'))
     
@@ -94,6 +98,7 @@ def company_delete(id):
     from app import get_db
     conn = get_db()
     conn.execute('DELETE FROM Company WHERE id = ?', (id,))
+    company_cache.invalidate(conn)
     conn.commit()
     return redirect(url_for('basic_data_bp.company_list'))
 
@@ -114,62 +119,26 @@ def debug_user():
 @login_required
 def company_export():
     # 添加请求处理日志
-    logging.debug(f"收到Excel导出请求: {datetime.datetime.now()}")
-    
+    logging.debug(f"收到单位导出请求: {datetime.datetime.now()}")
+
+    file_format = request.args.get('format', 'xlsx')
+    if file_format not in SUPPORTED_FORMATS:
+        return f"导出失败: 不支持的导出格式 {file_format}", 400
+
+    # 异步模式：提交后台任务，立即返回任务ID，通过 /api/jobs/<job_id> 查询进度并下载
+    if request.args.get('async') == '1':
+        job_id = get_job_manager().submit('company_export', export_job, 'company', file_format,
+                                          created_by=current_user.id)
+        return create_response(data={'job_id': job_id}), 202
+
     from app import get_db
     conn = get_db()
     try:
-        # 查询数据
-        cursor = conn.execute('SELECT id, name, contact_person, contact_phone FROM Company ORDER BY name')
-        companies = cursor.fetchall()
-        columns = ['id', 'name', 'contact_person', 'contact_phone']
-        logging.debug(f"查询到{len(companies)}条单位数据")
-    
-        # 创建DataFrame
-        df = pd.DataFrame(companies, columns=columns)
-        logging.debug(f"DataFrame创建成功: {len(df)}行")
-    
-        # 创建Excel文件
-        output = BytesIO()
-        try:
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='单位信息')
-            output.seek(0)
-            file_content = output.getvalue()
-            file_size = len(file_content)
-            logging.debug(f"Excel文件生成成功，大小: {file_size} bytes")
-        
-            # 验证Excel文件内容
-            try:
-                workbook = openpyxl.load_workbook(BytesIO(file_content))
-                sheet = workbook.active
-                logging.debug(f"Excel内容验证成功: {sheet.title}工作表，{sheet.max_row}行数据")
-            except Exception as e:
-                logging.error(f"Excel内容验证失败: {str(e)}", exc_info=True)
-                return "导出失败: 生成的Excel文件无效", 500
-        except Exception as e:
-            logging.error(f"Excel文件生成失败: {str(e)}", exc_info=True)
-            return "导出失败: 文件生成错误", 500
-        
-        # 设置正确的响应头
-        filename = "单位信息导出.xlsx"
-        
-        try:
-            # 使用send_file替代make_response，让Flask自动处理响应头
-            return send_file(
-                BytesIO(file_content),
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name=filename
-            )
-        except Exception as e:
-            logging.error(f"Excel导出失败: {str(e)}", exc_info=True)
-            return f"导出失败: {str(e)}", 500
+        # 从游标分批读取并流式写出，连接由应用上下文统一关闭
+        return export_response(conn, 'company', file_format)
     except Exception as e:
-        logging.error(f"数据库操作失败: {str(e)}", exc_info=True)
-        return "导出失败: 数据库错误", 500
-    finally:
-        conn.close()  # 确保数据库连接关闭
+        logging.error(f"单位导出失败: {str(e)}", exc_info=True)
+        return "导出失败: 文件生成错误", 500
 
 # 添加简单文本下载测试端点
 
@@ -184,6 +153,7 @@ def test_download():
     return response
 
 @basic_data_bp.route('/company_import', methods=['GET', 'POST'])
+@login_required
 def company_import():
     if request.method == 'GET':
         return render_template('basic_data/company_import.html')
@@ -195,26 +165,31 @@ def company_import():
 
         file = request.files['file']
 
+        # 异步模式：暂存上传文件并提交后台任务，立即返回任务ID
+        if request.form.get('async') == '1':
+            job_manager = get_job_manager()
+            upload_path = job_manager.upload_path(file.filename)
+            file.save(upload_path)
+            job_id = job_manager.submit('company_import', _company_import_job, upload_path, file.filename,
+                                        created_by=current_user.id)
+            return create_response(data={'job_id': job_id}), 202
+
         try:
-            # 读取Excel文件
-            df = _read_excel_file(file)
-            if not df.empty:
-                # 检查必要列
-                required_columns = ['单位名称']
-                column_check_result = _check_required_columns(df, required_columns)
-                if column_check_result:
-                    return render_template('basic_data/company_import.html', import_result=column_check_result)
-
-                # 导入数据到数据库
-                import_result = _import_data_to_db(df)
-                return render_template('basic_data/company_import.html', import_result=import_result)
-            else:
-                return render_template('basic_data/company_import.html', import_result={
-                    'total': 0,
-                    'success': 0,
-                    'fail': 0,
-                    'errors': ['Excel文件为空，没有可导入的数据']
-                })
+            # 流式读取表格，只解析表头，数据行按批次读取
+            headers, rows = open_table_reader(file)
+
+            # 检查必要列
+            required_columns = ['单位名称']
+            column_check_result = _check_required_columns(headers, required_columns)
+            if column_check_result:
+                return render_template('basic_data/company_import.html', import_result=column_check_result)
+
+            # 导入数据到数据库
+            from app import get_db
+            import_result = _import_companies(get_db(), headers, rows)
+            if import_result['total'] == 0:
+                import_result['errors'].append('文件为空，没有可导入的数据')
+            return render_template('basic_data/company_import.html', import_result=import_result)
         except Exception as e:
             return render_template('basic_data/company_import.html', import_result={
                 'total': 0,
@@ -242,24 +217,43 @@ def _validate_file_upload(files):
             'errors': ['没有选择文件']
         }
 
-    if not file.filename.endswith(('.xlsx', '.xls')):
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
         return {
             'total': 0,
             'success': 0,
             'fail': 0,
-            'errors': ['不支持的文件格式，请上传.xlsx或.xls格式的Excel文件']
+            'errors': ['不支持的文件格式，请上传.xlsx或.csv格式的文件']
         }
 
     return None
 
 
-def _read_excel_file(file):
-    """读取Excel文件并返回DataFrame"""
-    return pd.read_excel(file)
+# 导入模板列名与Company表字段的对应关系
+COMPANY_IMPORT_COLUMNS = {
+    '单位名称': 'name',
+    '开户行': 'bank_name',
+    '银行账户': 'account_number',
+    '单位地址': 'address',
+    '联系人': 'contact_person',
+    '联系电话': 'contact_phone'
+}
+
+# 按单位名称插入或更新，空单元格不覆盖已有数据
+COMPANY_UPSERT_SQL = '''
+    INSERT INTO Company (name, bank_name, account_number, address, contact_person, contact_phone)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET
+        bank_name = COALESCE(excluded.bank_name, bank_name),
+        account_number = COALESCE(excluded.account_number, account_number),
+        address = COALESCE(excluded.address, address),
+        contact_person = COALESCE(excluded.contact_person, contact_person),
+        contact_phone = COALESCE(excluded.contact_phone, contact_phone),
+        updated_at = CURRENT_TIMESTAMP
+'''
 
-def _check_required_columns(df, required_columns):
+def _check_required_columns(headers, required_columns):
     """检查必要列是否存在"""
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in headers]
     if missing_columns:
         return {
             'total': 0,
@@ -268,85 +262,114 @@ def _check_required_columns(df, required_columns):
             'errors': [f'缺少必要列: {", ".join(missing_columns)}']
         }
     return None
-def _import_data_to_db(df):
-    """将DataFrame数据导入数据库"""
-    conn = None
-    data = []
-    total = len(df) if not df.empty else 0
-    
+
+def _import_companies(conn, headers, rows, progress_callback=None):
+    """
+    分批将单位数据按名称插入或更新到数据库
+
+    Args:
+        conn: 数据库连接
+        headers (list): 表头
+        rows (iterable): (行号, 单元格值元组) 迭代器
+        progress_callback (callable, optional): 每批完成后回调，参数为已处理行数
+
+    Returns:
+        dict: 导入结果，包含汇总数字、错误信息和逐行结果
+    """
+    column_index = {header: i for i, header in enumerate(headers) if header in COMPANY_IMPORT_COLUMNS}
+    fields = list(COMPANY_IMPORT_COLUMNS.keys())
+    result = {'total': 0, 'success': 0, 'fail': 0, 'inserted': 0, 'updated': 0, 'errors': [], 'rows': []}
+
+    def record_failure(row_number, name, message):
+        result['fail'] += 1
+        result['errors'].append(f'第{row_number}行: {message}')
+        result['rows'].append({'row': row_number, 'name': name, 'status': 'failed', 'message': message})
+
+    for batch in chunked(rows, IMPORT_CHUNK_SIZE):
+        result['total'] += len(batch)
+
+        # 解析本批数据，单位名称为空的行直接记为失败
+        records = []
+        for row_number, values in batch:
+            record = tuple(
+                values[column_index[field]] if field in column_index and column_index[field] < len(values) else None
+                for field in fields
+            )
+            if not record[0]:
+                record_failure(row_number, None, '单位名称为空')
+                continue
+            records.append((row_number, record))
+
+        if records:
+            # 一次查询本批中已存在的单位，用于区分新增与更新
+            names = list({record[0] for _, record in records})
+            placeholders = ', '.join('?' * len(names))
+            existing = {row[0] for row in conn.execute(
+                f'SELECT name FROM Company WHERE name IN ({placeholders})', names
+            ).fetchall()}
+
+            try:
+                with conn:
+                    conn.executemany(COMPANY_UPSERT_SQL, [record for _, record in records])
+                succeeded = records
+            except Exception:
+                # 整批失败时逐行重试，定位出错行，其余行照常导入
+                succeeded = []
+                for row_number, record in records:
+                    try:
+                        with conn:
+                            conn.execute(COMPANY_UPSERT_SQL, record)
+                        succeeded.append((row_number, record))
+                    except Exception as e:
+                        record_failure(row_number, record[0], f'写入失败: {str(e)}')
+
+            for row_number, record in succeeded:
+                status = 'updated' if record[0] in existing else 'inserted'
+                existing.add(record[0])
+                result[status] += 1
+                result['success'] += 1
+                result['rows'].append({'row': row_number, 'name': record[0], 'status': status})
+
+        if progress_callback:
+            progress_callback(result['total'])
+
+    # 有数据写入时使单位目录缓存失效
+    if result['success']:
+        with conn:
+            company_cache.invalidate(conn)
+
+    return result
+
+def _company_import_job(context, upload_path, filename):
+    """后台任务：从暂存文件导入单位数据，完成后删除暂存文件"""
     try:
-        conn = get_db()
-        # 检查必要字段是否存在
-        required_fields = ['单位名称']
-        missing_fields = [field for field in required_fields if field not in df.columns]
-        if missing_fields:
-            return {
-                'total': total,
-                'success': 0,
-                'fail': total,
-                'errors': [f'缺少必要字段: {", ".join(missing_fields)}']
-            }
-            
-        # 从DataFrame中提取数据
-        data = df.to_dict(orient='records')
-        
-        # 执行批量插入
-        conn.executemany(
-            'INSERT INTO Company (name, contact_person, contact_phone) VALUES (?, ?, ?)',
-            [(item['单位名称'], item.get('联系人', ''), item.get('联系电话', '')) for item in data]
-        )
-        conn.commit()
-        
-        return {
-            'total': total,
-            'success': total,
-            'fail': 0,
-            'errors': []
-        }
-        
-    except KeyError as e:
-        if conn:
-            conn.rollback()
-        return {
-            'total': total,
-            'success': 0,
-            'fail': total,
-            'errors': [f'数据字段错误: 缺少 {str(e)}']
-        }
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        return {
-            'total': total,
-            'success': 0,
-            'fail': total,
-            'errors': [f'数据库导入失败: {str(e)}']
-        }
+        with open(upload_path, 'rb') as file:
+            headers, rows = open_table_reader(file, filename)
+            column_check_result = _check_required_columns(headers, ['单位名称'])
+            if column_check_result:
+                return column_check_result
+            result = _import_companies(
+                context.conn, headers, rows,
+                progress_callback=lambda done: context.update_progress(done, message=f'已处理{done}行')
+            )
+            context.update_progress(result['total'], result['total'], message=f"已处理{result['total']}行", force=True)
+            return result
     finally:
-        if conn:
-            try:
-                conn.close()  # 确保连接关闭
-            except Exception as close_err:
-                print(f"关闭数据库连接失败: {str(close_err)}")
+        os.remove(upload_path)
 
 @basic_data_bp.route('/company_import_template')
 def company_import_template():
     """下载单位数据导入模板"""
-    # 创建一个包含必要列的空DataFrame作为模板
-    template_columns = ['单位名称', '开户行', '银行账户', '单位地址', '联系人', '联系电话']
-    df = pd.DataFrame(columns=template_columns)
-
-    # 创建Excel文件
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='单位信息模板')
+    # 只包含表头的模板，列名与导入映射保持一致
+    output = tempfile.TemporaryFile()
+    write_xlsx(output, list(COMPANY_IMPORT_COLUMNS.keys()), [], sheet_name='单位信息模板')
     output.seek(0)
 
     # 设置响应头并返回文件
     filename = "单位数据导入模板.xlsx"
     return send_file(
-        BytesIO(output.getvalue()),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        output,
+        mimetype=XLSX_MIMETYPE,
         as_attachment=True,
         download_name=filename
     )
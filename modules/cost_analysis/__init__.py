@@ -1,5 +1,13 @@
-from flask import Blueprint, render_template
+from datetime import date
+from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
+from api.decorators import create_response
+from modules.user_management import get_db, permission_required
+from job_queue import get_job_manager
+from reference_cache import get_role_permission_names
+from dispatch_rollup import get_daily_task_stats
+from .cost_engine import (GROUPINGS, get_route_costs, pending_days, refresh_job, list_route_distances,
+                          save_route_distance, delete_route_distance)
 
 cost_analysis_bp = Blueprint('cost_analysis_bp', __name__, template_folder='templates')
 
@@ -9,8 +17,18 @@ def index():
     return render_template('cost_analysis/index.html', user=current_user)
 
 @cost_analysis_bp.route('/mail_route')
+@permission_required('cost_view')
 def mail_route_cost():
-    return render_template('cost_analysis/mail_route.html', title='邮路成本分析')
+    try:
+        date_from, date_to = _date_range(request.args)
+    except ValueError:
+        date_from, date_to = _date_range({})
+    conn = get_db()
+    report = get_route_costs(conn, date_from, date_to, group_by='route')
+    return render_template('cost_analysis/mail_route.html', title='邮路成本分析', user=current_user,
+                           date_from=date_from, date_to=date_to, report=report,
+                           can_manage=('超级管理员' in current_user.roles or
+                                       'cost_manage' in get_role_permission_names(conn, current_user.roles)))
 
 @cost_analysis_bp.route('/reports')
 def cost_reports():
@@ -19,3 +37,78 @@ def cost_reports():
 @cost_analysis_bp.route('/optimization')
 def cost_optimization():
     return render_template('cost_analysis/optimization.html', title='成本优化建议')
+
+def _date_range(args):
+    """解析日期范围，默认为本月1日至今天；格式错误或起始晚于截止时抛出ValueError"""
+    today = date.today()
+    date_from = args.get('date_from') or today.replace(day=1).isoformat()
+    date_to = args.get('date_to') or today.isoformat()
+    try:
+        start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    except ValueError:
+        raise ValueError('日期格式错误，应为YYYY-MM-DD')
+    if start > end:
+        raise ValueError('起始日期不能晚于截止日期')
+    return start.isoformat(), end.isoformat()
+
+# 按日、按承运商的任务统计（含已归档任务），日期范围默认为本月
+@cost_analysis_bp.route('/api/task-stats')
+@login_required
+def api_task_stats():
+    try:
+        date_from, date_to = _date_range(request.args)
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+
+    carrier = request.args.get('carrier', '').strip() or None
+    rows = get_daily_task_stats(get_db(), date_from, date_to, carrier)
+    return create_response(data={'date_from': date_from, 'date_to': date_to, 'list': rows})
+
+# 邮路成本报表 - 读取按日/按月汇总表，group_by 为 route、carrier、route_carrier、day、month
+@cost_analysis_bp.route('/api/route-costs')
+@permission_required('cost_view')
+def api_route_costs():
+    try:
+        date_from, date_to = _date_range(request.args)
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    group_by = request.args.get('group_by') or 'route'
+    if group_by not in GROUPINGS:
+        return create_response(success=False, error={'code': 4001, 'message': '分组方式无效'}), 400
+
+    report = get_route_costs(get_db(), date_from, date_to, group_by,
+                             carrier=request.args.get('carrier', '').strip() or None,
+                             route_name=request.args.get('route_name', '').strip() or None)
+    return create_response(data={'date_from': date_from, 'date_to': date_to, 'group_by': group_by, **report})
+
+# 重算成本汇总：由后台任务处理全部待重算日期，full=true 时重建全部历史
+@cost_analysis_bp.route('/api/route-costs/refresh', methods=['POST'])
+@permission_required('cost_manage')
+def api_route_costs_refresh():
+    data = request.get_json(silent=True) or {}
+    job_id = get_job_manager().submit('route_cost_refresh', refresh_job, bool(data.get('full')),
+                                      created_by=current_user.id)
+    return create_response(data={'job_id': job_id, 'pending_days': pending_days(get_db())}), 202
+
+# 邮路里程
+@cost_analysis_bp.route('/api/route-distances')
+@permission_required('cost_view')
+def api_route_distance_list():
+    return create_response(data=list_route_distances(get_db()))
+
+@cost_analysis_bp.route('/api/route-distances', methods=['POST'])
+@permission_required('cost_manage')
+def api_route_distance_save():
+    try:
+        distance = save_route_distance(get_db(), request.get_json(silent=True) or {})
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    return create_response(data=distance)
+
+@cost_analysis_bp.route('/api/route-distances', methods=['DELETE'])
+@permission_required('cost_manage')
+def api_route_distance_delete():
+    data = request.get_json(silent=True) or {}
+    if not delete_route_distance(get_db(), data.get('route_name'), data.get('route_direction')):
+        return create_response(success=False, error={'code': 4041, 'message': '邮路里程不存在'}), 404
+    return create_response(data={'route_name': data.get('route_name'), 'route_direction': data.get('route_direction')})
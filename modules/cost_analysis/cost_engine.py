@@ -0,0 +1,266 @@
+"""
+邮路成本引擎 - 已结束任务按 (日期, 邮路, 方向, 承运商) 汇总运价金额、重量、容积和实际装载，
+结果保存在按日、按月两级汇总表中；任务、车辆、运价变化时由触发器登记待重算日期，读取前增量重算。
+每吨公里成本、每立方米成本、装载率在查询时由汇总值和邮路里程计算，修改里程无需重算
+"""
+
+from constants import DispatchStatus
+from dispatch_rollup import split_date_range
+from modules.reconciliation.ledger import TARIFF_AMOUNT_SQL, TARIFF_JOIN_SQL
+from task_archive import TASK_SOURCES, open_archive, union_sources
+
+# 每个事务重算的天数
+REFRESH_CHUNK_DAYS = 31
+
+# 查询接口读取前同步重算的天数上限（只重算查询范围内的日期），其余由后台任务处理
+READ_REFRESH_DAYS = 7
+
+FULL_REFRESH_MARK = '*'
+
+METRIC_COLUMNS = ['task_count', 'priced_count', 'total_weight', 'priced_weight', 'planned_volume',
+                  'billed_volume', 'priced_volume', 'amount', 'measured_volume', 'actual_volume']
+
+# 报表分组方式 -> 分组列
+GROUPINGS = {
+    'route': ['route_name', 'route_direction'],
+    'carrier': ['carrier_company'],
+    'route_carrier': ['route_name', 'route_direction', 'carrier_company'],
+    'day': ['day'],
+    'month': ['month'],
+}
+
+# 单个库中待重算日期的已结束任务，按任务汇总实际装载容积
+TASK_SOURCE_SQL = '''
+        SELECT m.required_date, m.route_name, m.route_direction, m.carrier_company, m.transport_type,
+               m.requirement_type, m.weight, m.volume,
+               (SELECT SUM(v.actual_volume) FROM {vehicles} v WHERE v.task_id = m.task_id) AS actual_volume
+        FROM {tasks} m
+        WHERE m.status = ? AND m.required_date IN (SELECT day FROM temp.cost_refresh_days)
+'''
+
+DAILY_ROLLUP_SQL = f'''
+    INSERT INTO route_cost_daily (day, route_name, route_direction, carrier_company, {', '.join(METRIC_COLUMNS)})
+    SELECT t.required_date, t.route_name, t.route_direction, t.carrier_company,
+           COUNT(*), COUNT(tr.id),
+           SUM(t.weight), SUM(CASE WHEN tr.id IS NOT NULL THEN t.weight ELSE 0 END),
+           SUM(t.volume), SUM(t.billed_volume), SUM(CASE WHEN tr.id IS NOT NULL THEN t.billed_volume ELSE 0 END),
+           ROUND(SUM({TARIFF_AMOUNT_SQL}), 2),
+           SUM(CASE WHEN t.actual_volume IS NOT NULL THEN t.volume ELSE 0 END), COALESCE(SUM(t.actual_volume), 0)
+    FROM (SELECT s.*, COALESCE(s.actual_volume, s.volume) AS billed_volume FROM ({{source}}) s) t
+    {TARIFF_JOIN_SQL}
+    GROUP BY t.required_date, t.route_name, t.route_direction, t.carrier_company
+'''
+
+# 把待重算日期的按日汇总乘以 :sign（1 或 -1）累加到按月汇总
+MONTHLY_DELTA_SQL = f'''
+    INSERT INTO route_cost_monthly (month, route_name, route_direction, carrier_company, {', '.join(METRIC_COLUMNS)})
+    SELECT substr(day, 1, 7), route_name, route_direction, carrier_company,
+           {', '.join(f'SUM({c}) * :sign' for c in METRIC_COLUMNS)}
+    FROM route_cost_daily
+    WHERE day IN (SELECT day FROM temp.cost_refresh_days)
+    GROUP BY substr(day, 1, 7), route_name, route_direction, carrier_company
+    ON CONFLICT (month, route_name, route_direction, carrier_company) DO UPDATE SET
+        {', '.join(f'{c} = ROUND({c} + excluded.{c}, 3)' for c in METRIC_COLUMNS)}
+'''
+
+
+def _prepare_temp_tables(conn):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS cost_refresh_days (day TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.execute('DELETE FROM temp.cost_refresh_days')
+
+
+def _expand_full_refresh(conn):
+    """把全量重算标记展开为在途库与归档库中全部有已结束任务的日期"""
+    with conn:
+        if not conn.execute('DELETE FROM route_cost_dirty_days WHERE day = ?', (FULL_REFRESH_MARK,)).rowcount:
+            return
+        conn.execute(f'''
+            INSERT OR IGNORE INTO route_cost_dirty_days (day)
+            {union_sources('SELECT DISTINCT required_date FROM {tasks} WHERE status = ? AND required_date IS NOT NULL')}
+        ''', [DispatchStatus.TASK_COMPLETED.value] * len(TASK_SOURCES))
+
+
+def pending_days(conn):
+    """待重算日期数（全量重算标记未展开时为None）"""
+    if conn.execute('SELECT 1 FROM route_cost_dirty_days WHERE day = ?', (FULL_REFRESH_MARK,)).fetchone():
+        return None
+    return conn.execute('SELECT COUNT(*) FROM route_cost_dirty_days').fetchone()[0]
+
+
+def refresh_route_costs(conn, date_from=None, date_to=None, limit=None, progress_callback=None):
+    """
+    重算待重算日期的按日汇总，并把变化量累加到按月汇总；每 REFRESH_CHUNK_DAYS 天一个事务
+
+    Args:
+        date_from, date_to (str, optional): 只重算该范围内的日期
+        limit (int, optional): 本次最多重算的天数，默认全部
+        progress_callback (callable, optional): 每批重算后回调，参数为已重算天数
+
+    Returns:
+        dict: {'days': 重算天数, 'pending': 剩余待重算天数}
+    """
+    open_archive(conn)
+    _expand_full_refresh(conn)
+    scope, scope_params = 'day != ?', [FULL_REFRESH_MARK]
+    if date_from and date_to:
+        scope, scope_params = 'day BETWEEN ? AND ?', [date_from, date_to]
+
+    refreshed = 0
+    while limit is None or refreshed < limit:
+        size = REFRESH_CHUNK_DAYS if limit is None else min(REFRESH_CHUNK_DAYS, limit - refreshed)
+        with conn:
+            _prepare_temp_tables(conn)
+            count = conn.execute(f'''
+                INSERT INTO temp.cost_refresh_days
+                SELECT day FROM route_cost_dirty_days WHERE {scope} ORDER BY day LIMIT ?
+            ''', scope_params + [size]).rowcount
+            if not count:
+                break
+            conn.execute('DELETE FROM route_cost_dirty_days WHERE day IN (SELECT day FROM temp.cost_refresh_days)')
+            # 按月汇总先减去这些日期旧的按日汇总，重算后再加上新的
+            conn.execute(MONTHLY_DELTA_SQL, {'sign': -1})
+            conn.execute('DELETE FROM route_cost_daily WHERE day IN (SELECT day FROM temp.cost_refresh_days)')
+            conn.execute(DAILY_ROLLUP_SQL.format(source=union_sources(TASK_SOURCE_SQL)),
+                         [DispatchStatus.TASK_COMPLETED.value] * len(TASK_SOURCES))
+            conn.execute(MONTHLY_DELTA_SQL, {'sign': 1})
+            conn.execute('''
+                DELETE FROM route_cost_monthly
+                WHERE task_count = 0 AND month IN (SELECT substr(day, 1, 7) FROM temp.cost_refresh_days)
+            ''')
+        refreshed += count
+        if progress_callback:
+            progress_callback(refreshed)
+    return {'days': refreshed, 'pending': pending_days(conn)}
+
+
+def refresh_job(context, full=False):
+    """后台任务：重算全部待重算日期；full 为真时先标记全量重算"""
+    if full:
+        with context.conn:
+            context.conn.execute('INSERT OR IGNORE INTO route_cost_dirty_days (day) VALUES (?)', (FULL_REFRESH_MARK,))
+    open_archive(context.conn)
+    _expand_full_refresh(context.conn)
+    total = pending_days(context.conn)
+    result = refresh_route_costs(
+        context.conn,
+        progress_callback=lambda done: context.update_progress(done, total, message=f'已重算{done}天')
+    )
+    context.update_progress(result['days'], total, message=f"已重算{result['days']}天", force=True)
+    return result
+
+
+def _with_ratios(row):
+    """补充每吨公里成本、每立方米成本、装载率等比率"""
+    item = dict(row)
+    distance = item.get('distance_km')
+    ton_km = item['priced_weight'] * distance if distance else None
+    item['ton_km'] = round(ton_km, 3) if ton_km is not None else None
+    item['cost_per_ton_km'] = round(item['amount'] / ton_km, 4) if ton_km else None
+    item['cost_per_m3'] = round(item['amount'] / item['priced_volume'], 2) if item['priced_volume'] else None
+    item['utilization'] = (round(item['actual_volume'] / item['measured_volume'], 4)
+                           if item['measured_volume'] else None)
+    item['unpriced_count'] = item['task_count'] - item['priced_count']
+    return item
+
+
+def get_route_costs(conn, date_from, date_to, group_by='route', carrier=None, route_name=None):
+    """
+    查询成本报表（读取前重算查询范围内最多 READ_REFRESH_DAYS 个待重算日期）
+
+    Args:
+        group_by (str): route、carrier、route_carrier、day、month
+
+    Returns:
+        dict: {'list': 分组结果, 'total': 合计, 'pending_days': 剩余待重算天数}
+    """
+    if group_by not in GROUPINGS:
+        raise ValueError(f"分组方式必须是以下之一: {'、'.join(GROUPINGS)}")
+    refresh = refresh_route_costs(conn, date_from, date_to, limit=READ_REFRESH_DAYS)
+
+    # 按日分组只能读按日汇总；按月分组时首尾不足整月的部分按所在月份归组
+    parts = [('day', date_from, date_to)] if group_by == 'day' else split_date_range(date_from, date_to)
+    filters, filter_params = '', []
+    if carrier:
+        filters += ' AND carrier_company = ?'
+        filter_params.append(carrier)
+    if route_name:
+        filters += ' AND route_name = ?'
+        filter_params.append(route_name)
+
+    # 每部分先各自分组汇总，合并后再汇总一次并关联里程
+    columns = GROUPINGS[group_by]
+    group_columns = ', '.join(columns)
+    sums = ', '.join(f'SUM({c}) AS {c}' for c in METRIC_COLUMNS)
+    selects, params = [], []
+    for key, start, end in parts:
+        keys = group_columns.replace('month', f'substr({key}, 1, 7) AS month') if group_by == 'month' else group_columns
+        selects.append(f'''
+            SELECT {keys}, {sums} FROM route_cost_{'daily' if key == 'day' else 'monthly'}
+            WHERE {key} BETWEEN ? AND ?{filters}
+            GROUP BY {group_columns}
+        ''')
+        params += [start, end, *filter_params]
+
+    with_distance = 'route_name' in columns
+    rows = conn.execute(f'''
+        SELECT r.*{', d.distance_km' if with_distance else ''}
+        FROM (SELECT {group_columns}, {sums} FROM ({' UNION ALL '.join(selects)}) GROUP BY {group_columns}) r
+        {'LEFT JOIN route_distances d ON d.route_name = r.route_name AND d.route_direction = r.route_direction'
+         if with_distance else ''}
+        ORDER BY {'r.' + columns[0] if group_by in ('day', 'month') else 'r.amount DESC'}
+    ''', params).fetchall()
+
+    items = [_with_ratios(row) for row in rows]
+    total = {c: round(sum(item[c] for item in items), 3) for c in METRIC_COLUMNS}
+    # 合计的每吨公里成本只统计有里程的邮路
+    if with_distance:
+        measured = [item for item in items if item['ton_km']]
+        ton_km = sum(item['ton_km'] for item in measured)
+        total['ton_km'] = round(ton_km, 3)
+        total['cost_per_ton_km'] = round(sum(item['amount'] for item in measured) / ton_km, 4) if ton_km else None
+    total['cost_per_m3'] = round(total['amount'] / total['priced_volume'], 2) if total['priced_volume'] else None
+    total['utilization'] = (round(total['actual_volume'] / total['measured_volume'], 4)
+                            if total['measured_volume'] else None)
+    return {'list': items, 'total': total, 'pending_days': refresh['pending']}
+
+
+def list_route_distances(conn):
+    """邮路里程表，附带尚未维护里程的邮路（distance_km 为空）"""
+    rows = conn.execute('''
+        SELECT r.route_name, r.route_direction, d.distance_km, d.updated_at
+        FROM (SELECT DISTINCT route_name, route_direction FROM route_cost_monthly
+              UNION SELECT route_name, route_direction FROM route_distances) r
+        LEFT JOIN route_distances d ON d.route_name = r.route_name AND d.route_direction = r.route_direction
+        ORDER BY d.distance_km IS NULL DESC, r.route_name, r.route_direction
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+
+def save_route_distance(conn, data):
+    """新增或修改邮路里程，参数错误时抛出ValueError"""
+    route_name = (data.get('route_name') or '').strip()
+    route_direction = (data.get('route_direction') or '').strip()
+    if not route_name or not route_direction:
+        raise ValueError('邮路名称和方向不能为空')
+    try:
+        distance = float(data.get('distance_km'))
+    except (TypeError, ValueError):
+        raise ValueError('里程必须是数字')
+    if distance <= 0:
+        raise ValueError('里程必须大于0')
+
+    with conn:
+        conn.execute('''
+            INSERT INTO route_distances (route_name, route_direction, distance_km, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (route_name, route_direction) DO UPDATE SET
+                distance_km = excluded.distance_km, updated_at = excluded.updated_at
+        ''', (route_name, route_direction, distance))
+    return {'route_name': route_name, 'route_direction': route_direction, 'distance_km': distance}
+
+
+def delete_route_distance(conn, route_name, route_direction):
+    """删除邮路里程，返回是否存在"""
+    with conn:
+        return conn.execute('DELETE FROM route_distances WHERE route_name = ? AND route_direction = ?',
+                            (route_name, route_direction)).rowcount > 0
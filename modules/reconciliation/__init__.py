@@ -1,9 +1,28 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from flask import Blueprint, render_template
+from datetime import date
+from flask import Blueprint, render_template, request, session
 from flask_login import current_user
-from modules.user_management import permission_required
+from api.decorators import create_response
+from modules.user_management import permission_required, get_db
+from modules.user_management.user_query import parse_pagination
+from .ledger import current_period, parse_period, get_summary, get_task_ledger, sync_period
+from .ingest import (DATA_SOURCES, STATEMENT_FIELDS, list_profiles, save_profile, delete_profile,
+                     get_profile, ingest_job, list_batches, delete_batch)
+from .exception_rules import (EXCEPTION_RULES, EXCEPTION_STATUSES, refresh_job, evaluate_period, get_exception_summary, list_exceptions,
+                              handle_exception)
+from .feishu_sync import (OUTBOX_STATUSES, get_outbox_stats, list_documents, list_events, retry_document,
+                          sync_job)
+from .matching import (DEFAULT_DATE_TOLERANCE, MATCH_RESULTS, match_job, list_match_runs, get_latest_run,
+                       list_match_results)
+from reference_cache import company_cache, get_role_permission_names
+from import_service import SUPPORTED_EXTENSIONS
+from job_queue import get_job_manager
+from task_archive import archive_job, get_archive_stats, get_task_detail, search_tasks
+from backup_service import list_snapshots
+from config import ARCHIVE_RETENTION_DAYS, FEISHU_APPROVAL_URL
+from constants import DispatchStatus
 
 reconciliation_bp = Blueprint('reconciliation_bp', __name__, template_folder='templates')
 
@@ -30,7 +49,10 @@ def generate_reports():
 @reconciliation_bp.route('/data_import')
 @permission_required('reconciliation_view')
 def data_import():
-    return render_template('reconciliation/data_import.html', user=current_user)
+    conn = get_db()
+    return render_template('reconciliation/data_import.html', user=current_user,
+                           companies=company_cache.get(conn), profiles=list_profiles(conn),
+                           statement_fields=STATEMENT_FIELDS)
 
 @reconciliation_bp.route('/approval_process')
 @permission_required('reconciliation_view')
@@ -40,19 +62,395 @@ def approval_process():
 @reconciliation_bp.route('/exception_handling')
 @permission_required('reconciliation_view')
 def exception_handling():
-    return render_template('reconciliation/exception_handling.html', user=current_user)
+    conn = get_db()
+    try:
+        period = parse_period(request.args.get('month') or current_period())
+    except ValueError:
+        period = current_period()
+    rule_code = request.args.get('rule') if request.args.get('rule') in EXCEPTION_RULES else None
+    status = request.args.get('status') if request.args.get('status') in EXCEPTION_STATUSES else None
+    page, per_page = parse_pagination(request.args)
+
+    # 只读取异常队列；待复核任务由匹配任务、复核接口（后台任务）或 exceptions-refresh 命令处理
+    exceptions, total = list_exceptions(conn, period, rule_code, status, page, per_page)
+    return render_template('reconciliation/exception_handling.html', user=current_user,
+                           match_runs=list_match_runs(conn), summary=get_exception_summary(conn, period),
+                           exceptions=exceptions, total=total, page=page, per_page=per_page,
+                           total_pages=max((total + per_page - 1) // per_page, 1),
+                           rules=EXCEPTION_RULES, statuses=EXCEPTION_STATUSES,
+                           filters={'rule': rule_code, 'status': status},
+                           can_manage=('超级管理员' in current_user.roles or
+                                       'reconciliation_manage' in get_role_permission_names(conn, current_user.roles)))
 
 @reconciliation_bp.route('/feishu_collaboration')
 @permission_required('reconciliation_view')
 def feishu_collaboration():
-    return render_template('reconciliation/feishu_collaboration.html', user=current_user)
+    conn = get_db()
+    page, per_page = parse_pagination(request.args)
+    documents, total = list_documents(conn, page, per_page)
+    return render_template('reconciliation/feishu_collaboration.html', user=current_user,
+                           documents=documents, total=total, page=page, per_page=per_page,
+                           total_pages=max((total + per_page - 1) // per_page, 1),
+                           stats=get_outbox_stats(conn))
 
 @reconciliation_bp.route('/settlement_documents')
 @permission_required('reconciliation_view')
 def settlement_documents():
-    return render_template('reconciliation/settlement_documents.html', user=current_user)
+    # 读取台账汇总表，不做实时计算
+    period = request.args.get('month') or current_period()
+    try:
+        summary = get_summary(get_db(), parse_period(period))
+    except ValueError:
+        summary = get_summary(get_db(), current_period())
+    return render_template('reconciliation/settlement_documents.html', user=current_user, summary=summary)
+
+def _task_search_filters(args):
+    """解析任务查询条件，用车日期范围默认为本月1日至今天"""
+    today = date.today()
+    date_from = args.get('date_from') or today.replace(day=1).isoformat()
+    date_to = args.get('date_to') or today.isoformat()
+    try:
+        start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    except ValueError:
+        raise ValueError('日期格式错误，应为YYYY-MM-DD')
+    if start > end:
+        raise ValueError('起始日期不能晚于截止日期')
+    status = args.get('status') or None
+    if status and not DispatchStatus.is_valid(status):
+        raise ValueError('任务状态无效')
+    return {'date_from': date_from, 'date_to': date_to, 'status': status,
+            'carrier': (args.get('carrier') or '').strip() or None,
+            'task_id': (args.get('task_id') or '').strip() or None}
 
 @reconciliation_bp.route('/data_query')
 @permission_required('reconciliation_view')
 def data_query():
-    return render_template('reconciliation/data_query.html', user=current_user)
+    conn = get_db()
+    page, per_page = parse_pagination(request.args)
+    try:
+        filters = _task_search_filters(request.args)
+        error = None
+    except ValueError as e:
+        filters, error = _task_search_filters({}), str(e)
+    result = search_tasks(conn, **filters, page=page, per_page=per_page)
+    # 备份接口仅超级管理员可用，与 api/backup.py 的角色校验一致
+    can_manage_backups = session.get('user_role') == '超级管理员'
+    return render_template('reconciliation/data_query.html', user=current_user,
+                           companies=company_cache.get(conn), statuses=DispatchStatus.all_values(),
+                           filters=filters, error=error, tasks=result['list'], total=result['total'],
+                           page=page, per_page=per_page,
+                           total_pages=max((result['total'] + per_page - 1) // per_page, 1),
+                           archive=get_archive_stats(conn), retention_days=ARCHIVE_RETENTION_DAYS,
+                           can_manage_backups=can_manage_backups,
+                           snapshots=list_snapshots() if can_manage_backups else [])
+
+# 结算计算接口 - 按月份或起止日期计算各承运商的结算明细
+@reconciliation_bp.route('/api/settlement')
+@permission_required('reconciliation_view')
+def api_settlement():
+    # 延迟导入，仅在实际结算时加载numpy
+    from .settlement import compute_settlement, period_bounds
+
+    try:
+        date_from, date_to = period_bounds(request.args.get('month'),
+                                           request.args.get('date_from'), request.args.get('date_to'))
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+
+    carrier = request.args.get('carrier', '').strip() or None
+    return create_response(data=compute_settlement(get_db(), date_from, date_to, carrier))
+
+# 运价表接口
+@reconciliation_bp.route('/api/tariffs')
+@permission_required('reconciliation_view')
+def api_tariff_list():
+    from .settlement import list_tariffs
+
+    carrier = request.args.get('carrier', '').strip() or None
+    return create_response(data=list_tariffs(get_db(), carrier))
+
+@reconciliation_bp.route('/api/tariffs', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_tariff_save():
+    from .settlement import save_tariff
+
+    try:
+        tariff_id = save_tariff(get_db(), request.get_json(silent=True) or {})
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    return create_response(data={'id': tariff_id})
+
+@reconciliation_bp.route('/api/tariffs/<int:tariff_id>', methods=['DELETE'])
+@permission_required('reconciliation_manage')
+def api_tariff_delete(tariff_id):
+    from .settlement import delete_tariff
+
+    if not delete_tariff(get_db(), tariff_id):
+        return create_response(success=False, error={'code': 4041, 'message': '运价不存在'}), 404
+    return create_response(data={'id': tariff_id})
+
+# 结算台账接口 - 读取按承运商累计的结算期汇总
+@reconciliation_bp.route('/api/settlement/summary')
+@permission_required('reconciliation_view')
+def api_settlement_summary():
+    try:
+        period = parse_period(request.args.get('month') or current_period())
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+
+    carrier = request.args.get('carrier', '').strip() or None
+    return create_response(data=get_summary(get_db(), period, carrier))
+
+@reconciliation_bp.route('/api/settlement/ledger/<task_id>')
+@permission_required('reconciliation_view')
+def api_task_ledger(task_id):
+    return create_response(data=get_task_ledger(get_db(), task_id))
+
+# 按当前运价重新核对整个结算期（补录历史任务、调整运价后调用）
+@reconciliation_bp.route('/api/settlement/sync', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_settlement_sync():
+    data = request.get_json(silent=True) or {}
+    try:
+        period = parse_period(data.get('month') or current_period())
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+
+    result = sync_period(get_db(), period, operator=current_user.username, note=data.get('note'))
+    return create_response(data={'period': period, **result})
+
+# 对账单字段映射方案
+@reconciliation_bp.route('/api/mapping-profiles')
+@permission_required('reconciliation_view')
+def api_mapping_profile_list():
+    carrier = request.args.get('carrier', '').strip() or None
+    return create_response(data={'fields': STATEMENT_FIELDS, 'list': list_profiles(get_db(), carrier)})
+
+@reconciliation_bp.route('/api/mapping-profiles', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_mapping_profile_save():
+    try:
+        profile_id = save_profile(get_db(), request.get_json(silent=True) or {}, created_by=current_user.id)
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    return create_response(data={'id': profile_id})
+
+@reconciliation_bp.route('/api/mapping-profiles/<int:profile_id>', methods=['DELETE'])
+@permission_required('reconciliation_manage')
+def api_mapping_profile_delete(profile_id):
+    if not delete_profile(get_db(), profile_id):
+        return create_response(success=False, error={'code': 4041, 'message': '映射方案不存在'}), 404
+    return create_response(data={'id': profile_id})
+
+# 对账单导入 - 文件暂存后由后台任务流式写入暂存表，通过 /api/jobs/<job_id> 查询进度
+@reconciliation_bp.route('/api/statements/import', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_statement_import():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return create_response(success=False, error={'code': 4001, 'message': '未上传文件'}), 400
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        return create_response(success=False, error={
+            'code': 4001, 'message': '文件格式不正确，请上传.xlsx或.csv格式的文件'
+        }), 400
+
+    carrier = request.form.get('carrier_company', '').strip()
+    if not carrier:
+        return create_response(success=False, error={'code': 4001, 'message': '缺少必填字段: carrier_company'}), 400
+    data_source = request.form.get('data_source') or 'supplier'
+    if data_source not in DATA_SOURCES:
+        return create_response(success=False, error={'code': 4001, 'message': '数据来源无效'}), 400
+    profile_id = request.form.get('profile_id', type=int)
+    if profile_id and not get_profile(get_db(), profile_id):
+        return create_response(success=False, error={'code': 4041, 'message': '映射方案不存在'}), 404
+
+    job_manager = get_job_manager()
+    upload_path = job_manager.upload_path(file.filename)
+    file.save(upload_path)
+    # submit 的 created_by 只记录在任务上，导入批次的操作人需作为任务参数传入
+    job_id = job_manager.submit('statement_import', ingest_job, upload_path, file.filename, carrier,
+                                profile_id, data_source, current_user.id, created_by=current_user.id)
+    return create_response(data={'job_id': job_id}), 202
+
+@reconciliation_bp.route('/api/statements/batches')
+@permission_required('reconciliation_view')
+def api_statement_batches():
+    carrier = request.args.get('carrier', '').strip() or None
+    return create_response(data=list_batches(get_db(), carrier))
+
+@reconciliation_bp.route('/api/statements/batches/<int:batch_id>', methods=['DELETE'])
+@permission_required('reconciliation_manage')
+def api_statement_batch_delete(batch_id):
+    if not delete_batch(get_db(), batch_id):
+        return create_response(success=False, error={'code': 4041, 'message': '导入批次不存在'}), 404
+    return create_response(data={'id': batch_id})
+
+# 对账匹配 - 后台任务将批次对账单与派车记录匹配，通过 /api/jobs/<job_id> 查询进度
+@reconciliation_bp.route('/api/statements/batches/<int:batch_id>/match', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_statement_match(batch_id):
+    data = request.get_json(silent=True) or {}
+    date_tolerance = data.get('date_tolerance', DEFAULT_DATE_TOLERANCE)
+    if not isinstance(date_tolerance, int) or isinstance(date_tolerance, bool):
+        return create_response(success=False, error={'code': 4001, 'message': '日期容差必须是整数'}), 400
+
+    batch = get_db().execute('SELECT status FROM statement_batches WHERE id = ?', (batch_id,)).fetchone()
+    if not batch:
+        return create_response(success=False, error={'code': 4041, 'message': '导入批次不存在'}), 404
+    if batch['status'] != '已完成':
+        return create_response(success=False, error={'code': 4001, 'message': '导入批次尚未完成，不能匹配'}), 400
+
+    job_id = get_job_manager().submit('statement_match', match_job, batch_id, date_tolerance, current_user.id,
+                                      created_by=current_user.id)
+    return create_response(data={'job_id': job_id}), 202
+
+@reconciliation_bp.route('/api/statements/batches/<int:batch_id>/matches')
+@permission_required('reconciliation_view')
+def api_statement_matches(batch_id):
+    result = request.args.get('result') or None
+    if result and result not in MATCH_RESULTS:
+        return create_response(success=False, error={'code': 4001, 'message': '匹配结果类型无效'}), 400
+
+    conn = get_db()
+    run = get_latest_run(conn, batch_id)
+    if not run:
+        return create_response(success=False, error={'code': 4041, 'message': '该批次尚未完成匹配'}), 404
+    page, per_page = parse_pagination(request.args)
+    results, total = list_match_results(conn, run['id'], result, page, per_page)
+    return create_response(data={'run': run, 'list': results, 'total': total, 'page': page, 'limit': per_page})
+
+# 对账异常队列 - 查询前先复核少量有变化的任务
+@reconciliation_bp.route('/api/exceptions')
+@permission_required('reconciliation_view')
+def api_exception_list():
+    period = request.args.get('month') or None
+    if period:
+        try:
+            period = parse_period(period)
+        except ValueError as e:
+            return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    rule_code = request.args.get('rule') or None
+    if rule_code and rule_code not in EXCEPTION_RULES:
+        return create_response(success=False, error={'code': 4001, 'message': '异常规则无效'}), 400
+    status = request.args.get('status') or None
+    if status and status not in EXCEPTION_STATUSES:
+        return create_response(success=False, error={'code': 4001, 'message': '处理状态无效'}), 400
+
+    conn = get_db()
+    page, per_page = parse_pagination(request.args)
+    exceptions, total = list_exceptions(conn, period, rule_code, status, page, per_page)
+    return create_response(data={'list': exceptions, 'total': total, 'page': page, 'limit': per_page})
+
+@reconciliation_bp.route('/api/exceptions/summary')
+@permission_required('reconciliation_view')
+def api_exception_summary():
+    try:
+        period = parse_period(request.args.get('month') or current_period())
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+
+    return create_response(data=get_exception_summary(get_db(), period))
+
+@reconciliation_bp.route('/api/exceptions/<int:exception_id>/handle', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_exception_handle(exception_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        found = handle_exception(get_db(), exception_id, data.get('status'), data.get('note'), current_user.id)
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    if not found:
+        return create_response(success=False, error={'code': 4041, 'message': '异常记录不存在'}), 404
+    return create_response(data={'id': exception_id})
+
+# 复核异常规则：指定月份时同步全量复核该结算期，否则由后台任务处理全部待复核任务
+@reconciliation_bp.route('/api/exceptions/refresh', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_exception_refresh():
+    data = request.get_json(silent=True) or {}
+    if data.get('month'):
+        try:
+            period = parse_period(data['month'])
+        except ValueError as e:
+            return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+        return create_response(data={'period': period, **evaluate_period(get_db(), period)})
+
+    job_id = get_job_manager().submit('exception_refresh', refresh_job, created_by=current_user.id)
+    return create_response(data={'job_id': job_id}), 202
+
+# 任务查询接口 - 同时查询在途与已归档任务
+@reconciliation_bp.route('/api/tasks/search')
+@permission_required('reconciliation_view')
+def api_task_search():
+    try:
+        filters = _task_search_filters(request.args)
+    except ValueError as e:
+        return create_response(success=False, error={'code': 4001, 'message': str(e)}), 400
+    page, per_page = parse_pagination(request.args)
+    result = search_tasks(get_db(), **filters, page=page, per_page=per_page)
+    return create_response(data={**result, 'page': page, 'limit': per_page})
+
+@reconciliation_bp.route('/api/tasks/<task_id>/detail')
+@permission_required('reconciliation_view')
+def api_task_detail(task_id):
+    task = get_task_detail(get_db(), task_id)
+    if task is None:
+        return create_response(success=False, error={'code': 4041, 'message': '任务不存在'}), 404
+    return create_response(data=task)
+
+# 任务归档接口
+@reconciliation_bp.route('/api/archive')
+@permission_required('reconciliation_view')
+def api_archive_stats():
+    return create_response(data={**get_archive_stats(get_db()), 'retention_days': ARCHIVE_RETENTION_DAYS})
+
+@reconciliation_bp.route('/api/archive/run', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_archive_run():
+    data = request.get_json(silent=True) or {}
+    retention_days = data.get('retention_days', ARCHIVE_RETENTION_DAYS)
+    if not isinstance(retention_days, int) or retention_days < 0:
+        return create_response(success=False, error={'code': 4001, 'message': '保留天数应为非负整数'}), 400
+
+    job_id = get_job_manager().submit('task_archive', archive_job, retention_days, created_by=current_user.id)
+    return create_response(data={'job_id': job_id}), 202
+
+# 飞书审批同步接口
+@reconciliation_bp.route('/api/feishu/stats')
+@permission_required('reconciliation_view')
+def api_feishu_stats():
+    return create_response(data=get_outbox_stats(get_db()))
+
+@reconciliation_bp.route('/api/feishu/documents')
+@permission_required('reconciliation_view')
+def api_feishu_documents():
+    page, per_page = parse_pagination(request.args)
+    documents, total = list_documents(get_db(), page, per_page)
+    return create_response(data={'list': documents, 'total': total, 'page': page, 'limit': per_page})
+
+@reconciliation_bp.route('/api/feishu/events')
+@permission_required('reconciliation_view')
+def api_feishu_events():
+    status = request.args.get('status') or None
+    if status and status not in OUTBOX_STATUSES:
+        return create_response(success=False, error={'code': 4001, 'message': '同步状态无效'}), 400
+    page, per_page = parse_pagination(request.args)
+    events, total = list_events(get_db(), request.args.get('document_no') or None, status, page, per_page)
+    return create_response(data={'list': events, 'total': total, 'page': page, 'limit': per_page})
+
+@reconciliation_bp.route('/api/feishu/documents/<path:document_no>/retry', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_feishu_retry(document_no):
+    count = retry_document(get_db(), document_no)
+    if not count:
+        return create_response(success=False, error={'code': 4041, 'message': '该单据没有同步失败的事件'}), 404
+    return create_response(data={'document_no': document_no, 'retried': count})
+
+# 立即推送全部到期事件（未启动后台推送线程时使用）
+@reconciliation_bp.route('/api/feishu/sync', methods=['POST'])
+@permission_required('reconciliation_manage')
+def api_feishu_sync():
+    if not FEISHU_APPROVAL_URL:
+        return create_response(success=False, error={'code': 4001, 'message': '未配置审批系统地址'}), 400
+    job_id = get_job_manager().submit('feishu_sync', sync_job, created_by=current_user.id)
+    return create_response(data={'job_id': job_id}), 202
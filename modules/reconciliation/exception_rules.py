@@ -0,0 +1,265 @@
+"""
+对账异常规则 - 以集合SQL扫描派车数据和对账匹配结果，生成待审核的异常队列
+任务、车辆、车辆容积参考变化时由触发器登记到 exception_dirty_tasks，复核时只重新计算这些任务；
+规则不再命中的待处理异常自动标记为已解决，审核人员驳回的异常不会被重新打开
+"""
+
+from datetime import datetime
+
+from constants import DispatchStatus
+from .feishu_sync import enqueue_exception_event, wake_dispatcher
+from .ledger import PERIOD_SQL, _next_period_start
+
+# 每个事务复核的任务数
+REFRESH_CHUNK_SIZE = 20000
+
+STATUS_PENDING = '待处理'
+STATUS_PROCESSING = '处理中'
+STATUS_RESOLVED = '已解决'
+STATUS_REJECTED = '已驳回'
+EXCEPTION_STATUSES = (STATUS_PENDING, STATUS_PROCESSING, STATUS_RESOLVED, STATUS_REJECTED)
+
+# 规则代码 -> 名称
+EXCEPTION_RULES = {
+    'volume_overrun': '容积超限',
+    'duplicate_dispatch': '派车单号重复',
+    'billed_cancelled': '取消任务仍计费',
+    'missing_vehicle': '缺少车辆信息'
+}
+
+# 各规则对范围内任务的命中结果：(rule_code, task_id, ref_id, period, detail)
+RULES_SQL = {
+    'volume_overrun': f'''
+        SELECT 'volume_overrun', t.task_id, v.id, {PERIOD_SQL},
+               printf('车辆%s装载容积%g超过标准容积%g', v.license_plate, v.actual_volume, c.standard_volume)
+        FROM manual_dispatch_tasks t
+        JOIN vehicles v ON v.task_id = t.task_id
+        JOIN vehicle_capacity_reference c ON c.license_plate = v.license_plate
+        WHERE {{scope}} AND t.status != '{DispatchStatus.TASK_CANCELLED.value}'
+          AND v.actual_volume > c.standard_volume
+    ''',
+    'duplicate_dispatch': f'''
+        SELECT 'duplicate_dispatch', t.task_id, v.id, {PERIOD_SQL},
+               printf('派车单号%s与其他%d辆车重复', v.dispatch_number,
+                      (SELECT COUNT(*) FROM vehicles d WHERE d.dispatch_number = v.dispatch_number) - 1)
+        FROM manual_dispatch_tasks t
+        JOIN vehicles v ON v.task_id = t.task_id
+        WHERE {{scope}} AND v.dispatch_number != ''
+          AND EXISTS (SELECT 1 FROM vehicles d WHERE d.dispatch_number = v.dispatch_number AND d.id != v.id)
+    ''',
+    'billed_cancelled': f'''
+        SELECT 'billed_cancelled', t.task_id, s.id, {PERIOD_SQL},
+               printf('任务已取消，但对账批次%d第%d行仍计费', s.batch_id, s.row_number)
+        FROM manual_dispatch_tasks t
+        JOIN statement_match_results r ON r.task_id = t.task_id
+        JOIN statement_staging s ON s.id = r.staging_id
+        WHERE {{scope}} AND t.status = '{DispatchStatus.TASK_CANCELLED.value}'
+    ''',
+    'missing_vehicle': f'''
+        SELECT 'missing_vehicle', t.task_id, 0, {PERIOD_SQL}, '任务已结束但未登记车辆信息'
+        FROM manual_dispatch_tasks t
+        WHERE {{scope}} AND t.status = '{DispatchStatus.TASK_COMPLETED.value}'
+          AND NOT EXISTS (SELECT 1 FROM vehicles v WHERE v.task_id = t.task_id)
+    '''
+}
+
+EXCEPTION_COLUMNS = ['id', 'rule_code', 'task_id', 'ref_id', 'period', 'detail', 'status', 'detected_at',
+                     'updated_at', 'resolved_at', 'handled_by', 'handle_note']
+
+# 复核范围：规则SQL中任务表别名为 t
+SCOPE_TASKS = 't.task_id IN (SELECT task_id FROM temp.exception_scope)'
+SCOPE_EXCEPTIONS = 'task_id IN (SELECT task_id FROM temp.exception_scope)'
+
+
+def _prepare_temp_tables(conn):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS exception_scope (task_id TEXT PRIMARY KEY)')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS exception_current (
+            rule_code TEXT, task_id TEXT, ref_id INTEGER, period TEXT, detail TEXT,
+            PRIMARY KEY (rule_code, task_id, ref_id)
+        )
+    ''')
+    conn.execute('DELETE FROM temp.exception_current')
+
+
+def _evaluate(conn, task_scope, task_params, exception_scope, exception_params):
+    """
+    计算范围内任务的规则命中结果并与异常队列对比：新命中写入或重新打开，
+    不再命中的待处理、处理中异常标记为已解决。不提交事务，由调用方提交
+
+    Returns:
+        dict: {'opened': 新增、重新打开或内容变化的条数, 'resolved': 自动解决条数}
+    """
+    _prepare_temp_tables(conn)
+    for sql in RULES_SQL.values():
+        conn.execute(f'INSERT OR IGNORE INTO temp.exception_current {sql.format(scope=task_scope)}', task_params)
+
+    resolved = conn.execute(f'''
+        UPDATE reconciliation_exceptions
+        SET status = ?, resolved_at = CURRENT_TIMESTAMP, handle_note = '复核时规则不再命中'
+        WHERE {exception_scope} AND status IN (?, ?)
+          AND NOT EXISTS (SELECT 1 FROM temp.exception_current c
+                          WHERE c.rule_code = reconciliation_exceptions.rule_code
+                            AND c.task_id = reconciliation_exceptions.task_id
+                            AND c.ref_id = reconciliation_exceptions.ref_id)
+    ''', [STATUS_RESOLVED, *exception_params, STATUS_PENDING, STATUS_PROCESSING]).rowcount
+
+    # 新命中写入；已解决的重新打开，驳回的保持不变
+    opened = conn.execute('''
+        INSERT INTO reconciliation_exceptions (rule_code, task_id, ref_id, period, detail)
+        SELECT rule_code, task_id, ref_id, period, detail FROM temp.exception_current WHERE true
+        ON CONFLICT (rule_code, task_id, ref_id) DO UPDATE SET
+            period = excluded.period,
+            detail = excluded.detail,
+            updated_at = CURRENT_TIMESTAMP,
+            status = CASE status WHEN ? THEN ? ELSE status END,
+            resolved_at = CASE status WHEN ? THEN NULL ELSE resolved_at END
+        WHERE status = ? OR detail IS NOT excluded.detail OR period != excluded.period
+    ''', (STATUS_RESOLVED, STATUS_PENDING, STATUS_RESOLVED, STATUS_RESOLVED)).rowcount
+    return {'opened': opened, 'resolved': resolved}
+
+
+def mark_batch_tasks(conn, batch_id):
+    """登记对账批次中已取消的任务待复核（匹配结果变化前后各调用一次）。不提交事务"""
+    conn.execute('''
+        INSERT OR IGNORE INTO exception_dirty_tasks (task_id)
+        SELECT DISTINCT r.task_id
+        FROM statement_match_results r
+        JOIN manual_dispatch_tasks t ON t.task_id = r.task_id
+        WHERE r.batch_id = ? AND r.staging_id IS NOT NULL AND t.status = ?
+    ''', (batch_id, DispatchStatus.TASK_CANCELLED.value))
+
+
+def pending_count(conn):
+    """待复核的任务数"""
+    return conn.execute('SELECT COUNT(*) FROM exception_dirty_tasks').fetchone()[0]
+
+
+def refresh_exceptions(conn, limit=None, progress_callback=None):
+    """
+    复核待复核任务，每 REFRESH_CHUNK_SIZE 个任务一个事务
+
+    Args:
+        limit (int, optional): 本次最多复核的任务数，默认全部
+        progress_callback (callable, optional): 每批复核后回调，参数为已复核任务数
+
+    Returns:
+        dict: 复核任务数、新增或变化条数、自动解决条数、剩余待复核任务数
+    """
+    result = {'tasks': 0, 'opened': 0, 'resolved': 0}
+    while limit is None or result['tasks'] < limit:
+        size = REFRESH_CHUNK_SIZE if limit is None else min(REFRESH_CHUNK_SIZE, limit - result['tasks'])
+        with conn:
+            _prepare_temp_tables(conn)
+            conn.execute('DELETE FROM temp.exception_scope')
+            count = conn.execute('INSERT INTO temp.exception_scope SELECT task_id FROM exception_dirty_tasks LIMIT ?',
+                                 (size,)).rowcount
+            if not count:
+                break
+            conn.execute(f'DELETE FROM exception_dirty_tasks WHERE {SCOPE_EXCEPTIONS}')
+            changes = _evaluate(conn, SCOPE_TASKS, [], SCOPE_EXCEPTIONS, [])
+        result['tasks'] += count
+        result['opened'] += changes['opened']
+        result['resolved'] += changes['resolved']
+        if progress_callback:
+            progress_callback(result['tasks'])
+    result['pending'] = pending_count(conn)
+    return result
+
+
+def refresh_job(context):
+    """后台任务：复核全部待复核任务"""
+    total = pending_count(context.conn)
+    result = refresh_exceptions(
+        context.conn,
+        progress_callback=lambda done: context.update_progress(done, total, message=f'已复核{done}个任务')
+    )
+    context.update_progress(result['tasks'], total, message=f"已复核{result['tasks']}个任务", force=True)
+    return result
+
+
+def evaluate_period(conn, period):
+    """
+    全量复核一个结算期（用车日期所在月份）的全部任务，并提交事务
+
+    Args:
+        period (str): YYYY-MM
+    """
+    task_scope = 't.required_date >= ? AND t.required_date < ?'
+    task_params = [f'{period}-01', _next_period_start(period)]
+    exception_scope = ('(period = ? OR task_id IN (SELECT task_id FROM manual_dispatch_tasks '
+                       'WHERE required_date >= ? AND required_date < ?))')
+    with conn:
+        result = _evaluate(conn, task_scope, task_params, exception_scope, [period, *task_params])
+        conn.execute('''
+            INSERT INTO exception_periods (period, evaluated_at) VALUES (?, ?)
+            ON CONFLICT (period) DO UPDATE SET evaluated_at = excluded.evaluated_at
+        ''', (period, datetime.now().isoformat(sep=' ', timespec='seconds')))
+    return result
+
+
+def get_exception_summary(conn, period):
+    """结算期内各规则、各状态的异常数"""
+    counts = {code: dict.fromkeys(EXCEPTION_STATUSES, 0) for code in EXCEPTION_RULES}
+    for rule_code, status, count in conn.execute('''
+        SELECT rule_code, status, COUNT(*) FROM reconciliation_exceptions
+        WHERE period = ? GROUP BY rule_code, status
+    ''', (period,)):
+        if rule_code in counts:
+            counts[rule_code][status] = count
+    evaluated = conn.execute('SELECT evaluated_at FROM exception_periods WHERE period = ?', (period,)).fetchone()
+    return {
+        'period': period,
+        'rules': [{'rule_code': code, 'name': name, **counts[code]} for code, name in EXCEPTION_RULES.items()],
+        'open_count': sum(c[STATUS_PENDING] + c[STATUS_PROCESSING] for c in counts.values()),
+        'evaluated_at': evaluated[0] if evaluated else None,
+        'pending_tasks': pending_count(conn)
+    }
+
+
+def list_exceptions(conn, period=None, rule_code=None, status=None, page=1, per_page=20):
+    """
+    分页查询异常队列
+
+    Returns:
+        tuple: (异常列表, 总数)
+    """
+    conditions, params = [], []
+    for column, value in (('period', period), ('rule_code', rule_code), ('status', status)):
+        if value:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    total = conn.execute(f'SELECT COUNT(*) FROM reconciliation_exceptions {where}', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT {', '.join(EXCEPTION_COLUMNS)} FROM reconciliation_exceptions {where}
+        ORDER BY id DESC LIMIT ? OFFSET ?
+    ''', params + [per_page, (page - 1) * per_page]).fetchall()
+    exceptions = []
+    for row in rows:
+        item = dict(zip(EXCEPTION_COLUMNS, row))
+        item['rule_name'] = EXCEPTION_RULES.get(item['rule_code'], item['rule_code'])
+        exceptions.append(item)
+    return exceptions, total
+
+
+def handle_exception(conn, exception_id, status, note=None, handled_by=None):
+    """
+    审核人员处理异常，返回是否存在；已解决、已驳回的审核结果在同一事务中写入飞书审批同步发件箱，
+    提交后唤醒后台推送线程
+    """
+    if status not in EXCEPTION_STATUSES or status == STATUS_PENDING:
+        raise ValueError(f'处理状态必须是以下之一: {STATUS_PROCESSING}、{STATUS_RESOLVED}、{STATUS_REJECTED}')
+    with conn:
+        cursor = conn.execute('''
+            UPDATE reconciliation_exceptions
+            SET status = ?, handle_note = ?, handled_by = ?,
+                resolved_at = CASE WHEN ? IN (?, ?) THEN CURRENT_TIMESTAMP END
+            WHERE id = ?
+        ''', (status, note, handled_by, status, STATUS_RESOLVED, STATUS_REJECTED, exception_id))
+        enqueued = cursor.rowcount and status in (STATUS_RESOLVED, STATUS_REJECTED)
+        if enqueued:
+            enqueue_exception_event(conn, exception_id)
+    if enqueued:
+        wake_dispatcher()
+    return cursor.rowcount > 0
@@ -0,0 +1,419 @@
+"""
+飞书审批同步 - 发件箱模式
+结算台账变动、对账异常审核结果在业务事务中写入 feishu_outbox，由后台线程批量推送到审批系统，
+请求处理中不调用外部接口；推送失败按指数退避重试，幂等键保证重复推送不会生成重复审批单
+"""
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+
+from config import (FEISHU_APPROVAL_TOKEN, FEISHU_APPROVAL_URL, FEISHU_OUTBOX_RETENTION_DAYS,
+                    FEISHU_SYNC_BACKOFF_BASE, FEISHU_SYNC_BACKOFF_MAX, FEISHU_SYNC_BATCH_SIZE,
+                    FEISHU_SYNC_MAX_ATTEMPTS, FEISHU_SYNC_POLL_INTERVAL, FEISHU_SYNC_TIMEOUT)
+from metrics import LATENCY_BUCKETS, Counter, Histogram, InstrumentedConnection, registry
+
+logger = logging.getLogger(__name__)
+
+EVENT_SETTLEMENT = 'settlement_posted'
+EVENT_EXCEPTION = 'exception_handled'
+EVENT_TYPES = {EVENT_SETTLEMENT: '结算入账', EVENT_EXCEPTION: '异常审核'}
+
+STATUS_PENDING = '待同步'
+STATUS_SENDING = '同步中'
+STATUS_SYNCED = '已同步'
+STATUS_FAILED = '失败'
+OUTBOX_STATUSES = [STATUS_PENDING, STATUS_SENDING, STATUS_SYNCED, STATUS_FAILED]
+
+# 认领后超过该时间仍未回写结果（进程退出等）的事件重新推送
+LEASE_SECONDS = 120
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500)
+
+SYNC_EVENTS = registry.register(Counter('feishu_sync_events_total', '飞书审批同步事件数',
+                                        ('event_type', 'result')))
+SYNC_BATCH_SECONDS = registry.register(Histogram('feishu_sync_batch_duration_seconds', '每批推送耗时（秒）',
+                                                 LATENCY_BUCKETS, ('result',)))
+SYNC_BATCH_SIZE = registry.register(Histogram('feishu_sync_batch_size', '每批推送事件数',
+                                              BATCH_SIZE_BUCKETS, ()))
+
+# 结算单据编号：REC-结算期-承运商，同一单据的入账与冲销事件归在一起
+SETTLEMENT_EVENTS_SQL = f'''
+    INSERT OR IGNORE INTO feishu_outbox (event_type, document_no, idempotency_key, payload)
+    SELECT '{EVENT_SETTLEMENT}', 'REC-' || replace(period, '-', '') || '-' || carrier_company, 'ledger:' || id,
+           json_object('ledger_id', id, 'task_id', task_id, 'period', period, 'carrier_company', carrier_company,
+                       'entry_type', entry_type, 'tariff_id', tariff_id, 'weight', weight,
+                       'billed_volume', billed_volume, 'amount', amount, 'operator', operator,
+                       'note', note, 'created_at', created_at)
+    FROM settlement_ledger
+    WHERE id > ?
+'''
+
+EXCEPTION_EVENT_SQL = f'''
+    INSERT OR IGNORE INTO feishu_outbox (event_type, document_no, idempotency_key, payload)
+    SELECT '{EVENT_EXCEPTION}', 'EXC-' || id, ?,
+           json_object('exception_id', id, 'rule_code', rule_code, 'task_id', task_id, 'period', period,
+                       'detail', detail, 'status', status, 'handled_by', handled_by, 'handle_note', handle_note,
+                       'resolved_at', resolved_at)
+    FROM reconciliation_exceptions
+    WHERE id = ?
+'''
+
+
+def enqueue_ledger_events(conn, after_id):
+    """把 id 大于 after_id 的台账记录写入发件箱（在调用方事务中执行），返回写入条数"""
+    return conn.execute(SETTLEMENT_EVENTS_SQL, (after_id,)).rowcount
+
+
+def enqueue_exception_event(conn, exception_id):
+    """把异常的审核结果写入发件箱（在调用方事务中执行）；每次审核生成新的幂等键"""
+    conn.execute(EXCEPTION_EVENT_SQL, (f'exception:{exception_id}:{uuid.uuid4().hex}', exception_id))
+
+
+class ApprovalClientError(Exception):
+    """整批推送失败（网络错误、超时、服务端繁忙），整批稍后重试"""
+
+
+class ApprovalClient(ABC):
+    """
+    审批系统客户端接口
+    send_batch(events) 接收事件列表（idempotency_key、event_type、document_no、payload），
+    返回 {幂等键: {'status': 'accepted'|'duplicate'|'rejected', 'approval_no', 'approval_status', 'error'}}；
+    未返回结果的事件稍后重试
+    """
+
+    @abstractmethod
+    def send_batch(self, events):
+        pass
+
+
+class HttpApprovalClient(ApprovalClient):
+    """通过HTTP推送到审批系统：POST {base_url}/approvals/batch，请求体 {"events": [...]}"""
+
+    def __init__(self, base_url, token=None, timeout=FEISHU_SYNC_TIMEOUT):
+        self.url = base_url.rstrip('/') + '/approvals/batch'
+        self.token = token
+        self.timeout = timeout
+
+    def send_batch(self, events):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url, data=json.dumps({'events': events}, ensure_ascii=False).encode(),
+                                         headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                raise ApprovalClientError(f'审批系统繁忙（HTTP {e.code}）')
+            # 其他4xx为请求本身有误，整批标记为拒绝
+            error = f'审批系统拒绝请求（HTTP {e.code}）'
+            return {event['idempotency_key']: {'status': 'rejected', 'error': error} for event in events}
+        except (OSError, ValueError) as e:
+            raise ApprovalClientError(f'请求审批系统失败: {str(e)}')
+        return {item['idempotency_key']: item for item in data.get('results', []) if 'idempotency_key' in item}
+
+
+def get_approval_client():
+    """按配置创建审批系统客户端，未配置地址时返回None"""
+    if not FEISHU_APPROVAL_URL:
+        return None
+    return HttpApprovalClient(FEISHU_APPROVAL_URL, FEISHU_APPROVAL_TOKEN)
+
+
+def _backoff_seconds(attempts):
+    """第 attempts 次失败后的重试间隔，加入随机抖动避免大量事件同时重试"""
+    delay = min(FEISHU_SYNC_BACKOFF_BASE * 2 ** (attempts - 1), FEISHU_SYNC_BACKOFF_MAX)
+    return round(delay * random.uniform(0.8, 1.2))
+
+
+def _claim(conn, batch_size):
+    """认领一批到期事件：先收回租期已过的同步中事件，再按到期时间取待同步事件"""
+    with conn:
+        conn.execute('''
+            UPDATE feishu_outbox SET status = ?
+            WHERE status = ? AND next_attempt_at <= datetime('now')
+        ''', (STATUS_PENDING, STATUS_SENDING))
+        return conn.execute('''
+            UPDATE feishu_outbox SET status = ?, next_attempt_at = datetime('now', ?)
+            WHERE id IN (
+                SELECT id FROM feishu_outbox
+                WHERE status = ? AND next_attempt_at <= datetime('now')
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            )
+            RETURNING id, event_type, document_no, idempotency_key, payload, attempts
+        ''', (STATUS_SENDING, f'+{LEASE_SECONDS} seconds', STATUS_PENDING, batch_size)).fetchall()
+
+
+def _apply_results(conn, events, results, error=None):
+    """回写推送结果，返回 {'synced', 'retried', 'failed'}"""
+    synced, retried, failed = [], [], []
+    for event in events:
+        result = results.get(event['idempotency_key']) if results else None
+        status = result.get('status') if result else None
+        attempts = event['attempts'] + 1
+        if status in ('accepted', 'duplicate'):
+            synced.append((attempts, result.get('approval_no'), result.get('approval_status'), event['id']))
+        elif status == 'rejected':
+            failed.append((attempts, result.get('error') or '审批系统拒绝', event['id']))
+        else:
+            message = error or '审批系统未返回该事件的结果'
+            if attempts >= FEISHU_SYNC_MAX_ATTEMPTS:
+                failed.append((attempts, message, event['id']))
+            else:
+                retried.append((attempts, message, f'+{_backoff_seconds(attempts)} seconds', event['id']))
+
+    with conn:
+        conn.executemany('''
+            UPDATE feishu_outbox
+            SET status = ?, attempts = ?, external_id = ?, approval_status = ?, last_error = NULL,
+                synced_at = datetime('now')
+            WHERE id = ?
+        ''', [(STATUS_SYNCED, *row) for row in synced])
+        conn.executemany('''
+            UPDATE feishu_outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+        ''', [(STATUS_PENDING, *row) for row in retried])
+        conn.executemany('UPDATE feishu_outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?',
+                         [(STATUS_FAILED, *row) for row in failed])
+
+    event_types = {event['id']: event['event_type'] for event in events}
+    for result, rows in (('synced', synced), ('retried', retried), ('failed', failed)):
+        for row in rows:
+            registry.inc(SYNC_EVENTS, (event_types[row[-1]], result))
+    return {'synced': len(synced), 'retried': len(retried), 'failed': len(failed)}
+
+
+def dispatch_batch(conn, client, batch_size=FEISHU_SYNC_BATCH_SIZE):
+    """
+    推送一批到期事件；调用外部接口时不持有数据库事务
+
+    Returns:
+        dict: {'claimed', 'synced', 'retried', 'failed'}
+    """
+    rows = _claim(conn, batch_size)
+    if not rows:
+        return {'claimed': 0, 'synced': 0, 'retried': 0, 'failed': 0}
+
+    events = [{'idempotency_key': row['idempotency_key'], 'event_type': row['event_type'],
+               'document_no': row['document_no'], 'payload': json.loads(row['payload'])} for row in rows]
+    started = time.perf_counter()
+    try:
+        results, error = client.send_batch(events), None
+    except ApprovalClientError as e:
+        results, error = None, str(e)
+    except Exception as e:
+        logger.exception('推送审批事件时出现未预期的错误')
+        results, error = None, f'推送失败: {str(e)}'
+    registry.observe(SYNC_BATCH_SECONDS, ('error' if error else 'ok',), time.perf_counter() - started)
+    registry.observe(SYNC_BATCH_SIZE, (), len(rows))
+    if error:
+        logger.warning(f'推送 {len(rows)} 个审批事件失败，稍后重试: {error}')
+    return {'claimed': len(rows), **_apply_results(conn, rows, results, error)}
+
+
+def drain_outbox(conn, client, batch_size=FEISHU_SYNC_BATCH_SIZE, progress_callback=None):
+    """连续推送直到没有到期事件（失败事件已按退避推迟，不会重复推送）"""
+    totals = {'claimed': 0, 'synced': 0, 'retried': 0, 'failed': 0}
+    while True:
+        result = dispatch_batch(conn, client, batch_size)
+        if not result['claimed']:
+            return totals
+        for key, value in result.items():
+            totals[key] += value
+        if progress_callback:
+            progress_callback(totals)
+
+
+def purge_synced(conn, retention_days=FEISHU_OUTBOX_RETENTION_DAYS):
+    """删除超过保留天数的已同步事件，返回删除条数"""
+    with conn:
+        return conn.execute('''
+            DELETE FROM feishu_outbox WHERE status = ? AND synced_at < datetime('now', ?)
+        ''', (STATUS_SYNCED, f'-{retention_days} days')).rowcount
+
+
+def sync_job(context):
+    """后台任务：推送全部到期事件"""
+    client = get_approval_client()
+    if client is None:
+        raise ValueError('未配置审批系统地址（FEISHU_APPROVAL_URL）')
+    return drain_outbox(context.conn, client, progress_callback=lambda totals: context.update_progress(
+        totals['claimed'], message=f"已推送 {totals['synced']} 条，待重试 {totals['retried']} 条"))
+
+
+class OutboxDispatcher:
+    """后台推送线程：有到期事件时连续推送，没有时按轮询间隔等待"""
+
+    def __init__(self, db_path, client, batch_size=FEISHU_SYNC_BATCH_SIZE, poll_interval=FEISHU_SYNC_POLL_INTERVAL):
+        self.db_path = db_path
+        self.client = client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='feishu-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """提前唤醒（写入事件的事务提交后调用）"""
+        self._wake.set()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        try:
+            while not self._stopped.is_set():
+                try:
+                    result = dispatch_batch(conn, self.client, self.batch_size)
+                    self._purge(conn)
+                except sqlite3.Error as e:
+                    logger.warning(f'飞书审批同步出错，稍后重试: {str(e)}')
+                    result = None
+                if not result or result['claimed'] < self.batch_size:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        finally:
+            conn.close()
+
+    def _purge(self, conn):
+        """清理过期的已同步事件，每小时最多执行一次"""
+        now = time.monotonic()
+        if now - self._last_purge >= 3600:
+            self._last_purge = now
+            purge_synced(conn)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher(db_path, client=None):
+    """启动进程内的后台推送线程（多进程部署时每个进程一个，认领事件互不重复），已启动时直接返回"""
+    global _dispatcher
+    if _dispatcher is not None:
+        return _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            client = client or get_approval_client()
+            if client is None:
+                return None
+            _dispatcher = OutboxDispatcher(db_path, client)
+            _dispatcher.start()
+            logger.info('飞书审批同步线程已启动')
+        return _dispatcher
+
+
+def wake_dispatcher():
+    """唤醒后台推送线程，未启动时忽略"""
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def get_outbox_stats(conn):
+    """发件箱统计：各状态事件数、最早待同步事件时间、近1小时/24小时推送量"""
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM feishu_outbox GROUP BY status').fetchall())
+    row = conn.execute('''
+        SELECT (SELECT MIN(created_at) FROM feishu_outbox WHERE status IN (?, ?)),
+               (SELECT COUNT(*) FROM feishu_outbox WHERE status = ? AND synced_at >= datetime('now', '-1 hour')),
+               (SELECT COUNT(*) FROM feishu_outbox WHERE status = ? AND synced_at >= datetime('now', '-1 day'))
+    ''', (STATUS_PENDING, STATUS_SENDING, STATUS_SYNCED, STATUS_SYNCED)).fetchone()
+    return {
+        'counts': {status: counts.get(status, 0) for status in OUTBOX_STATUSES},
+        'oldest_pending_at': row[0],
+        'synced_last_hour': row[1],
+        'synced_last_day': row[2],
+        'client_configured': bool(FEISHU_APPROVAL_URL),
+        'dispatcher_running': _dispatcher is not None
+    }
+
+
+def list_documents(conn, page=1, per_page=20):
+    """
+    按单据汇总同步状态：有失败事件为同步失败，有未推送事件为待同步，否则为已同步；
+    审批单号和审批结果取最近一次推送成功的事件
+
+    Returns:
+        tuple: (单据列表, 总数)
+    """
+    total = conn.execute('SELECT COUNT(DISTINCT document_no) FROM feishu_outbox').fetchone()[0]
+    rows = conn.execute('''
+        WITH documents AS (
+            SELECT document_no, event_type, COUNT(*) AS events,
+                   SUM(status = ?) AS failed, SUM(status IN (?, ?)) AS pending,
+                   MAX(CASE WHEN status = ? THEN id END) AS last_synced_id, MAX(id) AS last_id
+            FROM feishu_outbox
+            GROUP BY document_no
+            ORDER BY last_id DESC
+            LIMIT ? OFFSET ?
+        )
+        SELECT d.document_no, d.event_type, d.events, d.failed, d.pending,
+               s.external_id, s.approval_status, s.synced_at, e.last_error
+        FROM documents d
+        LEFT JOIN feishu_outbox s ON s.id = d.last_synced_id
+        LEFT JOIN feishu_outbox e ON e.id = d.last_id
+        ORDER BY d.last_id DESC
+    ''', (STATUS_FAILED, STATUS_PENDING, STATUS_SENDING, STATUS_SYNCED, per_page, (page - 1) * per_page)).fetchall()
+
+    documents = []
+    for row in rows:
+        document = dict(row)
+        document['event_name'] = EVENT_TYPES.get(row['event_type'], row['event_type'])
+        document['sync_status'] = ('同步失败' if row['failed'] else STATUS_PENDING if row['pending']
+                                   else STATUS_SYNCED)
+        documents.append(document)
+    return documents, total
+
+
+def list_events(conn, document_no=None, status=None, page=1, per_page=20):
+    """查询发件箱事件，返回 (事件列表, 总数)"""
+    conditions, params = [], []
+    if document_no:
+        conditions.append('document_no = ?')
+        params.append(document_no)
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    total = conn.execute(f'SELECT COUNT(*) FROM feishu_outbox {where}', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT id, event_type, document_no, idempotency_key, payload, status, attempts, next_attempt_at,
+               external_id, approval_status, last_error, created_at, synced_at
+        FROM feishu_outbox {where}
+        ORDER BY id DESC
+        LIMIT ? OFFSET ?
+    ''', params + [per_page, (page - 1) * per_page]).fetchall()
+    return [{**dict(row), 'payload': json.loads(row['payload'])} for row in rows], total
+
+
+def retry_document(conn, document_no):
+    """把单据下同步失败的事件重新置为待同步，返回重置条数"""
+    with conn:
+        count = conn.execute('''
+            UPDATE feishu_outbox
+            SET status = ?, attempts = 0, last_error = NULL, next_attempt_at = datetime('now')
+            WHERE document_no = ? AND status = ?
+        ''', (STATUS_PENDING, document_no, STATUS_FAILED)).rowcount
+    if count:
+        wake_dispatcher()
+    return count
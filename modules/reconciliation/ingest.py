@@ -0,0 +1,356 @@
+"""
+对账数据接入 - 流式读取承运商提交的月度对账单（CSV/Excel）
+按映射方案对应字段，规范化车牌与单号后分批写入暂存表，内存占用只与批次大小有关
+"""
+
+import json
+import os
+import re
+import unicodedata
+from datetime import date, datetime, timedelta
+
+from import_service import chunked, open_table_reader
+from .exception_rules import mark_batch_tasks
+
+# 每个事务写入的行数
+INGEST_BATCH_SIZE = 5000
+
+# 结果中保留的错误明细条数，其余只计数
+MAX_ERROR_SAMPLES = 100
+
+# 标准字段 -> 默认表头（未指定映射方案时按默认表头对应）
+STATEMENT_FIELDS = {
+    'statement_date': '日期',
+    'dispatch_number': '派车单号',
+    'manifest_number': '路单流水号',
+    'license_plate': '车牌号',
+    'route_name': '邮路名称',
+    'volume': '容积',
+    'weight': '重量',
+    'amount': '金额'
+}
+
+# 至少映射其中一个字段才能与派车记录匹配
+IDENTIFIER_FIELDS = ('dispatch_number', 'manifest_number', 'license_plate')
+
+NUMERIC_FIELDS = ('volume', 'weight', 'amount')
+
+DATA_SOURCES = ('supplier', 'reimbursement')
+
+BATCH_IMPORTING = '导入中'
+BATCH_DONE = '已完成'
+BATCH_FAILED = '失败'
+
+# 暂存表字段顺序（与 STAGING_INSERT_SQL 一致）
+STAGING_FIELDS = ['statement_date', 'dispatch_number', 'manifest_number', 'license_plate',
+                  'route_name', 'volume', 'weight', 'amount']
+
+STAGING_INSERT_SQL = f'''
+    INSERT INTO statement_staging (batch_id, row_number, carrier_company, {', '.join(STAGING_FIELDS)}, error)
+    VALUES (?, ?, ?, {', '.join('?' * len(STAGING_FIELDS))}, ?)
+'''
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S',
+                '%Y-%m-%d %H:%M', '%Y年%m月%d日')
+
+# Excel 日期序列号的起点
+EXCEL_EPOCH = date(1899, 12, 30)
+
+_PLATE_NOISE = re.compile(r'[\s·•\-.．_]')
+_NUMBER_NOISE = re.compile(r'[\s,，元¥￥]')
+_WHITESPACE = re.compile(r'\s')
+
+PROFILE_COLUMNS = ['id', 'name', 'carrier_company', 'field_mapping', 'date_format', 'created_at', 'updated_at']
+
+
+def normalize_plate(value):
+    """车牌规范化：全角转半角、去除空白和分隔符、字母大写，如 '京a·1234５' -> '京A12345'"""
+    if not value:
+        return None
+    plate = _PLATE_NOISE.sub('', unicodedata.normalize('NFKC', str(value))).upper()
+    return plate or None
+
+
+def normalize_document_number(value):
+    """派车单号/路单号规范化：全角转半角、去除空白和Excel文本前缀、字母大写"""
+    if not value:
+        return None
+    number = str(value)
+    # 常见的纯字母数字单号无需全角转换
+    if number.isascii() and number.isalnum():
+        return number.upper()
+    number = _WHITESPACE.sub('', unicodedata.normalize('NFKC', number)).lstrip("'").upper()
+    return number or None
+
+
+def parse_statement_date(value, date_format=None):
+    """解析日期，支持常见格式、映射方案指定的格式以及Excel日期序列号，返回 YYYY-MM-DD"""
+    if not value:
+        return None
+    text = unicodedata.normalize('NFKC', str(value)).strip()
+    if text.isdigit() and len(text) <= 5:
+        return (EXCEL_EPOCH + timedelta(days=int(text))).isoformat()
+    for fmt in ((date_format,) if date_format else ()) + DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f'日期格式无法识别: {text}')
+
+
+def parse_number(value):
+    """解析数值，忽略千分位、空白和货币符号"""
+    if value in (None, ''):
+        return None
+    text = _NUMBER_NOISE.sub('', unicodedata.normalize('NFKC', str(value)))
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f'不是有效数字: {value}')
+
+
+def resolve_mapping(headers, field_mapping=None):
+    """
+    根据映射方案确定各标准字段所在列
+
+    Args:
+        headers (list): 文件表头
+        field_mapping (dict): 标准字段 -> 表头，未指定时使用默认表头
+
+    Returns:
+        dict: 标准字段 -> 列下标
+
+    Raises:
+        ValueError: 映射的表头在文件中不存在，或缺少日期、识别字段
+    """
+    field_mapping = field_mapping or STATEMENT_FIELDS
+    header_index = {header: i for i, header in enumerate(headers) if header}
+    columns = {}
+    missing = []
+    for field, header in field_mapping.items():
+        if not header:
+            continue
+        if header in header_index:
+            columns[field] = header_index[header]
+        elif field_mapping is not STATEMENT_FIELDS:
+            missing.append(header)
+    if missing:
+        raise ValueError(f'文件中缺少映射的列: {", ".join(missing)}')
+    if 'statement_date' not in columns:
+        raise ValueError(f"缺少日期列（{field_mapping.get('statement_date') or STATEMENT_FIELDS['statement_date']}）")
+    if not any(field in columns for field in IDENTIFIER_FIELDS):
+        raise ValueError('至少需要派车单号、路单流水号、车牌号中的一列')
+    return columns
+
+
+def _normalize_row(values, columns, date_format=None):
+    """规范化一行数据，返回 (字段值元组, 错误信息)"""
+    def cell(field):
+        index = columns.get(field)
+        return values[index] if index is not None and index < len(values) else None
+
+    record = {
+        'dispatch_number': normalize_document_number(cell('dispatch_number')),
+        'manifest_number': normalize_document_number(cell('manifest_number')),
+        'license_plate': normalize_plate(cell('license_plate')),
+        'route_name': cell('route_name')
+    }
+    errors = []
+    record['statement_date'] = None
+    if not cell('statement_date'):
+        errors.append('日期为空')
+    else:
+        try:
+            record['statement_date'] = parse_statement_date(cell('statement_date'), date_format)
+        except ValueError as e:
+            errors.append(str(e))
+    for field in NUMERIC_FIELDS:
+        try:
+            record[field] = parse_number(cell(field))
+        except ValueError as e:
+            record[field] = None
+            errors.append(f'{STATEMENT_FIELDS[field]}{e}')
+
+    if not any(record[field] for field in IDENTIFIER_FIELDS):
+        errors.append('派车单号、路单流水号、车牌号均为空')
+    return tuple(record[field] for field in STAGING_FIELDS), '；'.join(errors) or None
+
+
+def list_profiles(conn, carrier=None):
+    """查询映射方案"""
+    sql = f"SELECT {', '.join(PROFILE_COLUMNS)} FROM statement_mapping_profiles"
+    params = []
+    if carrier:
+        sql += ' WHERE carrier_company = ? OR carrier_company IS NULL'
+        params.append(carrier)
+    profiles = [dict(zip(PROFILE_COLUMNS, row)) for row in conn.execute(sql + ' ORDER BY name', params)]
+    for profile in profiles:
+        profile['field_mapping'] = json.loads(profile['field_mapping'])
+    return profiles
+
+
+def get_profile(conn, profile_id):
+    """按ID获取映射方案，不存在时返回None"""
+    row = conn.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM statement_mapping_profiles WHERE id = ?",
+                       (profile_id,)).fetchone()
+    if not row:
+        return None
+    profile = dict(zip(PROFILE_COLUMNS, row))
+    profile['field_mapping'] = json.loads(profile['field_mapping'])
+    return profile
+
+
+def save_profile(conn, data, created_by=None):
+    """
+    新增或更新映射方案（按名称覆盖）
+
+    Returns:
+        int: 方案ID
+
+    Raises:
+        ValueError: 数据无效
+    """
+    name = (data.get('name') or '').strip()
+    if not name:
+        raise ValueError('缺少必填字段: name')
+    mapping = data.get('field_mapping')
+    if not isinstance(mapping, dict) or not mapping:
+        raise ValueError('field_mapping 必须是标准字段到表头的对应关系')
+    unknown = [field for field in mapping if field not in STATEMENT_FIELDS]
+    if unknown:
+        raise ValueError(f'未知字段: {", ".join(unknown)}')
+    mapping = {field: str(header).strip() for field, header in mapping.items() if header and str(header).strip()}
+    if 'statement_date' not in mapping:
+        raise ValueError('必须映射日期字段 statement_date')
+    if not any(field in mapping for field in IDENTIFIER_FIELDS):
+        raise ValueError('至少映射派车单号、路单流水号、车牌号中的一个字段')
+
+    with conn:
+        row = conn.execute('''
+            INSERT INTO statement_mapping_profiles (name, carrier_company, field_mapping, date_format, created_by)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                carrier_company = excluded.carrier_company,
+                field_mapping = excluded.field_mapping,
+                date_format = excluded.date_format,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING id
+        ''', (name, (data.get('carrier_company') or '').strip() or None,
+              json.dumps(mapping, ensure_ascii=False), data.get('date_format') or None, created_by)).fetchone()
+    return row[0]
+
+
+def delete_profile(conn, profile_id):
+    """删除映射方案，返回是否存在"""
+    with conn:
+        cursor = conn.execute('DELETE FROM statement_mapping_profiles WHERE id = ?', (profile_id,))
+    return cursor.rowcount > 0
+
+
+def ingest_statement(conn, file, filename, carrier_company, profile=None, data_source='supplier',
+                     created_by=None, progress_callback=None):
+    """
+    流式导入对账单到暂存表
+
+    Args:
+        conn: 数据库连接
+        file: 二进制文件对象
+        filename (str): 文件名，用于判断格式
+        carrier_company (str): 承运公司
+        profile (dict, optional): 映射方案，未指定时按默认表头对应
+        data_source (str): supplier 或 reimbursement
+        progress_callback (callable, optional): 每批写入后回调，参数为已处理行数
+
+    Returns:
+        dict: 批次ID、总行数、成功/失败行数和部分错误明细
+    """
+    if data_source not in DATA_SOURCES:
+        raise ValueError(f'数据来源必须是以下之一: {", ".join(DATA_SOURCES)}')
+
+    headers, rows = open_table_reader(file, filename)
+    columns = resolve_mapping(headers, profile['field_mapping'] if profile else None)
+    date_format = profile.get('date_format') if profile else None
+
+    with conn:
+        batch_id = conn.execute('''
+            INSERT INTO statement_batches (carrier_company, data_source, filename, profile_id, status, created_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING id
+        ''', (carrier_company, data_source, os.path.basename(filename),
+              profile['id'] if profile else None, BATCH_IMPORTING, created_by)).fetchone()[0]
+
+    result = {'batch_id': batch_id, 'total': 0, 'success': 0, 'fail': 0, 'errors': []}
+    status = BATCH_FAILED
+    try:
+        for batch in chunked(rows, INGEST_BATCH_SIZE):
+            records = []
+            for row_number, values in batch:
+                record, error = _normalize_row(values, columns, date_format)
+                records.append((batch_id, row_number, carrier_company, *record, error))
+                if error:
+                    result['fail'] += 1
+                    if len(result['errors']) < MAX_ERROR_SAMPLES:
+                        result['errors'].append(f'第{row_number}行: {error}')
+            # 出错的行也写入暂存表（带错误信息），便于核对；匹配时忽略
+            with conn:
+                conn.executemany(STAGING_INSERT_SQL, records)
+            result['total'] += len(records)
+            if progress_callback:
+                progress_callback(result['total'])
+        result['success'] = result['total'] - result['fail']
+        status = BATCH_DONE
+    finally:
+        with conn:
+            conn.execute('''
+                UPDATE statement_batches
+                SET status = ?, total_rows = ?, error_rows = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, result['total'], result['fail'], batch_id))
+    return result
+
+
+def ingest_job(context, upload_path, filename, carrier_company, profile_id=None, data_source='supplier',
+               created_by=None):
+    """后台任务：从暂存文件导入对账单，完成后删除暂存文件"""
+    try:
+        profile = get_profile(context.conn, profile_id) if profile_id else None
+        if profile_id and not profile:
+            raise ValueError('映射方案不存在')
+        with open(upload_path, 'rb') as file:
+            result = ingest_statement(
+                context.conn, file, filename, carrier_company, profile, data_source, created_by,
+                progress_callback=lambda done: context.update_progress(done, message=f'已导入{done}行')
+            )
+        context.update_progress(result['total'], result['total'], message=f"已导入{result['total']}行", force=True)
+        return result
+    finally:
+        os.remove(upload_path)
+
+
+BATCH_COLUMNS = ['id', 'carrier_company', 'data_source', 'filename', 'profile_id', 'status',
+                 'total_rows', 'error_rows', 'created_by', 'created_at', 'finished_at']
+
+
+def list_batches(conn, carrier=None, limit=50):
+    """最近的导入批次"""
+    sql = f"SELECT {', '.join(BATCH_COLUMNS)} FROM statement_batches"
+    params = []
+    if carrier:
+        sql += ' WHERE carrier_company = ?'
+        params.append(carrier)
+    sql += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    return [dict(zip(BATCH_COLUMNS, row)) for row in conn.execute(sql, params)]
+
+
+def delete_batch(conn, batch_id):
+    """删除导入批次及其暂存数据和匹配结果（重新导入前使用），返回是否存在"""
+    with conn:
+        mark_batch_tasks(conn, batch_id)
+        conn.execute('DELETE FROM statement_match_results WHERE batch_id = ?', (batch_id,))
+        conn.execute('DELETE FROM statement_match_runs WHERE batch_id = ?', (batch_id,))
+        conn.execute('DELETE FROM statement_staging WHERE batch_id = ?', (batch_id,))
+        cursor = conn.execute('DELETE FROM statement_batches WHERE id = ?', (batch_id,))
+    return cursor.rowcount > 0
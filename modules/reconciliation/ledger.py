@@ -0,0 +1,238 @@
+"""
+结算台账 - 任务结束时按运价入账，并增量维护按承运商、月份汇总的结算数据
+台账只追加不修改：任务更正或运价调整后重新入账时，先写入冲销记录再写入新的入账记录
+"""
+
+from datetime import date, datetime
+
+from constants import DispatchStatus
+from task_archive import TASK_SOURCES, open_archive, union_sources
+from .feishu_sync import enqueue_ledger_events, wake_dispatcher
+
+ENTRY_POST = '入账'
+ENTRY_REVERSE = '冲销'
+
+# 结算期取用车日期所在月份
+PERIOD_SQL = "substr(t.required_date, 1, 7)"
+
+# 任务的结算重量与计费容积
+PRICING_SOURCE_SQL = '''
+        SELECT task_id, required_date, carrier_company, transport_type, requirement_type, weight,
+               COALESCE((SELECT SUM(v.actual_volume) FROM {vehicles} v WHERE v.task_id = m.task_id), volume) AS billed_volume
+        FROM {tasks} m
+        WHERE status = ? AND {scope}
+'''
+
+# 任务 t 匹配运价 tr（重量段不重叠，每个任务最多匹配一条运价）及按运价计算的金额，成本分析同样使用
+TARIFF_JOIN_SQL = '''
+    LEFT JOIN carrier_tariffs tr
+        ON tr.carrier_company = t.carrier_company
+       AND tr.transport_type = t.transport_type
+       AND tr.requirement_type = t.requirement_type
+       AND t.weight >= tr.weight_min
+       AND (tr.weight_max IS NULL OR t.weight < tr.weight_max)
+'''
+TARIFF_AMOUNT_SQL = 'CASE WHEN tr.id IS NULL THEN 0 ELSE ROUND(tr.base_price + tr.volume_price * t.billed_volume, 2) END'
+
+# 按当前运价计算任务的结算金额
+CURRENT_PRICING_SQL = f'''
+    INSERT INTO temp.ledger_current
+    SELECT t.task_id, {PERIOD_SQL}, t.carrier_company, tr.id, t.weight, t.billed_volume, {TARIFF_AMOUNT_SQL}
+    FROM ({{source}}) t
+    {TARIFF_JOIN_SQL}
+'''
+
+# 当前有效的入账记录（入账次数多于冲销次数的分组）
+ACTIVE_POSTINGS_SQL = f'''
+    INSERT INTO temp.ledger_active
+    SELECT task_id, period, carrier_company, tariff_id,
+           SUM(weight), SUM(billed_volume), ROUND(SUM(amount), 2)
+    FROM settlement_ledger
+    WHERE {{scope}}
+    GROUP BY task_id, period, carrier_company, tariff_id
+    HAVING SUM(CASE entry_type WHEN '{ENTRY_POST}' THEN 1 ELSE -1 END) > 0
+'''
+
+# 两条记录结算结果相同
+SAME_POSTING = '''
+    c.task_id = a.task_id AND c.period = a.period AND c.carrier_company = a.carrier_company
+    AND c.tariff_id IS a.tariff_id AND c.amount = a.amount
+    AND ROUND(c.weight, 3) = ROUND(a.weight, 3) AND ROUND(c.billed_volume, 3) = ROUND(a.billed_volume, 3)
+'''
+
+LEDGER_COLUMNS = ['id', 'task_id', 'period', 'carrier_company', 'tariff_id', 'weight',
+                  'billed_volume', 'amount', 'entry_type', 'operator', 'note', 'created_at']
+
+SUMMARY_COLUMNS = ['period', 'carrier_company', 'task_count', 'unpriced_count',
+                   'total_weight', 'billed_volume', 'amount', 'updated_at']
+
+
+def current_period():
+    """当前结算期 YYYY-MM"""
+    return date.today().strftime('%Y-%m')
+
+
+def parse_period(value):
+    """校验结算期 YYYY-MM，返回规范化后的字符串"""
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    except (TypeError, ValueError):
+        raise ValueError('结算月份格式错误，应为YYYY-MM')
+
+
+def _next_period_start(period):
+    year, month = map(int, period.split('-'))
+    return f'{year + month // 12:04d}-{month % 12 + 1:02d}-01'
+
+
+def _prepare_temp_tables(conn):
+    for name in ('ledger_current', 'ledger_active'):
+        conn.execute(f'''
+            CREATE TEMP TABLE IF NOT EXISTS {name} (
+                task_id TEXT, period TEXT, carrier_company TEXT, tariff_id INTEGER,
+                weight REAL, billed_volume REAL, amount REAL
+            )
+        ''')
+        # 两表按任务编号互相核对，整月核对时有数万行
+        conn.execute(f'CREATE INDEX IF NOT EXISTS temp.idx_{name}_task ON {name}(task_id)')
+        conn.execute(f'DELETE FROM temp.{name}')
+
+
+def _sync(conn, task_scope, task_params, ledger_scope, ledger_params, operator=None, note=None,
+          include_archive=False):
+    """
+    对比当前结算结果与有效入账记录：结果变化或任务不再结算的写入冲销，新结果写入入账，
+    并把本次新增台账记录的增量累加到汇总表、写入飞书审批同步发件箱。不提交事务，由调用方提交
+
+    Args:
+        include_archive (bool): 同时核对已归档的任务（需已调用 open_archive）
+
+    Returns:
+        dict: {'posted': 入账条数, 'reversed': 冲销条数}
+    """
+    _prepare_temp_tables(conn)
+    pricing_params = [DispatchStatus.TASK_COMPLETED.value, *task_params]
+    if include_archive:
+        source = union_sources(PRICING_SOURCE_SQL, scope=task_scope)
+        pricing_params *= len(TASK_SOURCES)
+    else:
+        source = PRICING_SOURCE_SQL.format(tasks='manual_dispatch_tasks', vehicles='vehicles', scope=task_scope)
+    conn.execute(CURRENT_PRICING_SQL.format(source=source), pricing_params)
+    conn.execute(ACTIVE_POSTINGS_SQL.format(scope=ledger_scope), ledger_params)
+
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM settlement_ledger').fetchone()[0]
+    reversed_count = conn.execute(f'''
+        INSERT INTO settlement_ledger (task_id, period, carrier_company, tariff_id, weight,
+                                       billed_volume, amount, entry_type, operator, note)
+        SELECT a.task_id, a.period, a.carrier_company, a.tariff_id, -a.weight, -a.billed_volume, -a.amount,
+               '{ENTRY_REVERSE}', ?, ?
+        FROM temp.ledger_active a
+        WHERE NOT EXISTS (SELECT 1 FROM temp.ledger_current c WHERE {SAME_POSTING})
+    ''', (operator, note)).rowcount
+    posted_count = conn.execute(f'''
+        INSERT INTO settlement_ledger (task_id, period, carrier_company, tariff_id, weight,
+                                       billed_volume, amount, entry_type, operator, note)
+        SELECT c.task_id, c.period, c.carrier_company, c.tariff_id, c.weight, c.billed_volume, c.amount,
+               '{ENTRY_POST}', ?, ?
+        FROM temp.ledger_current c
+        WHERE NOT EXISTS (SELECT 1 FROM temp.ledger_active a WHERE {SAME_POSTING})
+    ''', (operator, note)).rowcount
+
+    if reversed_count or posted_count:
+        _apply_summary_delta(conn, last_id)
+        enqueue_ledger_events(conn, last_id)
+    return {'posted': posted_count, 'reversed': reversed_count}
+
+
+def _apply_summary_delta(conn, after_id):
+    """把 id 大于 after_id 的台账记录累加到汇总表"""
+    conn.execute(f'''
+        INSERT INTO settlement_summary (period, carrier_company, task_count, unpriced_count,
+                                        total_weight, billed_volume, amount, updated_at)
+        SELECT period, carrier_company,
+               SUM(CASE entry_type WHEN '{ENTRY_POST}' THEN 1 ELSE -1 END),
+               SUM(CASE WHEN tariff_id IS NOT NULL THEN 0 WHEN entry_type = '{ENTRY_POST}' THEN 1 ELSE -1 END),
+               SUM(weight), SUM(billed_volume), SUM(amount), CURRENT_TIMESTAMP
+        FROM settlement_ledger
+        WHERE id > ?
+        GROUP BY period, carrier_company
+        ON CONFLICT (period, carrier_company) DO UPDATE SET
+            task_count = task_count + excluded.task_count,
+            unpriced_count = unpriced_count + excluded.unpriced_count,
+            total_weight = ROUND(total_weight + excluded.total_weight, 3),
+            billed_volume = ROUND(billed_volume + excluded.billed_volume, 3),
+            amount = ROUND(amount + excluded.amount, 2),
+            updated_at = excluded.updated_at
+    ''', (after_id,))
+
+
+def post_task_settlement(conn, task_id, operator=None, note=None):
+    """
+    任务结束或更正后重新入账（在调用方的事务中执行，调用方提交后调用 wake_dispatcher 推送台账变动）
+
+    Returns:
+        dict: {'posted': 入账条数, 'reversed': 冲销条数}，结果未变化时均为0
+    """
+    return _sync(conn, 'task_id = ?', [task_id], 'task_id = ?', [task_id], operator, note)
+
+
+def sync_period(conn, period, operator=None, note=None):
+    """
+    按当前运价重新核对整个结算期的台账（补录历史任务、运价调整后使用），提交事务后唤醒飞书审批推送
+
+    Args:
+        period (str): YYYY-MM
+    """
+    task_scope = 'required_date >= ? AND required_date < ?'
+    task_params = [f'{period}-01', _next_period_start(period)]
+    # 台账中属于本期或当前属于本期的任务都要核对；已归档的任务仍按归档数据核对，不会被冲销
+    ledger_scope = ('(period = ? OR task_id IN (SELECT task_id FROM all_tasks '
+                    'WHERE required_date >= ? AND required_date < ?))')
+    open_archive(conn)
+    with conn:
+        result = _sync(conn, task_scope, task_params, ledger_scope, [period, *task_params], operator, note,
+                       include_archive=True)
+    if result['posted'] or result['reversed']:
+        wake_dispatcher()
+    return result
+
+
+def rebuild_summary(conn, period=None):
+    """从台账重新汇总（用于修复汇总表），并提交事务"""
+    scope, params = ('WHERE period = ?', [period]) if period else ('', [])
+    with conn:
+        conn.execute(f'DELETE FROM settlement_summary {scope}', params)
+        conn.execute(f'''
+            INSERT INTO settlement_summary (period, carrier_company, task_count, unpriced_count,
+                                            total_weight, billed_volume, amount, updated_at)
+            SELECT period, carrier_company,
+                   SUM(CASE entry_type WHEN '{ENTRY_POST}' THEN 1 ELSE -1 END),
+                   SUM(CASE WHEN tariff_id IS NOT NULL THEN 0 WHEN entry_type = '{ENTRY_POST}' THEN 1 ELSE -1 END),
+                   ROUND(SUM(weight), 3), ROUND(SUM(billed_volume), 3), ROUND(SUM(amount), 2), CURRENT_TIMESTAMP
+            FROM settlement_ledger
+            {scope}
+            GROUP BY period, carrier_company
+        ''', params)
+
+
+def get_summary(conn, period, carrier=None):
+    """读取结算期汇总（含合计）"""
+    sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM settlement_summary WHERE period = ? AND task_count != 0"
+    params = [period]
+    if carrier:
+        sql += ' AND carrier_company = ?'
+        params.append(carrier)
+    rows = [dict(zip(SUMMARY_COLUMNS, row)) for row in conn.execute(sql + ' ORDER BY carrier_company', params)]
+    return {
+        'period': period,
+        'carriers': rows,
+        'task_count': sum(row['task_count'] for row in rows),
+        'unpriced_count': sum(row['unpriced_count'] for row in rows),
+        'amount': round(sum(row['amount'] for row in rows), 2)
+    }
+
+
+def get_task_ledger(conn, task_id):
+    """任务的全部台账记录"""
+    sql = f"SELECT {', '.join(LEDGER_COLUMNS)} FROM settlement_ledger WHERE task_id = ? ORDER BY id"
+    return [dict(zip(LEDGER_COLUMNS, row)) for row in conn.execute(sql, (task_id,))]
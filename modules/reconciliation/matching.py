@@ -0,0 +1,435 @@
+"""
+对账匹配 - 将暂存的对账单明细与派车记录（车辆 + 派车任务）逐行匹配
+按派车单号、路单流水号、车牌在内存中建立哈希索引，分批读取对账单先做精确匹配（单号或车牌且日期一致），
+剩余行再做模糊匹配（单号不限日期、车牌按日期容差、忽略省份简称），结果写入 statement_match_results
+"""
+
+import math
+import sys
+import time
+from array import array
+from datetime import date, timedelta
+
+from constants import DispatchStatus
+from task_archive import TASK_SOURCES, open_archive, union_sources
+from .exception_rules import mark_batch_tasks, refresh_exceptions
+from .ingest import normalize_document_number, normalize_plate
+
+# 每次从数据库读取的行数
+MATCH_FETCH_SIZE = 50000
+
+# 车牌+日期模糊匹配允许相差的天数
+DEFAULT_DATE_TOLERANCE = 1
+MAX_DATE_TOLERANCE = 7
+
+# 容积相差超过该值（立方米）记为差异
+VOLUME_TOLERANCE = 0.5
+
+RUN_RUNNING = '匹配中'
+RUN_DONE = '已完成'
+RUN_FAILED = '失败'
+
+RESULT_MATCHED = '已匹配'
+RESULT_DISCREPANCY = '差异'
+RESULT_UNMATCHED = '未匹配'
+RESULT_UNBILLED = '未对账'
+MATCH_RESULTS = (RESULT_MATCHED, RESULT_DISCREPANCY, RESULT_UNMATCHED, RESULT_UNBILLED)
+
+LEVEL_EXACT = '精确'
+LEVEL_FUZZY = '模糊'
+
+KEY_DISPATCH = '派车单号'
+KEY_MANIFEST = '路单流水号'
+KEY_PLATE = '车牌+日期'
+
+# 承运商在日期范围内的全部车辆记录（含已取消任务，用于发现取消后仍计费的情况），在途库与归档库分别展开
+RECORDS_SQL = '''
+    SELECT v.id, v.task_id, v.dispatch_number, v.manifest_number, v.license_plate,
+           t.required_date, t.status, COALESCE(v.actual_volume, t.volume)
+    FROM {tasks} t
+    JOIN {vehicles} v ON v.task_id = t.task_id
+    WHERE t.carrier_company = ? AND t.required_date >= ? AND t.required_date < ?
+'''
+
+STAGING_SQL = '''
+    SELECT id, row_number, statement_date, dispatch_number, manifest_number, license_plate, volume
+    FROM statement_staging
+    WHERE batch_id = ? AND error IS NULL
+    ORDER BY row_number
+'''
+
+RESULT_INSERT_SQL = '''
+    INSERT INTO statement_match_results (run_id, batch_id, staging_id, task_id, vehicle_id, result, match_key,
+                                         match_level, date_diff, statement_volume, our_volume, discrepancy)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+RUN_COLUMNS = ['id', 'batch_id', 'carrier_company', 'date_from', 'date_to', 'date_tolerance', 'status',
+               'matched_count', 'discrepancy_count', 'unmatched_count', 'unbilled_count', 'duration_ms',
+               'created_by', 'created_at', 'finished_at']
+
+RESULT_COLUMNS = ['id', 'staging_id', 'row_number', 'statement_date', 'dispatch_number', 'manifest_number',
+                  'license_plate', 'amount', 'task_id', 'vehicle_id', 'result', 'match_key', 'match_level',
+                  'date_diff', 'statement_volume', 'our_volume', 'discrepancy']
+
+
+def _ordinal(value):
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _add(mapping, key, i):
+    # 绝大多数单号只对应一条记录，单条时直接存记录序号以节省内存
+    existing = mapping.setdefault(key, i)
+    if existing is i:
+        return
+    if isinstance(existing, int):
+        mapping[key] = [existing, i]
+    else:
+        existing.append(i)
+
+
+def _plate_tail(plate):
+    """去掉省份简称的车牌，用于对账单漏写或写错省份时匹配"""
+    return plate[1:] if plate and not plate[0].isascii() else plate
+
+
+class DispatchIndex:
+    """
+    派车车辆记录的哈希索引，记录按加载顺序编号，used_by 记录匹配到的对账单行号（0为未匹配）
+    数值列使用 array 存储，几十万条记录时内存约为列表的三分之一
+    """
+
+    def __init__(self, conn, carrier_company, date_from, date_to):
+        self.vehicle_ids = array('q')
+        self.task_ids = []
+        self.dates = array('l')
+        self.statuses = []
+        self.volumes = array('d')
+        self.by_dispatch = {}
+        self.by_manifest = {}
+        self.by_plate = {}
+        self.by_plate_tail = {}
+
+        # 车牌数量远少于车次，规范化结果按原值缓存
+        plate_keys = {}
+        cursor = conn.execute(union_sources(RECORDS_SQL), (carrier_company, date_from, date_to) * len(TASK_SOURCES))
+        while True:
+            rows = cursor.fetchmany(MATCH_FETCH_SIZE)
+            if not rows:
+                break
+            for vehicle_id, task_id, dispatch_number, manifest_number, plate, required_date, status, volume in rows:
+                ordinal = _ordinal(required_date)
+                if ordinal is None:
+                    continue
+                i = len(self.vehicle_ids)
+                self.vehicle_ids.append(vehicle_id)
+                self.task_ids.append(task_id)
+                self.dates.append(ordinal)
+                self.statuses.append(sys.intern(status))
+                self.volumes.append(math.nan if volume is None else volume)
+
+                key = normalize_document_number(dispatch_number)
+                if key:
+                    _add(self.by_dispatch, key, i)
+                key = normalize_document_number(manifest_number)
+                if key:
+                    _add(self.by_manifest, key, i)
+                if plate not in plate_keys:
+                    plate_keys[plate] = normalize_plate(plate)
+                plate = plate_keys[plate]
+                if plate:
+                    _add(self.by_plate, plate, i)
+                    _add(self.by_plate_tail, _plate_tail(plate), i)
+
+        self.used_by = array('l', bytes(len(self.vehicle_ids) * array('l').itemsize))
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    def volume(self, i):
+        volume = self.volumes[i]
+        return None if math.isnan(volume) else volume
+
+    def pick(self, candidates, ordinal, tolerance):
+        """在候选记录中选择未被匹配且日期最接近的一条；tolerance 为 None 时不限日期"""
+        if isinstance(candidates, int):
+            candidates = (candidates,)
+        best, best_diff = None, None
+        for i in candidates:
+            if self.used_by[i]:
+                continue
+            diff = abs(self.dates[i] - ordinal)
+            if tolerance is not None and diff > tolerance:
+                continue
+            if best is None or diff < best_diff:
+                best, best_diff = i, diff
+                if diff == 0:
+                    break
+        return best
+
+
+def _discrepancies(index, i, date_diff, statement_volume):
+    problems = []
+    if date_diff:
+        problems.append(f'日期相差{date_diff}天')
+    status = index.statuses[i]
+    if status == DispatchStatus.TASK_CANCELLED.value:
+        problems.append('任务已取消')
+    elif status != DispatchStatus.TASK_COMPLETED.value:
+        problems.append(f'任务未结束（{status}）')
+    our_volume = index.volume(i)
+    if statement_volume is not None and our_volume is not None \
+            and abs(statement_volume - our_volume) > VOLUME_TOLERANCE:
+        problems.append(f'容积不符：对账单{statement_volume:g}，派车记录{our_volume:g}')
+    return '；'.join(problems) or None
+
+
+class _Matcher:
+    """一次匹配运行：按轮次匹配对账单行并生成结果行"""
+
+    def __init__(self, index, run_id, batch_id, date_tolerance):
+        self.index = index
+        self.run_id = run_id
+        self.batch_id = batch_id
+        self.exact_stages = [
+            (KEY_DISPATCH, index.by_dispatch, 3, 0),
+            (KEY_MANIFEST, index.by_manifest, 4, 0),
+            (KEY_PLATE, index.by_plate, 5, 0)
+        ]
+        self.fuzzy_stages = [
+            (KEY_DISPATCH, index.by_dispatch, 3, None),
+            (KEY_MANIFEST, index.by_manifest, 4, None),
+            (KEY_PLATE, index.by_plate, 5, date_tolerance),
+            (KEY_PLATE, index.by_plate_tail, 7, date_tolerance)
+        ]
+        self.counts = dict.fromkeys(MATCH_RESULTS, 0)
+
+    def run_pass(self, rows, stages, level):
+        """
+        对一批行逐个匹配阶段执行一轮（每个阶段先处理完整批行，避免车牌匹配抢占其他行的单号匹配）
+
+        Args:
+            rows (list): (id, row_number, 日期序号, 派车单号, 路单号, 车牌, 容积, 去省份车牌)
+        Returns:
+            (list, list): 结果行、未匹配的行
+        """
+        results = []
+        for key_name, lookup, position, tolerance in stages:
+            remaining = []
+            for row in rows:
+                key = row[position]
+                candidates = lookup.get(key) if key else None
+                i = None if candidates is None else self.index.pick(candidates, row[2], tolerance)
+                if i is None:
+                    remaining.append(row)
+                else:
+                    results.append(self._matched(row, i, key_name, level))
+            rows = remaining
+        return results, rows
+
+    def _matched(self, row, i, key_name, level):
+        index = self.index
+        index.used_by[i] = row[1]
+        date_diff = abs(index.dates[i] - row[2])
+        discrepancy = _discrepancies(index, i, date_diff, row[6])
+        result = RESULT_DISCREPANCY if discrepancy else RESULT_MATCHED
+        self.counts[result] += 1
+        return (self.run_id, self.batch_id, row[0], index.task_ids[i], index.vehicle_ids[i], result, key_name,
+                level, date_diff, row[6], index.volume(i), discrepancy)
+
+    def unmatched(self, row):
+        """未匹配的行：单号在派车记录中存在但已被其他行匹配时记为重复对账"""
+        index = self.index
+        for key_name, lookup, position in ((KEY_DISPATCH, index.by_dispatch, 3), (KEY_MANIFEST, index.by_manifest, 4)):
+            candidates = lookup.get(row[position]) if row[position] else None
+            if candidates is not None:
+                i = candidates if isinstance(candidates, int) else candidates[0]
+                self.counts[RESULT_DISCREPANCY] += 1
+                return (self.run_id, self.batch_id, row[0], index.task_ids[i], index.vehicle_ids[i],
+                        RESULT_DISCREPANCY, key_name, None, None, row[6], index.volume(i),
+                        f'重复对账：{key_name}已由第{index.used_by[i]}行匹配')
+        self.counts[RESULT_UNMATCHED] += 1
+        return (self.run_id, self.batch_id, row[0], None, None, RESULT_UNMATCHED, None, None, None,
+                row[6], None, None)
+
+    def unbilled(self, date_from, date_to):
+        """对账单日期范围内已结束但未被任何行匹配的车辆记录"""
+        index = self.index
+        completed = DispatchStatus.TASK_COMPLETED.value
+        for i in range(len(index)):
+            if not index.used_by[i] and index.statuses[i] == completed and date_from <= index.dates[i] <= date_to:
+                self.counts[RESULT_UNBILLED] += 1
+                yield (self.run_id, self.batch_id, None, index.task_ids[i], index.vehicle_ids[i], RESULT_UNBILLED,
+                       None, None, None, None, index.volume(i), '对账单中无此车次')
+
+
+def _write(conn, results):
+    with conn:
+        conn.executemany(RESULT_INSERT_SQL, results)
+
+
+def match_batch(conn, batch_id, date_tolerance=DEFAULT_DATE_TOLERANCE, created_by=None, progress_callback=None):
+    """
+    匹配一个导入批次的对账单，结果替换该批次上一次的匹配结果
+
+    Args:
+        conn: 数据库连接
+        batch_id (int): 对账单导入批次
+        date_tolerance (int): 车牌+日期模糊匹配允许相差的天数
+        progress_callback (callable, optional): 每批匹配后回调，参数为 (已处理行数, 总行数)
+
+    Returns:
+        dict: 运行ID及已匹配、差异、未匹配、未对账条数
+    """
+    if not isinstance(date_tolerance, int) or not 0 <= date_tolerance <= MAX_DATE_TOLERANCE:
+        raise ValueError(f'日期容差应为0到{MAX_DATE_TOLERANCE}天')
+    batch = conn.execute('SELECT carrier_company, status FROM statement_batches WHERE id = ?',
+                         (batch_id,)).fetchone()
+    if not batch:
+        raise ValueError('导入批次不存在')
+    carrier_company, batch_status = batch[0], batch[1]
+    if batch_status != '已完成':
+        raise ValueError('导入批次尚未完成，不能匹配')
+    open_archive(conn)
+
+    started = time.perf_counter()
+    total, first_date, last_date = conn.execute('''
+        SELECT COUNT(*), MIN(statement_date), MAX(statement_date)
+        FROM statement_staging WHERE batch_id = ? AND error IS NULL
+    ''', (batch_id,)).fetchone()
+    with conn:
+        run_id = conn.execute('''
+            INSERT INTO statement_match_runs (batch_id, carrier_company, date_from, date_to, date_tolerance,
+                                              status, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+        ''', (batch_id, carrier_company, first_date, last_date, date_tolerance, RUN_RUNNING,
+              created_by)).fetchone()[0]
+
+    status = RUN_FAILED
+    matcher = None
+    try:
+        if total:
+            # 日期范围两端各放宽容差，使跨月边界的车次也能按车牌匹配
+            load_from = (date.fromisoformat(first_date) - timedelta(days=date_tolerance)).isoformat()
+            load_to = (date.fromisoformat(last_date) + timedelta(days=date_tolerance + 1)).isoformat()
+            index = DispatchIndex(conn, carrier_company, load_from, load_to)
+            matcher = _Matcher(index, run_id, batch_id, date_tolerance)
+
+            # 第一轮：分批精确匹配，剩余行留待模糊匹配
+            leftovers = []
+            done = 0
+            cursor = conn.execute(STAGING_SQL, (batch_id,))
+            while True:
+                chunk = cursor.fetchmany(MATCH_FETCH_SIZE)
+                if not chunk:
+                    break
+                rows = [(row[0], row[1], _ordinal(row[2]), row[3], row[4], row[5], row[6], _plate_tail(row[5]))
+                        for row in chunk]
+                results, remaining = matcher.run_pass(rows, matcher.exact_stages, LEVEL_EXACT)
+                _write(conn, results)
+                leftovers.extend(remaining)
+                done += len(chunk)
+                if progress_callback:
+                    progress_callback(done, total)
+
+            # 第二轮：模糊匹配，仍未匹配的行判断是否重复对账
+            for start in range(0, len(leftovers), MATCH_FETCH_SIZE):
+                rows = leftovers[start:start + MATCH_FETCH_SIZE]
+                results, remaining = matcher.run_pass(rows, matcher.fuzzy_stages, LEVEL_FUZZY)
+                results.extend(matcher.unmatched(row) for row in remaining)
+                _write(conn, results)
+
+            _write(conn, matcher.unbilled(date.fromisoformat(first_date).toordinal(),
+                                          date.fromisoformat(last_date).toordinal()))
+        status = RUN_DONE
+    finally:
+        counts = matcher.counts if matcher else dict.fromkeys(MATCH_RESULTS, 0)
+        with conn:
+            conn.execute('''
+                UPDATE statement_match_runs
+                SET status = ?, matched_count = ?, discrepancy_count = ?, unmatched_count = ?, unbilled_count = ?,
+                    duration_ms = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, counts[RESULT_MATCHED], counts[RESULT_DISCREPANCY], counts[RESULT_UNMATCHED],
+                  counts[RESULT_UNBILLED], round((time.perf_counter() - started) * 1000), run_id))
+            # 成功时替换批次旧结果，失败时清除本次写入的部分结果
+            if status == RUN_DONE:
+                # 新旧结果中已取消的任务都需要复核"取消任务仍计费"规则
+                mark_batch_tasks(conn, batch_id)
+                conn.execute('DELETE FROM statement_match_results WHERE batch_id = ? AND run_id != ?',
+                             (batch_id, run_id))
+            else:
+                conn.execute('DELETE FROM statement_match_results WHERE run_id = ?', (run_id,))
+
+    return {
+        'run_id': run_id,
+        'total': total,
+        'matched': counts[RESULT_MATCHED],
+        'discrepancy': counts[RESULT_DISCREPANCY],
+        'unmatched': counts[RESULT_UNMATCHED],
+        'unbilled': counts[RESULT_UNBILLED]
+    }
+
+
+def match_job(context, batch_id, date_tolerance=DEFAULT_DATE_TOLERANCE, created_by=None):
+    """后台任务：匹配导入批次的对账单，完成后复核异常"""
+    result = match_batch(
+        context.conn, batch_id, date_tolerance, created_by,
+        progress_callback=lambda done, total: context.update_progress(done, total, message=f'已匹配{done}行')
+    )
+    context.update_progress(result['total'], result['total'], message='正在复核异常', force=True)
+    result['exceptions'] = refresh_exceptions(context.conn)
+    context.update_progress(result['total'], result['total'], message=f"已匹配{result['total']}行", force=True)
+    return result
+
+
+def list_match_runs(conn, batch_id=None, limit=20):
+    """最近的匹配运行记录"""
+    sql = f"SELECT {', '.join(RUN_COLUMNS)} FROM statement_match_runs"
+    params = []
+    if batch_id:
+        sql += ' WHERE batch_id = ?'
+        params.append(batch_id)
+    sql += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    return [dict(zip(RUN_COLUMNS, row)) for row in conn.execute(sql, params)]
+
+
+def get_latest_run(conn, batch_id):
+    """批次最近一次完成的匹配，没有时返回None"""
+    row = conn.execute(f'''
+        SELECT {', '.join(RUN_COLUMNS)} FROM statement_match_runs
+        WHERE batch_id = ? AND status = ?
+        ORDER BY id DESC LIMIT 1
+    ''', (batch_id, RUN_DONE)).fetchone()
+    return dict(zip(RUN_COLUMNS, row)) if row else None
+
+
+def list_match_results(conn, run_id, result=None, page=1, per_page=20):
+    """
+    分页查询匹配结果（附对账单原始字段）
+
+    Returns:
+        tuple: (结果列表, 总数)
+    """
+    where = 'WHERE r.run_id = ?'
+    params = [run_id]
+    if result:
+        where += ' AND r.result = ?'
+        params.append(result)
+    total = conn.execute(f'SELECT COUNT(*) FROM statement_match_results r {where}', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT r.id, r.staging_id, s.row_number, s.statement_date, s.dispatch_number, s.manifest_number,
+               s.license_plate, s.amount, r.task_id, r.vehicle_id, r.result, r.match_key, r.match_level,
+               r.date_diff, r.statement_volume, r.our_volume, r.discrepancy
+        FROM statement_match_results r
+        LEFT JOIN statement_staging s ON s.id = r.staging_id
+        {where}
+        ORDER BY r.id
+        LIMIT ? OFFSET ?
+    ''', params + [per_page, (page - 1) * per_page]).fetchall()
+    return [dict(zip(RESULT_COLUMNS, row)) for row in rows], total
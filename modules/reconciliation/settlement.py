@@ -0,0 +1,343 @@
+"""
+结算计算 - 按承运商运价表计算结算期内已结束任务的运费
+任务数据按列分批读入 NumPy 数组，运价匹配与汇总均为向量化计算，不逐行循环
+依赖numpy，路由中按需导入本模块，避免启动时加载
+"""
+
+import calendar
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from constants import DispatchStatus, RequirementType, TransportType
+from task_archive import TASK_SOURCES, open_archive, union_sources
+
+# 每次从游标拉取的任务行数
+FETCH_BATCH_SIZE = 50000
+
+# 计费容积取车辆实际装载容积之和，未录入时取任务需求容积；在途库与归档库分别展开（见 union_sources）
+SETTLEMENT_TASKS_SQL = '''
+    SELECT t.carrier_company,
+           t.transport_type = '往返',
+           t.requirement_type = '加班',
+           t.weight,
+           COALESCE((SELECT SUM(v.actual_volume) FROM {vehicles} v WHERE v.task_id = t.task_id), t.volume)
+    FROM {tasks} t
+    WHERE t.status = ? AND t.required_date >= ? AND t.required_date < ? {carrier}
+'''
+
+TARIFF_COLUMNS = ['id', 'carrier_company', 'transport_type', 'requirement_type',
+                  'weight_min', 'weight_max', 'base_price', 'volume_price', 'updated_at']
+
+
+def period_bounds(month=None, date_from=None, date_to=None):
+    """
+    解析结算期
+
+    Args:
+        month (str): YYYY-MM，优先使用
+        date_from (str): 起始日期 YYYY-MM-DD（含）
+        date_to (str): 截止日期 YYYY-MM-DD（含）
+
+    Returns:
+        tuple: (起始日期, 截止日期)，均为 YYYY-MM-DD
+
+    Raises:
+        ValueError: 参数缺失或格式错误
+    """
+    if month:
+        try:
+            start = datetime.strptime(month, '%Y-%m').date()
+        except ValueError:
+            raise ValueError('结算月份格式错误，应为YYYY-MM')
+        end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+        return start.isoformat(), end.isoformat()
+
+    if not date_from or not date_to:
+        raise ValueError('请指定结算月份或起止日期')
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d').date()
+        end = datetime.strptime(date_to, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('日期格式错误，应为YYYY-MM-DD')
+    if end < start:
+        raise ValueError('截止日期不能早于起始日期')
+    return start.isoformat(), end.isoformat()
+
+
+def weight_class_label(weight_min, weight_max):
+    """重量段显示名称"""
+    if weight_max is None:
+        return f'{weight_min:g}吨以上'
+    return f'{weight_min:g}-{weight_max:g}吨'
+
+
+def list_tariffs(conn, carrier=None):
+    """查询运价表"""
+    sql = f"SELECT {', '.join(TARIFF_COLUMNS)} FROM carrier_tariffs"
+    params = []
+    if carrier:
+        sql += ' WHERE carrier_company = ?'
+        params.append(carrier)
+    sql += ' ORDER BY carrier_company, transport_type, requirement_type, weight_min'
+    return [dict(zip(TARIFF_COLUMNS, row)) for row in conn.execute(sql, params)]
+
+
+def _validate_tariff(data):
+    """校验运价数据，返回规范化后的字段"""
+    carrier = (data.get('carrier_company') or '').strip()
+    if not carrier:
+        raise ValueError('缺少必填字段: carrier_company')
+    if data.get('transport_type') not in TransportType.all_values():
+        raise ValueError('运输类型必须是"单程"或"往返"')
+    if data.get('requirement_type') not in RequirementType.all_values():
+        raise ValueError('需求类型必须是"正班"或"加班"')
+
+    try:
+        weight_min = float(data.get('weight_min') or 0)
+        weight_max = data.get('weight_max')
+        weight_max = float(weight_max) if weight_max not in (None, '') else None
+        base_price = float(data.get('base_price') or 0)
+        volume_price = float(data.get('volume_price') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('重量段和价格必须是有效数字')
+
+    if weight_min < 0 or base_price < 0 or volume_price < 0:
+        raise ValueError('重量和价格不能为负数')
+    if weight_max is not None and weight_max <= weight_min:
+        raise ValueError('重量段上限必须大于下限')
+
+    return {
+        'carrier_company': carrier,
+        'transport_type': data['transport_type'],
+        'requirement_type': data['requirement_type'],
+        'weight_min': weight_min,
+        'weight_max': weight_max,
+        'base_price': base_price,
+        'volume_price': volume_price
+    }
+
+
+def save_tariff(conn, data):
+    """
+    新增或更新运价（承运商、运输类型、需求类型、重量段下限相同时覆盖）
+
+    Returns:
+        int: 运价ID
+
+    Raises:
+        ValueError: 数据无效或与已有重量段重叠
+    """
+    tariff = _validate_tariff(data)
+
+    # 同一承运商、运输类型、需求类型下的重量段不能重叠
+    overlap = conn.execute('''
+        SELECT weight_min, weight_max FROM carrier_tariffs
+        WHERE carrier_company = ? AND transport_type = ? AND requirement_type = ?
+          AND weight_min != ?
+          AND (weight_max IS NULL OR weight_max > ?)
+          AND (? IS NULL OR weight_min < ?)
+    ''', (tariff['carrier_company'], tariff['transport_type'], tariff['requirement_type'],
+          tariff['weight_min'], tariff['weight_min'], tariff['weight_max'], tariff['weight_max'])).fetchone()
+    if overlap:
+        raise ValueError(f'与已有重量段 {weight_class_label(overlap[0], overlap[1])} 重叠')
+
+    with conn:
+        row = conn.execute('''
+            INSERT INTO carrier_tariffs (carrier_company, transport_type, requirement_type,
+                                         weight_min, weight_max, base_price, volume_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (carrier_company, transport_type, requirement_type, weight_min) DO UPDATE SET
+                weight_max = excluded.weight_max,
+                base_price = excluded.base_price,
+                volume_price = excluded.volume_price,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING id
+        ''', (tariff['carrier_company'], tariff['transport_type'], tariff['requirement_type'],
+              tariff['weight_min'], tariff['weight_max'], tariff['base_price'], tariff['volume_price'])).fetchone()
+    return row[0]
+
+
+def delete_tariff(conn, tariff_id):
+    """删除运价，返回是否存在"""
+    with conn:
+        cursor = conn.execute('DELETE FROM carrier_tariffs WHERE id = ?', (tariff_id,))
+    return cursor.rowcount > 0
+
+
+def _group_codes(carrier_codes, round_trip, overtime):
+    """(承运商, 运输类型, 需求类型) 组合编码"""
+    return (carrier_codes.astype(np.int64) * 2 + round_trip) * 2 + overtime
+
+
+def _load_tasks(conn, carrier_index, date_from, date_to, carrier=None):
+    """按列分批读取结算期内已结束的任务"""
+    open_archive(conn)
+    # 截止日期当天的任务也计入（required_date 可能带时间部分）
+    end = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+    params = [DispatchStatus.TASK_COMPLETED.value, date_from, end]
+    if carrier:
+        params.append(carrier)
+    sql = union_sources(SETTLEMENT_TASKS_SQL, carrier='AND t.carrier_company = ?' if carrier else '')
+    params *= len(TASK_SOURCES)
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+
+    chunks = {'carrier': [], 'round_trip': [], 'overtime': [], 'weight': [], 'volume': []}
+    while True:
+        batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            break
+        carriers, round_trip, overtime, weight, volume = zip(*batch)
+        chunks['carrier'].append(np.fromiter(
+            (carrier_index.setdefault(name, len(carrier_index)) for name in carriers),
+            dtype=np.int32, count=len(batch)))
+        chunks['round_trip'].append(np.array(round_trip, dtype=np.int8))
+        chunks['overtime'].append(np.array(overtime, dtype=np.int8))
+        chunks['weight'].append(np.array(weight, dtype=np.float64))
+        chunks['volume'].append(np.array(volume, dtype=np.float64))
+    cursor.close()
+
+    dtypes = {'carrier': np.int32, 'round_trip': np.int8, 'overtime': np.int8,
+              'weight': np.float64, 'volume': np.float64}
+    return {name: np.concatenate(parts) if parts else np.zeros(0, dtype=dtypes[name])
+            for name, parts in chunks.items()}
+
+
+def _load_tariff_arrays(conn, carrier_index, carrier=None):
+    """读取运价表并按 (组合编码, 重量段下限) 排序"""
+    tariffs = list_tariffs(conn, carrier)
+    for tariff in tariffs:
+        carrier_index.setdefault(tariff['carrier_company'], len(carrier_index))
+
+    carrier_codes = np.array([carrier_index[t['carrier_company']] for t in tariffs], dtype=np.int32)
+    round_trip = np.array([t['transport_type'] == '往返' for t in tariffs], dtype=np.int8)
+    overtime = np.array([t['requirement_type'] == '加班' for t in tariffs], dtype=np.int8)
+    arrays = {
+        'group': _group_codes(carrier_codes, round_trip, overtime),
+        'weight_min': np.array([t['weight_min'] for t in tariffs], dtype=np.float64),
+        'weight_max': np.array([np.inf if t['weight_max'] is None else t['weight_max'] for t in tariffs],
+                               dtype=np.float64),
+        'base_price': np.array([t['base_price'] for t in tariffs], dtype=np.float64),
+        'volume_price': np.array([t['volume_price'] for t in tariffs], dtype=np.float64)
+    }
+    order = np.lexsort((arrays['weight_min'], arrays['group']))
+    return [tariffs[i] for i in order], {name: values[order] for name, values in arrays.items()}
+
+
+def _match_tariffs(tasks, tariffs):
+    """为每个任务查找运价行下标，未匹配的任务为 -1"""
+    count = len(tasks['weight'])
+    if count == 0 or len(tariffs['group']) == 0:
+        return np.full(count, -1, dtype=np.int64)
+
+    # 组合编码与重量合成单调的排序键，一次 searchsorted 完成分组内的重量段查找
+    span = max(float(tasks['weight'].max()), float(tariffs['weight_min'].max())) + 1
+    tariff_keys = tariffs['group'] * span + tariffs['weight_min']
+    task_keys = tasks['group'] * span + tasks['weight']
+
+    index = np.searchsorted(tariff_keys, task_keys, side='right') - 1
+    safe = np.clip(index, 0, None)
+    matched = ((index >= 0)
+               & (tariffs['group'][safe] == tasks['group'])
+               & (tasks['weight'] < tariffs['weight_max'][safe]))
+    return np.where(matched, index, -1)
+
+
+def _round2(value):
+    return round(float(value), 2)
+
+
+def compute_settlement(conn, date_from, date_to, carrier=None):
+    """
+    计算结算期内各承运商的结算明细
+
+    Args:
+        conn: 数据库连接
+        date_from (str): 起始日期（含）
+        date_to (str): 截止日期（含）
+        carrier (str): 只计算指定承运商
+
+    Returns:
+        dict: 汇总、按承运商的结算行以及未匹配运价的任务统计
+    """
+    started = time.perf_counter()
+    carrier_index = {}
+    tasks = _load_tasks(conn, carrier_index, date_from, date_to, carrier)
+    tariff_rows, tariffs = _load_tariff_arrays(conn, carrier_index, carrier)
+    carrier_names = sorted(carrier_index, key=carrier_index.get)
+    carrier_count = len(carrier_names)
+
+    tasks['group'] = _group_codes(tasks['carrier'], tasks['round_trip'], tasks['overtime'])
+    index = _match_tariffs(tasks, tariffs)
+    matched = index >= 0
+    line_index = index[matched]
+    billed_volume = tasks['volume'][matched]
+    amounts = tariffs['base_price'][line_index] + tariffs['volume_price'][line_index] * billed_volume
+
+    # 按运价行汇总
+    tariff_count = len(tariff_rows)
+    line_tasks = np.bincount(line_index, minlength=tariff_count)
+    line_weight = np.bincount(line_index, weights=tasks['weight'][matched], minlength=tariff_count)
+    line_volume = np.bincount(line_index, weights=billed_volume, minlength=tariff_count)
+    line_amount = np.bincount(line_index, weights=amounts, minlength=tariff_count)
+
+    # 按承运商汇总
+    carrier_tasks = np.bincount(tasks['carrier'], minlength=carrier_count)
+    carrier_priced = np.bincount(tasks['carrier'][matched], minlength=carrier_count)
+    carrier_weight = np.bincount(tasks['carrier'][matched], weights=tasks['weight'][matched],
+                                 minlength=carrier_count)
+    carrier_volume = np.bincount(tasks['carrier'][matched], weights=billed_volume, minlength=carrier_count)
+    carrier_amount = np.bincount(tasks['carrier'][matched], weights=amounts, minlength=carrier_count)
+
+    carriers = {}
+    for code in np.flatnonzero(carrier_tasks).tolist():
+        carriers[code] = {
+            'carrier_company': carrier_names[code],
+            'task_count': int(carrier_tasks[code]),
+            'priced_count': int(carrier_priced[code]),
+            'unpriced_count': int(carrier_tasks[code] - carrier_priced[code]),
+            'total_weight': _round2(carrier_weight[code]),
+            'billed_volume': _round2(carrier_volume[code]),
+            'amount': _round2(carrier_amount[code]),
+            'lines': []
+        }
+    for i in np.flatnonzero(line_tasks).tolist():
+        tariff = tariff_rows[i]
+        carriers[carrier_index[tariff['carrier_company']]]['lines'].append({
+            'tariff_id': tariff['id'],
+            'transport_type': tariff['transport_type'],
+            'requirement_type': tariff['requirement_type'],
+            'weight_class': weight_class_label(tariff['weight_min'], tariff['weight_max']),
+            'base_price': tariff['base_price'],
+            'volume_price': tariff['volume_price'],
+            'task_count': int(line_tasks[i]),
+            'total_weight': _round2(line_weight[i]),
+            'billed_volume': _round2(line_volume[i]),
+            'amount': _round2(line_amount[i])
+        })
+
+    # 未匹配运价的任务按 (承运商, 运输类型, 需求类型) 统计，便于补录运价
+    unpriced_groups = np.bincount(tasks['group'][~matched], minlength=carrier_count * 4)
+    unpriced = []
+    for group in np.flatnonzero(unpriced_groups).tolist():
+        unpriced.append({
+            'carrier_company': carrier_names[group // 4],
+            'transport_type': '往返' if group // 2 % 2 else '单程',
+            'requirement_type': '加班' if group % 2 else '正班',
+            'task_count': int(unpriced_groups[group])
+        })
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'task_count': int(len(tasks['weight'])),
+        'priced_count': int(matched.sum()),
+        'total_amount': _round2(amounts.sum()),
+        'carriers': sorted(carriers.values(), key=lambda item: item['carrier_company']),
+        'unpriced': unpriced,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, make_response
 from flask_login import current_user, login_required
 import sqlite3
 import hashlib
@@ -11,6 +11,14 @@ from flask import Blueprint, session, redirect, url_for, request
 
 # 使用延迟导入避免循环依赖
 from flask import current_app
+from api.decorators import create_response
+from .user_query import search_users, parse_pagination
+from reference_cache import role_cache, company_cache, permission_cache, get_role_permission_names
+from .provisioning import provision_users_from_file, provisioning_job, pop_credentials
+from import_service import SUPPORTED_EXTENSIONS
+from job_queue import get_job_manager
+from security import hash_password
+from session_store import invalidate_user_sessions
 
 def get_db():
     if 'db' not in current_app.config:
@@ -27,21 +35,11 @@ def permission_required(permission_name):
         @login_required
         def decorated_function(*args, **kwargs):
             
-            # 获取用户权限
-            conn = get_db()
-            permissions = conn.execute('''
-                SELECT p.name FROM Permission p
-                JOIN RolePermission rp ON p.id = rp.permission_id
-                JOIN UserRole ur ON rp.role_id = ur.role_id
-                WHERE ur.user_id = ?
-            ''', (current_user.id,)).fetchall()
-
-            
             # 检查用户是否有超级管理员角色
             is_super_admin = '超级管理员' in current_user.roles
             
-            # 检查权限
-            permission_names = [p['name'] for p in permissions]
+            # 检查权限（按角色从缓存中取权限集合）
+            permission_names = get_role_permission_names(get_db(), current_user.roles)
             if permission_name in permission_names or is_super_admin:
                 return f(*args, **kwargs)
             else:
@@ -65,31 +63,16 @@ def get_user_roles(user_id):
 def index():
     return redirect(url_for('user_management_bp.user_list'))
 
-# 用户列表页面 - 添加搜索功能
+# 用户列表页面 - 分页检索
 @user_management_bp.route('/users')
 @permission_required('user_manage')
 def user_list():
     search_query = request.args.get('search', '').strip()
+    page, per_page = parse_pagination(request.args)
     conn = get_db()
-    
-    if search_query:
-        users = conn.execute('''
-            SELECT * FROM User 
-            WHERE username LIKE ? OR full_name LIKE ? OR email LIKE ?
-            ORDER BY created_at DESC
-        ''', (f'%{search_query}%', f'%{search_query}%', f'%{search_query}%')).fetchall()
-    else:
-        users = conn.execute('SELECT * FROM User ORDER BY created_at DESC').fetchall()
-    
-    # 获取每个用户的角色信息
-    users_with_roles = []
-    for user in users:
-        roles = conn.execute('''
-            SELECT r.* FROM Role r
-            JOIN UserRole ur ON r.id = ur.role_id
-            WHERE ur.user_id = ?
-        ''', (user['id'],)).fetchall()
-        users_with_roles.append({** user, 'roles': roles})
+
+    users_with_roles, total = search_users(conn, search_query, page, per_page)
+    total_pages = max((total + per_page - 1) // per_page, 1)
     
     # 获取当前登录用户信息及角色名称列表
     current_user_info = {
@@ -98,7 +81,73 @@ def user_list():
         'full_name': current_user.full_name,
         'roles': current_user.roles
     }
-    return render_template('user_management/user_list.html', users=users_with_roles, search_query=search_query, user=current_user_info)
+    return render_template('user_management/user_list.html', users=users_with_roles, search_query=search_query,
+                           user=current_user_info, page=page, per_page=per_page, total=total,
+                           total_pages=total_pages)
+
+# 用户列表接口 - 分页检索（JSON）
+@user_management_bp.route('/api/users')
+@permission_required('user_manage')
+def api_user_list():
+    search_query = request.args.get('search', '').strip()
+    page, per_page = parse_pagination(request.args)
+
+    users, total = search_users(get_db(), search_query, page, per_page)
+    return create_response(data={
+        'list': users,
+        'total': total,
+        'page': page,
+        'limit': per_page
+    })
+
+# 批量开通账号接口 - 上传CSV/Excel批量创建用户
+@user_management_bp.route('/api/users/provision', methods=['POST'])
+@permission_required('user_manage')
+def api_user_provision():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return create_response(success=False, error={'code': 4001, 'message': '未上传文件'}), 400
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        return create_response(success=False, error={
+            'code': 4001, 'message': '文件格式不正确，请上传.xlsx或.csv格式的文件'
+        }), 400
+
+    dry_run = request.form.get('dry_run') == '1'
+
+    # 异步模式：暂存上传文件并提交后台任务，立即返回任务ID
+    if request.form.get('async') == '1':
+        job_manager = get_job_manager()
+        upload_path = job_manager.upload_path(file.filename)
+        file.save(upload_path)
+        job_id = job_manager.submit('user_provision', provisioning_job, upload_path, file.filename,
+                                    dry_run=dry_run, created_by=current_user.id)
+        return create_response(data={'job_id': job_id}), 202
+
+    try:
+        result = provision_users_from_file(get_db(), file, dry_run=dry_run)
+        return create_response(data=result)
+    except Exception as e:
+        return create_response(success=False, error={'code': 5001, 'message': f'批量开通失败: {str(e)}'}), 500
+
+# 下载后台批量开通任务生成的初始密码 - 文件下载一次后即删除
+@user_management_bp.route('/api/users/provision/<job_id>/credentials', methods=['GET'])
+@permission_required('user_manage')
+def api_user_provision_credentials(job_id):
+    job = get_job_manager().get_job(job_id)
+    if not job or job['job_type'] != 'user_provision' or job['created_by'] != current_user.id:
+        return create_response(success=False, error={'code': 4004, 'message': '任务不存在'}), 404
+
+    content = pop_credentials(job_id)
+    if content is None:
+        return create_response(success=False, error={
+            'code': 4004, 'message': '初始密码文件不存在或已被下载'
+        }), 404
+
+    response = make_response(content)
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = f'attachment; filename=initial_passwords_{job_id}.csv'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 # 创建新用户
 @user_management_bp.route('/users/new', methods=['GET', 'POST'])
@@ -112,14 +161,14 @@ def user_new():
         
         # 验证密码匹配
         if password != confirm_password:
-            roles = conn.execute('SELECT * FROM Role').fetchall()
-            companies = conn.execute('SELECT * FROM Company').fetchall()
+            roles = role_cache.get(conn)
+            companies = company_cache.get(conn)
             return render_template('user_management/user_edit.html', error='两次输入的密码不一致', roles=roles, companies=companies, user_roles=[])
         
         # 验证密码长度
         if len(password) < 8:
-            roles = conn.execute('SELECT * FROM Role').fetchall()
-            companies = conn.execute('SELECT * FROM Company').fetchall()
+            roles = role_cache.get(conn)
+            companies = company_cache.get(conn)
             return render_template('user_management/user_edit.html', error='密码长度不能少于8位', roles=roles, companies=companies, user_roles=[])
         
         full_name = request.form['full_name']
@@ -138,38 +187,32 @@ def user_new():
                 role_id = None
         
         # 哈希密码
-        # 在第125行附近，替换现有的密码哈希代码
-        # 原来的代码：
-        # hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        # 新的代码：
-        from werkzeug.security import generate_password_hash
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         
         conn = get_db()
         try:
             # 检查用户名和邮箱是否已存在 (增强调试日志)
-            print(f"正在检查用户名: {username} (精确匹配)")  # 调试日志
+            current_app.logger.debug(f"正在检查用户名: {username} (精确匹配)")
             existing_user = conn.execute('SELECT id FROM User WHERE username = ? COLLATE NOCASE', (username,)).fetchone()
             if existing_user:
-                print(f"用户名已存在: {username} (现有用户ID: {existing_user['id']})")  # 调试日志
-                print(f"当前事务状态: {conn.in_transaction}")  # 调试事务状态
-                roles = conn.execute('SELECT * FROM Role').fetchall()
-                companies = conn.execute('SELECT * FROM Company').fetchall()
-                print(f"查询到的角色数量: {len(roles)}, 公司数量: {len(companies)}")  # 调试日志
+                current_app.logger.debug(f"用户名已存在: {username} (现有用户ID: {existing_user['id']})")
+                current_app.logger.debug(f"当前事务状态: {conn.in_transaction}")
+                roles = role_cache.get(conn)
+                companies = company_cache.get(conn)
+                current_app.logger.debug(f"查询到的角色数量: {len(roles)}, 公司数量: {len(companies)}")
                 return render_template('user_management/user_edit.html', error='用户名已存在', roles=roles, companies=companies, user_roles=[])
             
             # 检查邮箱是否已存在
-            print(f"正在检查邮箱: {email}")  # 调试日志
+            current_app.logger.debug(f"正在检查邮箱: {email}")
             existing_email = conn.execute('SELECT id FROM User WHERE email = ?', (email,)).fetchone()
             if existing_email:
-                print(f"邮箱已存在: {email} (现有用户ID: {existing_email['id']})")  # 调试日志
-                roles = conn.execute('SELECT * FROM Role').fetchall()
-                companies = conn.execute('SELECT * FROM Company').fetchall()
+                current_app.logger.debug(f"邮箱已存在: {email} (现有用户ID: {existing_email['id']})")
+                roles = role_cache.get(conn)
+                companies = company_cache.get(conn)
                 return render_template('user_management/user_edit.html', error='邮箱已被注册', roles=roles, companies=companies, user_roles=[])
             
             # 创建用户 (增强调试和错误处理)
-            print(f"正在创建新用户: {username}, 姓名: {full_name}, 邮箱: {email}")  # 调试日志
+            current_app.logger.debug(f"正在创建新用户: {username}, 姓名: {full_name}, 邮箱: {email}")
             try:
                 # 开始事务
                 with conn:
@@ -180,30 +223,30 @@ def user_new():
                     
                     # 获取新创建的用户
                     user = conn.execute('SELECT id FROM User WHERE username = ?', (username,)).fetchone()
-                    print(f"新用户创建成功，ID: {user['id']}")  # 调试日志
+                    current_app.logger.debug(f"新用户创建成功，ID: {user['id']}")
                     
                     # 分配角色（单个角色）
                     if role_id:
                         conn.execute('INSERT INTO UserRole (user_id, role_id) VALUES (?, ?)', (user['id'], role_id))
-                        print(f"角色分配成功，角色ID: {role_id}")  # 调试日志
+                        current_app.logger.debug(f"角色分配成功，角色ID: {role_id}")
                 
                 # 确保当前用户会话有效
                 if not current_user.is_authenticated:
-                    print("警告：当前用户会话无效")
+                    current_app.logger.warning("当前用户会话无效")
                 
                 return redirect(url_for('user_management_bp.user_list'))
             except Exception as e:
-                print(f"用户创建过程中出错: {str(e)}")  # 调试日志
-                roles = conn.execute('SELECT * FROM Role').fetchall()
-                companies = conn.execute('SELECT * FROM Company').fetchall()
+                current_app.logger.error(f"用户创建过程中出错: {str(e)}")
+                roles = role_cache.get(conn)
+                companies = company_cache.get(conn)
                 return render_template('user_management/user_edit.html', 
                                     error=f"创建用户失败: {str(e)}", 
                                     roles=roles, 
                                     companies=companies, 
                                     user_roles=[])
         except sqlite3.IntegrityError:
-            roles = conn.execute('SELECT * FROM Role').fetchall()
-            companies = conn.execute('SELECT * FROM Company').fetchall()
+            roles = role_cache.get(conn)
+            companies = company_cache.get(conn)
             return render_template('user_management/user_edit.html', error="用户名已存在", roles=roles, companies=companies, user_roles=[])
         finally:
               pass  # 由Flask自动管理连接关闭
@@ -211,8 +254,8 @@ def user_new():
     # GET请求 - 显示表单
     conn = get_db()
     # 获取所有角色
-    all_roles = conn.execute('SELECT * FROM Role').fetchall()
-    companies = conn.execute('SELECT * FROM Company').fetchall()
+    all_roles = role_cache.get(conn)
+    companies = company_cache.get(conn)
     current_user_info = {
         'id': current_user.id,
         'username': current_user.username,
@@ -251,8 +294,8 @@ def user_edit(id):
             current_app.logger.warning(f"用户不存在: ID={id}")
 
         # 2. 预加载角色和公司数据（GET/POST都需要用到）
-        roles = conn.execute('SELECT * FROM Role').fetchall()
-        companies = conn.execute('SELECT * FROM Company').fetchall()
+        roles = role_cache.get(conn)
+        companies = company_cache.get(conn)
 
         # 3. 处理用户不存在的情况
         if not user:
@@ -330,7 +373,7 @@ def _handle_post_request(conn, user, user_id, roles, companies):
                     error="密码长度不能少于8位"
                 )
             # 安全哈希处理（替代原sha256，自带盐值）
-            hashed_password = generate_password_hash(new_password)
+            hashed_password = hash_password(new_password)
             # 调整SQL和字段列表（插入密码字段）
             base_query = '''
                 UPDATE User 
@@ -353,6 +396,8 @@ def _handle_post_request(conn, user, user_id, roles, companies):
 
         # 提交事务
         conn.commit()
+        # 角色或状态可能已变更，使该用户已有会话中的授权快照失效
+        invalidate_user_sessions(user_id)
         current_app.logger.info(f"用户更新成功: ID={user_id}")
         return redirect(url_for('user_management_bp.user_list'))
 
@@ -405,10 +450,8 @@ def _handle_get_request(conn, user, roles, companies):
         user_roles=edited_user_role_ids,  # 被编辑用户的角色ID（用于勾选）
         user=current_user_info
     )
-    # 打印下id
-    print(f"编辑用户ID: {id}")      
-    # 打印下request.form
-    print(f"request.form: {request.form}")      
+    # 表单可能包含密码，只记录字段名
+    current_app.logger.debug(f"编辑用户ID: {id}, 表单字段: {list(request.form.keys())}")
    
 
 
@@ -456,13 +499,7 @@ def _handle_get_request(conn, user, roles, companies):
             '''
             
             if new_password and new_password.strip():
-                # 在第200行附近，替换编辑用户时的密码哈希代码
-                # 原来的代码：
-                # hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-                
-                # 新的代码：
-                from werkzeug.security import generate_password_hash
-                hashed_password = generate_password_hash(new_password)
+                hashed_password = hash_password(new_password)
                 query = '''
                     UPDATE User 
                     SET full_name = ?, email = ?, company_id = ?, is_active = ?, password = ?, updated_at = ?
@@ -498,8 +535,8 @@ def _handle_get_request(conn, user, roles, companies):
         user_roles = [user_role['role_id']] if user_role else []
             
         # 获取所有角色和公司
-        roles = conn.execute('SELECT * FROM Role').fetchall()
-        companies = conn.execute('SELECT * FROM Company').fetchall()
+        roles = role_cache.get(conn)
+        companies = company_cache.get(conn)
         
        
             
@@ -525,6 +562,7 @@ def user_delete(id):
     conn = get_db()
     conn.execute('DELETE FROM User WHERE id = ?', (id,))
     conn.commit()
+    invalidate_user_sessions(id)
 
     return redirect(url_for('user_management_bp.user_list'))
 
@@ -532,16 +570,16 @@ def user_delete(id):
 @user_management_bp.route('/users/<int:id>/reset-password', methods=['POST'])
 @permission_required('user_manage')
 def user_reset_password(id):
-    from werkzeug.security import generate_password_hash
     conn = get_db()
     # 检查用户是否存在
     user = conn.execute('SELECT id FROM User WHERE id = ?', (id,)).fetchone()
     if not user:
         return redirect(url_for('user_management_bp.user_list'))
     # 重置密码为admin123
-    hashed_password = generate_password_hash('admin123')
+    hashed_password = hash_password('admin123')
     conn.execute('UPDATE User SET password = ? WHERE id = ?', (hashed_password, id))
     conn.commit()
+    invalidate_user_sessions(id)
     return redirect(url_for('user_management_bp.user_list'))
 
 # 角色列表
@@ -549,7 +587,7 @@ def user_reset_password(id):
 @permission_required('user_manage')
 def role_list():
     conn = get_db()  # 修正为get_db()
-    roles = conn.execute('SELECT * FROM Role').fetchall()
+    roles = role_cache.get(conn)
     current_user = conn.execute('SELECT * FROM User WHERE id = ?', (session['user_id'],)).fetchone()
 
     return render_template('user_management/role_list.html', roles=roles, user=current_user)
@@ -575,7 +613,8 @@ def role_edit(id):
             # 分配新权限
             for permission_id in permission_ids:
                 conn.execute('INSERT INTO RolePermission (role_id, permission_id) VALUES (?, ?)', (id, permission_id))
-                
+
+            permission_cache.invalidate(conn)
             conn.commit()
             return redirect(url_for('user_management_bp.role_list'))
         except sqlite3.Error as e:
@@ -585,7 +624,7 @@ def role_edit(id):
     
     # GET请求 - 显示表单
     role_permissions = [p['permission_id'] for p in conn.execute('SELECT permission_id FROM RolePermission WHERE role_id = ?', (id,)).fetchall()]
-    permissions = conn.execute('SELECT * FROM Permission ORDER BY module').fetchall()
+    permissions = permission_cache.get(conn)['all']
     current_user = conn.execute('SELECT * FROM User WHERE id = ?', (session['user_id'],)).fetchone()
 
     return render_template('user_management/role_edit.html', role=role, permissions=permissions, role_permissions=role_permissions, user=current_user)
@@ -0,0 +1,300 @@
+"""
+批量开通账号 - 从CSV/Excel批量创建用户（供应商入驻等场景）
+唯一性校验使用集合查询，密码哈希在线程池中并行计算，所有有效行在一个事务中写入
+"""
+
+import csv
+import os
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import PROVISIONING_HASH_WORKERS
+from import_service import open_table_reader
+from job_queue import get_job_manager
+from reference_cache import role_cache, company_cache
+from security import hash_password
+
+# 表头 -> 字段
+PROVISIONING_COLUMNS = {
+    '用户名': 'username',
+    '姓名': 'full_name',
+    '邮箱': 'email',
+    '电话': 'phone',
+    '所属单位': 'company',
+    '角色': 'role',
+    '密码': 'password'
+}
+
+REQUIRED_COLUMNS = ['用户名']
+
+# 未填写角色时使用的默认角色
+DEFAULT_ROLE = '供应商'
+
+MIN_PASSWORD_LENGTH = 8
+
+# 行数少于该值时直接在当前线程中计算哈希
+HASH_POOL_THRESHOLD = 16
+
+# 后台任务生成的初始密码文件未被下载时的保留时间（秒）
+CREDENTIALS_RETENTION_SECONDS = 24 * 3600
+
+# IN 查询每批的参数个数
+LOOKUP_BATCH_SIZE = 500
+
+_PASSWORD_ALPHABET = string.ascii_letters + string.digits
+
+
+def generate_initial_password(length=12):
+    """生成随机初始密码"""
+    return ''.join(secrets.choice(_PASSWORD_ALPHABET) for _ in range(length))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PROVISIONING_HASH_WORKERS, thread_name_prefix='provision-hash')
+        return _executor
+
+
+def hash_passwords(passwords):
+    """
+    批量计算密码哈希，数量较多时在线程池中并行计算
+
+    pbkdf2 计算期间释放 GIL，线程即可并行；不在多线程的 Web 进程中 fork 进程池，
+    也不占用登录校验的线程池
+    """
+    if len(passwords) < HASH_POOL_THRESHOLD or PROVISIONING_HASH_WORKERS <= 1:
+        return [hash_password(password) for password in passwords]
+    return list(_get_executor().map(hash_password, passwords))
+
+
+def _existing_values(conn, column, values):
+    """集合查询已存在的值（不区分大小写），返回小写值集合"""
+    values = list(values)
+    existing = set()
+    for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+        batch = values[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ', '.join('?' * len(batch))
+        existing.update(row[0] for row in conn.execute(
+            f'SELECT lower({column}) FROM User WHERE lower({column}) IN ({placeholders})', batch
+        ))
+    return existing
+
+
+def _parse_rows(headers, rows):
+    """按表头解析数据行，返回 [(行号, 字段字典)]"""
+    column_index = {PROVISIONING_COLUMNS[header]: i for i, header in enumerate(headers)
+                    if header in PROVISIONING_COLUMNS}
+    records = []
+    for row_number, values in rows:
+        record = {
+            field: values[index] if index < len(values) else None
+            for field, index in column_index.items()
+        }
+        records.append((row_number, record))
+    return records
+
+
+def provision_users(conn, headers, rows, dry_run=False, default_role=DEFAULT_ROLE):
+    """
+    批量创建用户
+
+    Args:
+        conn: 数据库连接
+        headers (list): 表头
+        rows (iterable): (行号, 单元格值元组) 迭代器
+        dry_run (bool): 只校验不写入
+        default_role (str): 未填写角色时使用的角色
+
+    Returns:
+        dict: 导入结果，包含汇总数字、错误信息和逐行结果；
+              未提供密码的行会生成初始密码并在逐行结果中返回
+    """
+    result = {'total': 0, 'success': 0, 'fail': 0, 'errors': [], 'rows': []}
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in headers]
+    if missing:
+        result['errors'].append(f"缺少必要列: {', '.join(missing)}")
+        return result
+
+    records = _parse_rows(headers, rows)
+    result['total'] = len(records)
+
+    role_ids = {role['name']: role['id'] for role in role_cache.get(conn)}
+    company_ids = {company['name']: company['id'] for company in company_cache.get(conn)}
+    existing_usernames = _existing_values(
+        conn, 'username', {record['username'].lower() for _, record in records if record.get('username')}
+    )
+    existing_emails = _existing_values(
+        conn, 'email', {record['email'].lower() for _, record in records if record.get('email')}
+    )
+
+    # 逐行校验，文件内的重复也视为冲突
+    seen_usernames = set()
+    seen_emails = set()
+    valid = []
+    failures = {}
+    for row_number, record in records:
+        username = record.get('username')
+        email = record.get('email')
+        role_name = record.get('role') or default_role
+        company_name = record.get('company')
+        password = record.get('password')
+
+        if not username:
+            error = '用户名为空'
+        elif username.lower() in existing_usernames:
+            error = f'用户名已存在: {username}'
+        elif username.lower() in seen_usernames:
+            error = f'文件中用户名重复: {username}'
+        elif email and email.lower() in existing_emails:
+            error = f'邮箱已被注册: {email}'
+        elif email and email.lower() in seen_emails:
+            error = f'文件中邮箱重复: {email}'
+        elif role_name not in role_ids:
+            error = f'角色不存在: {role_name}'
+        elif company_name and company_name not in company_ids:
+            error = f'单位不存在: {company_name}'
+        elif password and len(password) < MIN_PASSWORD_LENGTH:
+            error = f'密码长度不能少于{MIN_PASSWORD_LENGTH}位'
+        else:
+            error = None
+
+        if username:
+            seen_usernames.add(username.lower())
+        if email:
+            seen_emails.add(email.lower())
+
+        if error:
+            failures[row_number] = error
+            continue
+
+        valid.append({
+            'row': row_number,
+            'username': username,
+            'full_name': record.get('full_name'),
+            'email': email,
+            'phone': record.get('phone'),
+            'company_id': company_ids.get(company_name),
+            'role_id': role_ids[role_name],
+            'role': role_name,
+            'password': password,
+            'generated_password': None if password else generate_initial_password()
+        })
+
+    if valid and not dry_run:
+        hashes = hash_passwords([user['password'] or user['generated_password'] for user in valid])
+        now = datetime.now()
+        try:
+            with conn:
+                for user, password_hash in zip(valid, hashes):
+                    user['id'] = conn.execute('''
+                        INSERT INTO User (username, password, full_name, email, phone, company_id, is_active, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                        RETURNING id
+                    ''', (user['username'], password_hash, user['full_name'], user['email'], user['phone'],
+                          user['company_id'], now, now)).fetchone()[0]
+                conn.executemany('INSERT INTO UserRole (user_id, role_id) VALUES (?, ?)',
+                                 [(user['id'], user['role_id']) for user in valid])
+        except Exception as e:
+            # 整批回滚，所有有效行记为失败
+            for user in valid:
+                failures[user['row']] = f'写入失败: {str(e)}'
+            valid = []
+
+    created = {user['row']: user for user in valid}
+    for row_number, record in records:
+        if row_number in failures:
+            result['fail'] += 1
+            result['errors'].append(f'第{row_number}行: {failures[row_number]}')
+            result['rows'].append({'row': row_number, 'username': record.get('username'),
+                                   'status': 'failed', 'message': failures[row_number]})
+            continue
+
+        user = created[row_number]
+        result['success'] += 1
+        row_result = {'row': row_number, 'username': user['username'], 'role': user['role'],
+                      'status': 'valid' if dry_run else 'created'}
+        if not dry_run:
+            row_result['id'] = user['id']
+            if user['generated_password']:
+                row_result['initial_password'] = user['generated_password']
+        result['rows'].append(row_result)
+
+    return result
+
+
+def provision_users_from_file(conn, file, filename=None, dry_run=False):
+    """从上传文件或文件对象批量创建用户"""
+    headers, rows = open_table_reader(file, filename)
+    return provision_users(conn, headers, rows, dry_run=dry_run)
+
+
+def credentials_path(job_id):
+    """后台任务生成的初始密码文件路径（不登记为任务结果文件，不能通过 /api/jobs 下载）"""
+    return os.path.join(get_job_manager().result_dir, 'credentials', f'{job_id}.csv')
+
+
+def _purge_expired_credentials():
+    """删除超过保留时间仍未下载的初始密码文件"""
+    credentials_dir = os.path.dirname(credentials_path('_'))
+    if not os.path.isdir(credentials_dir):
+        return
+    cutoff = time.time() - CREDENTIALS_RETENTION_SECONDS
+    for entry in os.scandir(credentials_dir):
+        if entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+
+def pop_credentials(job_id):
+    """
+    读取并删除后台任务生成的初始密码文件（只能下载一次）
+
+    Returns:
+        bytes: CSV文件内容，文件不存在或已被下载时返回None
+    """
+    path = credentials_path(job_id)
+    try:
+        with open(path, 'rb') as file:
+            content = file.read()
+        os.remove(path)
+    except FileNotFoundError:
+        return None
+    return content
+
+
+def provisioning_job(context, upload_path, filename, dry_run=False):
+    """
+    后台任务：从暂存文件批量创建用户，完成后删除暂存文件
+
+    任务结果保存在 background_jobs 中，初始密码不写入结果，另存为只能下载一次的CSV文件，
+    结果中只返回生成的数量
+    """
+    _purge_expired_credentials()
+    try:
+        with open(upload_path, 'rb') as file:
+            result = provision_users_from_file(context.conn, file, filename, dry_run=dry_run)
+    finally:
+        os.remove(upload_path)
+
+    generated = [(row['row'], row['username'], row.pop('initial_password'))
+                 for row in result['rows'] if 'initial_password' in row]
+    result['generated_passwords'] = len(generated)
+    if generated:
+        path = credentials_path(context.job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8-sig',
+                  newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['行号', '用户名', '初始密码'])
+            writer.writerows(generated)
+    return result
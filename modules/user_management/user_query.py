@@ -0,0 +1,89 @@
+"""
+用户列表查询 - 分页检索用户并一次性获取当页用户的角色
+检索词不少于3个字符时走 user_search 全文索引（trigram），否则退回LIKE
+"""
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# trigram分词要求检索词至少3个字符
+FTS_MIN_QUERY_LENGTH = 3
+
+# 列表页展示字段（不含密码）
+USER_LIST_COLUMNS = 'u.id, u.username, u.full_name, u.email, u.phone, u.company_id, u.is_active, u.created_at'
+
+
+def _has_search_index(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_search'").fetchone()
+    return row is not None
+
+
+def _build_filter(conn, search_query):
+    """根据检索词构建 (WHERE子句, 参数)"""
+    if not search_query:
+        return '', []
+
+    if len(search_query) >= FTS_MIN_QUERY_LENGTH and _has_search_index(conn):
+        # 整体作为短语匹配，双引号需转义
+        phrase = '"' + search_query.replace('"', '""') + '"'
+        return 'WHERE u.id IN (SELECT rowid FROM user_search WHERE user_search MATCH ?)', [phrase]
+
+    pattern = '%' + search_query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return ("WHERE u.username LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\' OR u.email LIKE ? ESCAPE '\\'",
+            [pattern, pattern, pattern])
+
+
+def search_users(conn, search_query='', page=1, per_page=DEFAULT_PAGE_SIZE):
+    """
+    分页检索用户
+
+    Args:
+        conn: 数据库连接
+        search_query (str): 检索词，匹配用户名、姓名、邮箱
+        page (int): 页码，从1开始
+        per_page (int): 每页数量
+
+    Returns:
+        tuple: (用户字典列表（含roles列表）, 总数)
+    """
+    where, params = _build_filter(conn, (search_query or '').strip())
+    total = conn.execute(f'SELECT COUNT(*) FROM User u {where}', params).fetchone()[0]
+
+    # 先取当页用户，再一次关联出这些用户的全部角色
+    rows = conn.execute(f'''
+        WITH page AS (
+            SELECT {USER_LIST_COLUMNS} FROM User u
+            {where}
+            ORDER BY u.created_at DESC, u.id DESC
+            LIMIT ? OFFSET ?
+        )
+        SELECT page.*, r.id AS role_id, r.name AS role_name, r.description AS role_description
+        FROM page
+        LEFT JOIN UserRole ur ON ur.user_id = page.id
+        LEFT JOIN Role r ON r.id = ur.role_id
+        ORDER BY page.created_at DESC, page.id DESC, r.id
+    ''', params + [per_page, (page - 1) * per_page]).fetchall()
+
+    users = {}
+    for row in rows:
+        user = users.get(row['id'])
+        if user is None:
+            user = users[row['id']] = {
+                key: row[key] for key in row.keys() if not key.startswith('role_')
+            }
+            user['roles'] = []
+        if row['role_id'] is not None:
+            user['roles'].append({
+                'id': row['role_id'],
+                'name': row['role_name'],
+                'description': row['role_description']
+            })
+
+    return list(users.values()), total
+
+
+def parse_pagination(args):
+    """从请求参数解析 (page, per_page)，非法值回退为默认值"""
+    page = args.get('page', 1, type=int) or 1
+    per_page = args.get('limit', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE
+    return max(page, 1), min(max(per_page, 1), MAX_PAGE_SIZE)
@@ -0,0 +1,186 @@
+"""
+慢查询分析模块 - 按归一化语句汇总SQL执行次数与耗时
+超过阈值的语句记录日志（含参数类型），并自动执行 EXPLAIN QUERY PLAN，标记全表扫描
+作为 metrics 模块的SQL观察者接入，统计保存在进程内存中；耗时包含读取结果的时间，
+语句读完（或游标关闭、回收）后才判断是否为慢查询，全表扫描的查询在 fetch 阶段的耗时也会计入
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from metrics import add_sql_observer
+
+logger = logging.getLogger(__name__)
+
+# 每条归一化语句最多记录的参数类型组合数
+MAX_SHAPES = 5
+
+# 最多汇总的归一化语句数，超出后不再新增（避免动态拼接的SQL撑满内存）
+MAX_STATEMENTS = 2000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+# 可以执行 EXPLAIN QUERY PLAN 的语句
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+# 不走索引的全表扫描：SCAN 表名（有别名时为别名），不含 USING INDEX
+_FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql):
+    """归一化SQL：字面量替换为?，IN列表折叠，压缩空白"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def param_shape(params):
+    """参数类型形状，如 (int, str, NoneType)；不记录参数值"""
+    if params is None:
+        return 'executemany'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+
+
+def explain_query_plan(conn, sql, params):
+    """
+    获取查询计划
+
+    Returns:
+        list: 计划明细文本，按树形缩进；无法解释时返回空列表
+    """
+    # 直接调用 sqlite3.Connection.execute，绕过计时游标，避免递归记录
+    rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    depth = {0: -1}
+    plan = []
+    for row in rows:
+        node_id, parent_id, detail = row[0], row[1], row[3]
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        plan.append('  ' * depth[node_id] + detail)
+    return plan
+
+
+def find_full_scans(plan):
+    """从查询计划中找出全表扫描的表（或别名）"""
+    tables = []
+    for line in plan:
+        match = _FULL_SCAN.match(line.strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+class QueryProfiler:
+    """按归一化语句汇总SQL执行统计，记录慢查询"""
+
+    def __init__(self, threshold_ms=100, explain=True):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, cursor, sql, params, elapsed, many=False):
+        """metrics 模块的SQL观察者回调，语句结果读完后调用，elapsed 为执行与读取结果的合计耗时"""
+        elapsed_ms = elapsed * 1000
+        normalized = normalize_sql(sql)
+        slow = elapsed_ms >= self.threshold_ms
+
+        with self._lock:
+            entry = self._stats.get(normalized)
+            if entry is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    return
+                entry = self._stats[normalized] = {
+                    'sql': normalized,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'slow_count': 0,
+                    'shapes': [],
+                    'plan': None,
+                    'full_scans': [],
+                    'last_slow_at': None
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            shape = param_shape(params)
+            if shape not in entry['shapes'] and len(entry['shapes']) < MAX_SHAPES:
+                entry['shapes'].append(shape)
+            if not slow:
+                return
+            entry['slow_count'] += 1
+            entry['last_slow_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            # 每条语句只在第一次变慢时解释，计划一般不会随参数变化
+            need_plan = entry['plan'] is None
+
+        if need_plan:
+            plan = self._explain(cursor, sql, params, many)
+            # 解释失败（如游标回收时连接已关闭）时保留为空，下次变慢时重试
+            if plan is not None:
+                with self._lock:
+                    entry['plan'] = plan
+                    entry['full_scans'] = find_full_scans(plan)
+
+        logger.warning('慢查询 %.1fms 参数%s%s: %s%s', elapsed_ms, shape,
+                       f" 全表扫描{entry['full_scans']}" if entry['full_scans'] else '',
+                       normalized, ''.join('\n    ' + line for line in entry['plan'] or []))
+
+    def _explain(self, cursor, sql, params, many):
+        if not self.explain or many or not _EXPLAINABLE.match(sql):
+            return []
+        try:
+            return explain_query_plan(cursor.connection, sql, params)
+        except sqlite3.Error as e:
+            logger.debug('EXPLAIN QUERY PLAN 失败: %s', e)
+            return None
+
+    def report(self, sort='total_ms', limit=50, slow_only=False):
+        """
+        汇总报告
+
+        Args:
+            sort (str): 排序字段 total_ms / max_ms / count / slow_count / avg_ms
+            limit (int): 返回条数
+            slow_only (bool): 只返回出现过慢查询的语句
+        """
+        with self._lock:
+            entries = [dict(entry, shapes=list(entry['shapes']),
+                            avg_ms=entry['total_ms'] / entry['count'])
+                       for entry in self._stats.values()
+                       if not slow_only or entry['slow_count']]
+        if sort not in ('total_ms', 'max_ms', 'count', 'slow_count', 'avg_ms'):
+            sort = 'total_ms'
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        for entry in entries:
+            for key in ('total_ms', 'max_ms', 'avg_ms'):
+                entry[key] = round(entry[key], 2)
+        return {
+            'threshold_ms': self.threshold_ms,
+            'statement_count': len(self._stats),
+            'statements': entries[:limit]
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+profiler = None
+
+
+def init_query_profiler(threshold_ms, explain=True):
+    """创建全局慢查询分析器并注册为SQL观察者"""
+    global profiler
+    if profiler is None:
+        profiler = QueryProfiler(threshold_ms=threshold_ms, explain=explain)
+        add_sql_observer(profiler.observe)
+    return profiler
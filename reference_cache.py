@@ -0,0 +1,76 @@
+"""
+基础数据缓存模块 - 角色、单位、权限等下拉框/校验用的参考数据
+各缓存按 cache_versions 表的版本号失效，写操作需在同一事务中调用 invalidate
+"""
+
+import threading
+
+from cache_versions import COMPANY_CACHE, ROLE_CACHE, PERMISSION_CACHE, get_cache_version, bump_cache_version
+
+
+class VersionedCache:
+    """按版本号失效的进程内缓存"""
+
+    def __init__(self, name, loader):
+        """
+        Args:
+            name (str): 缓存名称，对应 cache_versions.name
+            loader (callable): 加载函数，签名为 loader(conn)，返回缓存值
+        """
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self, conn):
+        """读取缓存，版本号变化时重新加载"""
+        version = get_cache_version(conn, self.name)
+        if version == self._version:
+            return self._value
+        with self._lock:
+            if version != self._version:
+                self._value = self.loader(conn)
+                self._version = version
+            return self._value
+
+    def invalidate(self, conn):
+        """递增版本号使所有进程的缓存失效（随调用方事务提交）"""
+        bump_cache_version(conn, self.name)
+
+
+def _load_roles(conn):
+    return tuple(dict(row) for row in conn.execute('SELECT * FROM Role ORDER BY id'))
+
+
+def _load_companies(conn):
+    return tuple(dict(row) for row in conn.execute('SELECT * FROM Company ORDER BY name'))
+
+
+def _load_permissions(conn):
+    permissions = tuple(dict(row) for row in conn.execute('SELECT * FROM Permission ORDER BY module, id'))
+
+    by_role = {}
+    for row in conn.execute('''
+        SELECT r.name AS role_name, p.name AS permission_name
+        FROM RolePermission rp
+        JOIN Role r ON r.id = rp.role_id
+        JOIN Permission p ON p.id = rp.permission_id
+    '''):
+        by_role.setdefault(row['role_name'], set()).add(row['permission_name'])
+
+    return {
+        'all': permissions,
+        'by_role': {role: frozenset(names) for role, names in by_role.items()}
+    }
+
+
+role_cache = VersionedCache(ROLE_CACHE, _load_roles)
+company_cache = VersionedCache(COMPANY_CACHE, _load_companies)
+permission_cache = VersionedCache(PERMISSION_CACHE, _load_permissions)
+
+
+def get_role_permission_names(conn, role_names):
+    """获取若干角色拥有的权限名称集合"""
+    by_role = permission_cache.get(conn)['by_role']
+    return frozenset().union(*(by_role.get(role, frozenset()) for role in role_names))
@@ -0,0 +1,155 @@
+"""
+密码安全模块 - 统一的密码哈希策略与登录校验
+密码校验在有界线程池中执行，登录高峰时限制同时进行的哈希计算，避免占满CPU拖慢其他请求
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import (PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH, PASSWORD_VERIFY_WORKERS,
+                    PASSWORD_VERIFY_QUEUE_SIZE, PASSWORD_VERIFY_TIMEOUT)
+
+
+class LoginBusyError(Exception):
+    """密码校验排队已满"""
+
+
+def hash_password(password):
+    """按当前策略计算密码哈希"""
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
+
+
+_normalized_method = None
+
+
+def _current_method():
+    """当前策略的完整方法串（werkzeug会补全默认迭代次数等参数）"""
+    global _normalized_method
+    if _normalized_method is None:
+        _normalized_method = generate_password_hash('', method=PASSWORD_HASH_METHOD, salt_length=1).split('$', 1)[0]
+    return _normalized_method
+
+
+def needs_rehash(pwhash):
+    """已存储的哈希是否与当前策略不一致"""
+    return pwhash.split('$', 1)[0] != _current_method()
+
+
+def _verify_and_rehash(pwhash, password):
+    """校验密码，通过且需要升级时一并计算新哈希"""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    return True, hash_password(password) if needs_rehash(pwhash) else None
+
+
+class LoginStats:
+    """登录统计：次数、最近一分钟速率、校验耗时"""
+
+    WINDOW_SECONDS = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.busy_rejections = 0
+        self.rehashed = 0
+        self.in_flight = 0
+        self.verify_count = 0
+        self.verify_total_ms = 0.0
+        self.verify_max_ms = 0.0
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0] > self.WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def record_attempt(self, success):
+        now = time.monotonic()
+        with self._lock:
+            self.attempts += 1
+            if success:
+                self.successes += 1
+            else:
+                self.failures += 1
+            self._recent.append(now)
+            self._trim(now)
+
+    def begin_verify(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end_verify(self, elapsed_ms):
+        with self._lock:
+            self.in_flight -= 1
+            self.verify_count += 1
+            self.verify_total_ms += elapsed_ms
+            self.verify_max_ms = max(self.verify_max_ms, elapsed_ms)
+
+    def record_busy(self):
+        with self._lock:
+            self.busy_rejections += 1
+
+    def record_rehash(self):
+        with self._lock:
+            self.rehashed += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                'attempts': self.attempts,
+                'successes': self.successes,
+                'failures': self.failures,
+                'busy_rejections': self.busy_rejections,
+                'rehashed': self.rehashed,
+                'in_flight': self.in_flight,
+                'attempts_last_minute': len(self._recent),
+                'verify_avg_ms': round(self.verify_total_ms / self.verify_count, 1) if self.verify_count else 0.0,
+                'verify_max_ms': round(self.verify_max_ms, 1),
+                'hash_method': _current_method(),
+                'verify_workers': PASSWORD_VERIFY_WORKERS
+            }
+
+
+login_stats = LoginStats()
+
+_executor = None
+_executor_lock = threading.Lock()
+# 正在校验与排队中的请求总数上限
+_slots = threading.BoundedSemaphore(PASSWORD_VERIFY_WORKERS + PASSWORD_VERIFY_QUEUE_SIZE)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_VERIFY_WORKERS, thread_name_prefix='password-verify')
+        return _executor
+
+
+def verify_password(pwhash, password):
+    """
+    在有界线程池中校验密码
+
+    Returns:
+        tuple: (是否通过, 新哈希)，存储的哈希参数已过时则返回按当前策略计算的新哈希，否则为None
+
+    Raises:
+        LoginBusyError: 排队已满且等待超时
+    """
+    if not _slots.acquire(timeout=PASSWORD_VERIFY_TIMEOUT):
+        login_stats.record_busy()
+        raise LoginBusyError('登录请求较多，请稍后再试')
+
+    login_stats.begin_verify()
+    started = time.perf_counter()
+    try:
+        return _get_executor().submit(_verify_and_rehash, pwhash, password).result()
+    finally:
+        login_stats.end_verify((time.perf_counter() - started) * 1000)
+        _slots.release()
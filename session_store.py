@@ -0,0 +1,230 @@
+"""
+服务端会话模块 - 会话数据保存在服务端，Cookie中只保留短小的随机会话ID
+支持SQLite（多进程共享）和内存LRU（单进程）两种存储后端，按TTL过期淘汰
+"""
+
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# 过期会话清理的最小间隔（秒）
+PURGE_INTERVAL = 300
+
+_SID_PATTERN = re.compile(r'[A-Za-z0-9_-]{22}')
+
+_serializer = TaggedJSONSerializer()
+
+
+def new_session_id():
+    """生成128位随机会话ID（22个URL安全字符）"""
+    return secrets.token_urlsafe(16)
+
+
+class MemorySessionStore:
+    """内存会话存储：按最近使用顺序淘汰，仅适用于单进程部署"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        """返回 (数据, 过期时间)，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            data, expires_at, _ = entry
+            if expires_at <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return _serializer.loads(data), expires_at
+
+    def set(self, sid, data, expires_at, user_id=None):
+        with self._lock:
+            self._entries[sid] = (_serializer.dumps(data), expires_at, user_id)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def delete_for_user(self, user_id):
+        """删除某用户的全部会话（用户被禁用、删除或角色变更时调用）"""
+        with self._lock:
+            for sid in [sid for sid, entry in self._entries.items() if entry[2] == user_id]:
+                del self._entries[sid]
+
+
+class SQLiteSessionStore:
+    """SQLite会话存储：多个工作进程共享，定期清理过期会话"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._last_purge = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get(self, sid):
+        """返回 (数据, 过期时间)，不存在或已过期时返回None"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?',
+                               (sid, time.time())).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return _serializer.loads(row['data']), row['expires_at']
+
+    def set(self, sid, data, expires_at, user_id=None):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO sessions (id, data, user_id, expires_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        data = excluded.data,
+                        user_id = excluded.user_id,
+                        expires_at = excluded.expires_at
+                ''', (sid, _serializer.dumps(data), user_id, expires_at))
+                self._purge_expired(conn)
+        finally:
+            conn.close()
+
+    def delete(self, sid):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+        finally:
+            conn.close()
+
+    def delete_for_user(self, user_id):
+        """删除某用户的全部会话（用户被禁用、删除或角色变更时调用）"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+        finally:
+            conn.close()
+
+    def _purge_expired(self, conn):
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """服务端会话对象，修改时自动标记"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        """更换会话ID（登录时调用，防止会话固定攻击），数据保持不变"""
+        if self.sid and not self.previous_sid:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """将会话数据保存到服务端存储的 Flask SessionInterface"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_PATTERN.fullmatch(sid):
+            record = self.store.get(sid)
+            if record is not None:
+                data, expires_at = record
+                return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # 会话被清空：删除服务端记录和Cookie
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        # 未修改时只在剩余有效期不足一半时续期，减少写入
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        needs_refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not session.modified and not needs_refresh:
+            return
+
+        if session.sid is None:
+            session.sid = new_session_id()
+        session.expires_at = now + lifetime
+        self.store.set(session.sid, dict(session), session.expires_at, user_id=session.get('user_id'))
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+def create_session_store(backend, db_path=None, max_entries=10000):
+    """按配置创建会话存储：sqlite 或 memory"""
+    if backend == 'memory':
+        return MemorySessionStore(max_entries=max_entries)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(db_path)
+    raise ValueError(f'不支持的会话存储后端: {backend}')
+
+
+def invalidate_user_sessions(user_id):
+    """使某用户的全部会话失效，下次请求需重新登录"""
+    from flask import current_app
+
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        interface.store.delete_for_user(user_id)
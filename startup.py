@@ -0,0 +1,44 @@
+"""
+启动计时 - 记录应用启动各阶段耗时，启动完成后输出一条汇总日志
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """按阶段记录启动耗时"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.finished = None
+
+    @contextmanager
+    def phase(self, name):
+        """计时一个阶段；阶段内可通过 yield 出的字典补充说明"""
+        info = {}
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.phases.append({'name': name, 'ms': round((time.perf_counter() - started) * 1000, 1), **info})
+
+    def finish(self):
+        """结束计时并输出汇总"""
+        self.finished = time.perf_counter()
+        logger.info('启动完成，耗时 %.1fms（pid %d）: %s', self.total_ms, os.getpid(),
+                    ', '.join(f"{phase['name']} {phase['ms']}ms" for phase in self.phases),
+                    extra={'startup': self.as_dict()})
+
+    @property
+    def total_ms(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return round((end - self.started) * 1000, 1)
+
+    def as_dict(self):
+        return {'total_ms': self.total_ms, 'phases': list(self.phases)}
@@ -1,11 +1,19 @@
 /**
  * 承运公司选择框组件
  * 提供从数据库获取公司列表、搜索和选择功能
+ * 输入时调用 /api/companies?q= 在服务端按名称前缀、拼音首字母检索
  */
 
-// 公司数据缓存
+// 每次检索返回的候选数量
+const SEARCH_LIMIT = 20;
+// 输入防抖间隔（毫秒）
+const SEARCH_DELAY = 200;
+
+// 公司数据缓存：当前候选列表，以及已加载过的公司名称（用于校验）
 let companyCache = [];
+const knownCompanies = new Map();
 let currentSelectedCompany = '';
+let searchTimer = null;
 
 /**
  * 初始化公司选择框
@@ -30,15 +38,18 @@ export async function initializeCompanySelector(inputElementId) {
 
 /**
  * 从API加载公司数据
+ * @param {string} query - 检索词，为空时返回按名称排序的前若干条
  */
-async function loadCompanies() {
+async function loadCompanies(query = '') {
     try {
-        const response = await fetch('/api/companies');
+        const params = new URLSearchParams({ q: query, limit: SEARCH_LIMIT });
+        const response = await fetch(`/api/companies?${params}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const companies = await response.json();
         companyCache = companies;
+        companies.forEach(company => knownCompanies.set(company.name, company));
     } catch (error) {
         console.error('加载公司数据失败:', error);
     }
@@ -82,6 +93,15 @@ function addEventListeners(inputElement) {
     // 处理用户输入事件
     inputElement.addEventListener('input', function(event) {
         handleUserInput(inputElement, event.target.value);
+
+        // 防抖后按输入内容重新检索候选项
+        const query = event.target.value;
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(async () => {
+            await loadCompanies(query);
+            populateOptions(inputElement);
+            handleUserInput(inputElement, inputElement.value);
+        }, SEARCH_DELAY);
     });
     
     // 处理选择变化事件
@@ -97,7 +117,7 @@ function addEventListeners(inputElement) {
  */
 function handleUserInput(inputElement, inputValue) {
     // 查找完全匹配的公司（不区分大小写）
-    const matchedCompany = companyCache.find(company => 
+    const matchedCompany = Array.from(knownCompanies.values()).find(company => 
         company.name.toLowerCase() === inputValue.toLowerCase()
     );
     
@@ -129,10 +149,8 @@ export function validateCompanySelection() {
         return false;
     }
     
-    // 检查输入的公司是否在缓存中存在
-    const isValidCompany = companyCache.some(company => 
-        company.name === currentSelectedCompany
-    );
+    // 检查输入的公司是否在已加载的公司中存在
+    const isValidCompany = knownCompanies.has(currentSelectedCompany);
     
     if (!isValidCompany) {
         alert('请输入有效的委办承运公司');
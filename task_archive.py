@@ -0,0 +1,276 @@
+"""
+任务归档 - 把超过保留天数的已结束/已取消任务（含车辆与状态历史）移入独立的归档库
+归档库是按分析查询建好覆盖索引的只读SQLite文件，主库只保留在途和近期任务。
+分析查询先调用 open_archive 挂载归档库，再读取热表与归档表合并后的临时视图
+all_tasks / all_vehicles / all_status_history
+"""
+
+import logging
+import os
+from datetime import date, timedelta
+
+from backup_service import exclusive_operation
+from config import ARCHIVE_DATABASE
+from constants import DispatchStatus
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = 'archive'
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_PAGE_SIZE = 16384  # 归档库以顺序扫描为主，用较大的页减少IO次数
+ARCHIVABLE_STATUSES = (DispatchStatus.TASK_COMPLETED.value, DispatchStatus.TASK_CANCELLED.value)
+OPEN_EXCEPTION_STATUSES = ('待处理', '处理中')  # 有未处理对账异常的任务暂不归档
+
+# 主库表 -> (归档表, 合并视图)
+ARCHIVE_TABLES = {
+    'manual_dispatch_tasks': ('archived_tasks', 'all_tasks'),
+    'vehicles': ('archived_vehicles', 'all_vehicles'),
+    'dispatch_status_history': ('archived_status_history', 'all_status_history'),
+}
+
+# 在途库与归档库的 (任务表, 车辆表, 状态历史表)，供需要按任务关联车辆或状态历史的查询分别展开
+TASK_SOURCES = (('main.manual_dispatch_tasks', 'main.vehicles', 'main.dispatch_status_history'),
+                (f'{ARCHIVE_SCHEMA}.archived_tasks', f'{ARCHIVE_SCHEMA}.archived_vehicles',
+                 f'{ARCHIVE_SCHEMA}.archived_status_history'))
+
+# 归档库索引：结算、台账核对、按日统计都按 (日期, 状态) 范围扫描，索引覆盖所需列，无需回表
+ARCHIVE_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archived_tasks_id ON archived_tasks(task_id)',
+    '''CREATE INDEX IF NOT EXISTS archive.idx_archived_tasks_date ON archived_tasks(
+           required_date, status, carrier_company, transport_type, requirement_type, weight, volume, task_id)''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archived_tasks_carrier ON archived_tasks(carrier_company, required_date)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archived_vehicles_task ON archived_vehicles(task_id, actual_volume)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archived_history_task ON archived_status_history(task_id)',
+]
+
+# 创建时间也须早于截止日期：任务编号按创建当天已有任务数生成，当天的任务移走后编号会重复
+ARCHIVE_CANDIDATES_SQL = f'''
+    INSERT INTO temp.archive_batch (task_id)
+    SELECT t.task_id FROM main.manual_dispatch_tasks t
+    WHERE t.status IN ({', '.join('?' * len(ARCHIVABLE_STATUSES))}) AND t.required_date < ? AND t.created_at < ?
+      AND NOT EXISTS (SELECT 1 FROM main.reconciliation_exceptions e
+                      WHERE e.task_id = t.task_id AND e.status IN ({', '.join('?' * len(OPEN_EXCEPTION_STATUSES))}))
+    ORDER BY t.required_date
+    LIMIT ?
+'''
+
+TASK_COLUMNS = ['task_id', 'required_date', 'start_bureau', 'route_name', 'route_direction', 'carrier_company',
+                'transport_type', 'requirement_type', 'volume', 'weight', 'status', 'created_at']
+
+def archive_path(conn):
+    """归档库文件路径：优先使用配置，否则放在主库文件旁（主库为内存库时归档库也在内存中）"""
+    if ARCHIVE_DATABASE:
+        return ARCHIVE_DATABASE
+    main_file = next((row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main'), '')
+    if not main_file:
+        return ':memory:'
+    return f'{os.path.splitext(main_file)[0]}_archive.db'
+
+
+def _columns(conn, schema, table):
+    return [(row[1], row[2]) for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _ensure_schema(conn):
+    """按主库表结构创建或补齐归档表（主库新增列时归档表同步加列）"""
+    if not conn.execute(f'SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master LIMIT 1').fetchone():
+        conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.page_size = {ARCHIVE_PAGE_SIZE}')
+
+    for table, (archive_table, _) in ARCHIVE_TABLES.items():
+        columns = _columns(conn, 'main', table)
+        existing = {name for name, _ in _columns(conn, ARCHIVE_SCHEMA, archive_table)}
+        if not existing:
+            # 车辆与历史表沿用自增id作为rowid，归档任务表按归档顺序（用车日期）存放
+            definitions = [f'{name} {col_type} PRIMARY KEY' if name == 'id' else f'{name} {col_type}'
+                           for name, col_type in columns]
+            if table == 'manual_dispatch_tasks':
+                definitions.append('archived_at TEXT')
+            conn.execute(f"CREATE TABLE {ARCHIVE_SCHEMA}.{archive_table} ({', '.join(definitions)})")
+            continue
+        for name, col_type in columns:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE {ARCHIVE_SCHEMA}.{archive_table} ADD COLUMN {name} {col_type}')
+
+    for sql in ARCHIVE_INDEXES:
+        conn.execute(sql)
+
+
+def open_archive(conn):
+    """
+    在连接上挂载归档库，并创建热表与归档表合并的临时视图（同一连接重复调用直接返回）
+    ATTACH 不能在事务中执行，需在写操作之前调用
+
+    视图比主库表多一列 archived（0 在途/近期，1 已归档）
+    """
+    if any(row[1] == ARCHIVE_SCHEMA for row in conn.execute('PRAGMA database_list')):
+        return
+    if conn.in_transaction:
+        raise RuntimeError('不能在事务中挂载归档库，请先提交或回滚')
+
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (archive_path(conn),))
+    with conn:
+        _ensure_schema(conn)
+    for table, (archive_table, view) in ARCHIVE_TABLES.items():
+        column_list = ', '.join(name for name, _ in _columns(conn, 'main', table))
+        conn.execute(f'DROP VIEW IF EXISTS temp.{view}')
+        conn.execute(f'''
+            CREATE TEMP VIEW {view} AS
+            SELECT {column_list}, 0 AS archived FROM main.{table}
+            UNION ALL
+            SELECT {column_list}, 1 AS archived FROM {ARCHIVE_SCHEMA}.{archive_table}
+        ''')
+
+
+def union_sources(template, **kwargs):
+    """
+    把按 {tasks}、{vehicles}、{history} 书写的查询分别展开到在途库和归档库后 UNION ALL，参数需按库各传一遍
+    合并视图上按任务编号关联车辆的子查询无法使用索引（会先物化整个视图），关联车辆的查询改用本函数
+    """
+    return '\nUNION ALL\n'.join(template.format(tasks=tasks, vehicles=vehicles, history=history, **kwargs)
+                                 for tasks, vehicles, history in TASK_SOURCES)
+
+
+def _move_batch(conn, columns, archived_at):
+    """把 temp.archive_batch 中的任务复制到归档库并从主库删除（在调用方的事务中执行）"""
+    for table, (archive_table, _) in ARCHIVE_TABLES.items():
+        column_list = ', '.join(columns[table])
+        if table == 'manual_dispatch_tasks':
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.{archive_table} ({column_list}, archived_at)
+                SELECT {column_list}, ? FROM main.{table}
+                WHERE task_id IN (SELECT task_id FROM temp.archive_batch)
+                ORDER BY required_date
+            ''', (archived_at,))
+        else:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.{archive_table} ({column_list})
+                SELECT {column_list} FROM main.{table}
+                WHERE task_id IN (SELECT task_id FROM temp.archive_batch)
+            ''')
+
+    # 先删子表再删任务；已归档任务不再参与异常复核
+    for table in ('dispatch_status_history', 'vehicles', 'manual_dispatch_tasks', 'exception_dirty_tasks'):
+        conn.execute(f'DELETE FROM main.{table} WHERE task_id IN (SELECT task_id FROM temp.archive_batch)')
+
+
+def archive_tasks(conn, retention_days, batch_size=ARCHIVE_BATCH_SIZE, progress_callback=None):
+    """
+    归档用车日期早于 retention_days 天前的已结束/已取消任务，每批单独提交
+    归档库以 ATTACH 挂载在同一连接上，复制与删除在同一事务中完成，中途失败不会丢失或重复数据
+
+    结算台账、对账匹配结果等按任务编号引用任务（不设外键），归档后通过合并视图仍可关联；
+    车辆和状态历史与任务一起移动，移动期间保持外键检查，主库中不会留下引用已归档任务的记录；
+    同一进程内与备份、恢复互斥，其他进程的归档由备份在复制后对齐（见 backup_service）
+
+    Returns:
+        dict: {'archived': 归档任务数, 'cutoff': 截止日期}
+    """
+    if retention_days < 0:
+        raise ValueError('保留天数不能为负数')
+    cutoff = (date.today() - timedelta(days=retention_days)).isoformat()
+    with exclusive_operation():
+        archived = _archive_before(conn, cutoff, batch_size, progress_callback)
+
+    if archived:
+        conn.execute(f'ANALYZE {ARCHIVE_SCHEMA}')
+        logger.info(f'已归档 {archived} 个任务（用车日期早于 {cutoff}）')
+    return {'archived': archived, 'cutoff': cutoff}
+
+
+def _archive_before(conn, cutoff, batch_size, progress_callback):
+    """分批归档用车日期早于 cutoff 的任务，返回归档任务数"""
+    open_archive(conn)
+    columns = {table: [name for name, _ in _columns(conn, 'main', table)] for table in ARCHIVE_TABLES}
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (task_id TEXT PRIMARY KEY)')
+
+    archived = 0
+    while True:
+        archived_at = conn.execute("SELECT datetime('now', 'localtime')").fetchone()[0]
+        with conn:
+            conn.execute('DELETE FROM temp.archive_batch')
+            count = conn.execute(ARCHIVE_CANDIDATES_SQL, [*ARCHIVABLE_STATUSES, cutoff, cutoff,
+                                                          *OPEN_EXCEPTION_STATUSES, batch_size]).rowcount
+            if count:
+                _move_batch(conn, columns, archived_at)
+        archived += count
+        if progress_callback:
+            progress_callback(archived)
+        if count < batch_size:
+            break
+    return archived
+
+
+def archive_job(context, retention_days, batch_size=ARCHIVE_BATCH_SIZE):
+    """后台任务：归档历史任务"""
+    result = archive_tasks(
+        context.conn, retention_days, batch_size,
+        progress_callback=lambda done: context.update_progress(done, message=f'已归档{done}个任务')
+    )
+    context.update_progress(result['archived'], result['archived'],
+                            message=f"已归档{result['archived']}个任务", force=True)
+    return result
+
+
+def get_archive_stats(conn):
+    """在途与归档任务数量、归档库的日期范围与文件大小"""
+    open_archive(conn)
+    hot_count = conn.execute('SELECT COUNT(*) FROM main.manual_dispatch_tasks').fetchone()[0]
+    archived_count, date_from, date_to, last_archived_at = conn.execute(f'''
+        SELECT COUNT(*), MIN(required_date), MAX(required_date), MAX(archived_at)
+        FROM {ARCHIVE_SCHEMA}.archived_tasks
+    ''').fetchone()
+    path = archive_path(conn)
+    return {
+        'hot_count': hot_count,
+        'archived_count': archived_count,
+        'archived_from': date_from,
+        'archived_to': date_to,
+        'last_archived_at': last_archived_at,
+        'archive_size': os.path.getsize(path) if os.path.exists(path) else 0
+    }
+
+
+def search_tasks(conn, date_from, date_to, carrier=None, status=None, task_id=None, page=1, per_page=20):
+    """
+    在在途与已归档任务中查询（用车日期范围必填，避免全表扫描）
+
+    Args:
+        date_to (str): 截止日期（含）
+    """
+    open_archive(conn)
+    end = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+    where = ['required_date >= ?', 'required_date < ?']
+    params = [date_from, end]
+    for column, value in (('carrier_company', carrier), ('status', status)):
+        if value:
+            where.append(f'{column} = ?')
+            params.append(value)
+    if task_id:
+        where.append('task_id LIKE ?')
+        params.append(f'%{task_id}%')
+    where_sql = ' AND '.join(where)
+
+    total = conn.execute(f'SELECT COUNT(*) FROM all_tasks WHERE {where_sql}', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT {', '.join(TASK_COLUMNS)}, archived FROM all_tasks
+        WHERE {where_sql}
+        ORDER BY required_date DESC, task_id
+        LIMIT ? OFFSET ?
+    ''', [*params, per_page, (page - 1) * per_page])
+    return {'list': [dict(zip([*TASK_COLUMNS, 'archived'], row)) for row in rows], 'total': total}
+
+
+def get_task_detail(conn, task_id):
+    """任务（含车辆与状态历史），不区分是否已归档；不存在时返回None"""
+    open_archive(conn)
+    cursor = conn.execute('SELECT * FROM all_tasks WHERE task_id = ?', (task_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    task = dict(zip([d[0] for d in cursor.description], row))
+
+    for key, view, order in (('vehicles', 'all_vehicles', 'id'), ('status_history', 'all_status_history', 'id')):
+        cursor = conn.execute(f'SELECT * FROM {view} WHERE task_id = ? ORDER BY {order}', (task_id,))
+        names = [d[0] for d in cursor.description]
+        task[key] = [dict(zip(names, item)) for item in cursor]
+    return task